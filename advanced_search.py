@@ -6,6 +6,9 @@ Filtros múltiples, búsqueda inteligente y ordenamiento avanzado
 
 import os
 import sys
+import threading
+from collections import Counter
+from contextlib import nullcontext
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from sqlalchemy import and_, or_, func, desc, asc
@@ -13,24 +16,61 @@ from sqlalchemy import and_, or_, func, desc, asc
 # Agregar el directorio actual al path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from flask import url_for
-from app import create_app
+from flask import current_app, has_app_context, url_for
 from app.extensions import db
-from app.models import Toy, Order, OrderItem
+from app.models import Toy, ToyPopularity
+from app.utils.catalog import get_catalog_snapshot
+from app.utils.popularity import popularity_for
+from app.utils.facets import compute_facets
+from app.utils.search_index import ranked_subquery, search_toy_ids
 from cache_system import ToyCache, cached
 
 class AdvancedSearchEngine:
     """Motor de búsqueda avanzada para juguetes"""
     
-    def __init__(self):
-        self.app = create_app()
-        
-        # Configuración de filtros disponibles
-        self.available_filters = {
+    EXTENSION_KEY = 'advanced_search'
+
+    def __init__(self, app=None):
+        self.app = None
+        # Metadatos de facetas/filtros: (snapshot del catálogo, datos) calculados bajo demanda
+        self._metadata = None
+        self._metadata_lock = threading.Lock()
+
+        # Opciones de ordenamiento
+        self.sort_options = {
+            'relevance': {'label': 'Relevancia', 'default': True},
+            'name_asc': {'label': 'Nombre A-Z'},
+            'name_desc': {'label': 'Nombre Z-A'},
+            'price_asc': {'label': 'Precio menor a mayor'},
+            'price_desc': {'label': 'Precio mayor a menor'},
+            'newest': {'label': 'Más recientes'},
+            'popular': {'label': 'Más populares'},
+            'stock_desc': {'label': 'Mayor stock'}
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Registrar el motor como servicio de la aplicación"""
+        self.app = app
+        app.extensions.setdefault(self.EXTENSION_KEY, self)
+
+    def _app_context(self):
+        """Reutilizar el contexto activo; solo se crea uno fuera de Flask (scripts)"""
+        if has_app_context() or self.app is None:
+            return nullcontext()
+        return self.app.app_context()
+
+    @property
+    def available_filters(self) -> Dict:
+        """Configuración de filtros disponibles (opciones según el catálogo actual)"""
+        metadata = self._get_metadata()
+        return {
             'category': {
                 'type': 'select',
                 'label': 'Categoría',
-                'options': self._get_categories()
+                'options': metadata['categories']
             },
             'price_min': {
                 'type': 'number',
@@ -49,83 +89,51 @@ class AdvancedSearchEngine:
             'on_sale': {
                 'type': 'checkbox',
                 'label': 'En oferta'
-            }
-        }
-
-        # Agregar filtros para nuevas columnas del item (Toy)
-        # - age_range (rango de edad)
-        # - gender (mapea a Toy.gender_category)
-        self.available_filters.update({
+            },
+            # Filtros para columnas del item (Toy): age_range y gender (Toy.gender_category)
             'age_range': {
                 'type': 'select',
                 'label': 'Rango de edad',
-                'options': self._get_age_ranges()
+                'options': metadata['age_ranges']
             },
             'gender': {
                 'type': 'select',
-                'label': 'Gnero',
-                'options': self._get_gender_categories()
+                'label': 'Género',
+                'options': metadata['genders']
             }
-        })
-
-        # Opciones de ordenamiento
-        self.sort_options = {
-            'relevance': {'label': 'Relevancia', 'default': True},
-            'name_asc': {'label': 'Nombre A-Z'},
-            'name_desc': {'label': 'Nombre Z-A'},
-            'price_asc': {'label': 'Precio menor a mayor'},
-            'price_desc': {'label': 'Precio mayor a menor'},
-            'newest': {'label': 'Más recientes'},
-            'popular': {'label': 'Más populares'},
-            'stock_desc': {'label': 'Mayor stock'}
         }
-    
+
+    def _get_metadata(self) -> Dict[str, List[Dict]]:
+        """Conteos por categoría/edad/género, recalculados solo cuando cambia el catálogo"""
+        with self._app_context():
+            snapshot = get_catalog_snapshot()
+            cached_metadata = self._metadata
+            if cached_metadata is not None and cached_metadata[0] is snapshot:
+                return cached_metadata[1]
+
+            with self._metadata_lock:
+                cached_metadata = self._metadata
+                if cached_metadata is None or cached_metadata[0] is not snapshot:
+                    metadata = {
+                        'categories': _count_options(snapshot.toys, 'category'),
+                        'age_ranges': _count_options(snapshot.toys, 'age_range'),
+                        'genders': _count_options(snapshot.toys, 'gender_category'),
+                    }
+                    cached_metadata = (snapshot, metadata)
+                    self._metadata = cached_metadata
+                return cached_metadata[1]
+
     def _get_categories(self) -> List[Dict]:
         """Obtener categorías disponibles"""
-        with self.app.app_context():
-            categories = db.session.query(
-                Toy.category,
-                func.count(Toy.id).label('count')
-            ).filter(
-                Toy.is_active == True
-            ).group_by(Toy.category).all()
-            
-            return [
-                {'value': cat.category, 'label': cat.category, 'count': cat.count}
-                for cat in categories if cat.category
-            ]
-    
+        return self._get_metadata()['categories']
+
     def _get_age_ranges(self) -> List[Dict]:
         """Obtener rangos de edad disponibles desde Toy.age_range"""
-        with self.app.app_context():
-            age_ranges = db.session.query(
-                Toy.age_range,
-                func.count(Toy.id).label('count')
-            ).filter(
-                Toy.is_active == True,
-                Toy.age_range.isnot(None)
-            ).group_by(Toy.age_range).all()
-
-            return [
-                {'value': ar.age_range, 'label': ar.age_range, 'count': ar.count}
-                for ar in age_ranges if ar.age_range
-            ]
+        return self._get_metadata()['age_ranges']
 
     def _get_gender_categories(self) -> List[Dict]:
-        """Obtener categoras de gnero disponibles desde Toy.gender_category"""
-        with self.app.app_context():
-            genders = db.session.query(
-                Toy.gender_category,
-                func.count(Toy.id).label('count')
-            ).filter(
-                Toy.is_active == True,
-                Toy.gender_category.isnot(None)
-            ).group_by(Toy.gender_category).all()
-
-            return [
-                {'value': g.gender_category, 'label': g.gender_category, 'count': g.count}
-                for g in genders if g.gender_category
-            ]
+        """Obtener categorías de género disponibles desde Toy.gender_category"""
+        return self._get_metadata()['genders']
 
     def _get_age_groups(self) -> List[Dict]:
         """Obtener grupos de edad disponibles"""
@@ -160,12 +168,16 @@ class AdvancedSearchEngine:
         if cached_result:
             return cached_result
         
-        with self.app.app_context():
+        with self._app_context():
             # Construir query base
             query_obj = Toy.query.filter(Toy.is_active == True)
             
-            # Aplicar filtros de texto
-            if query.strip():
+            # Aplicar filtros de texto: índice FTS5 con ranking bm25 si existe,
+            # si no, coincidencia ilike por término (todas las palabras requeridas)
+            ranking = ranked_subquery(query) if query.strip() else None
+            if ranking is not None:
+                query_obj = query_obj.join(ranking, ranking.c.toy_id == Toy.id)
+            elif query.strip():
                 search_terms = query.strip().split()
                 text_conditions = []
                 
@@ -175,11 +187,7 @@ class AdvancedSearchEngine:
                         Toy.description.ilike(f"%{term}%"),
                         Toy.category.ilike(f"%{term}%")
                     ]
-                    'image_url': (
-                        url_for('static', filename=toy.image_url)
-                        if toy.image_url
-                        else url_for('static', filename='images/toys/default_toy.png')
-                    ),
+                    text_conditions.append(or_(*term_conditions))
                 
                 if text_conditions:
                     query_obj = query_obj.filter(and_(*text_conditions))
@@ -187,19 +195,26 @@ class AdvancedSearchEngine:
             # Aplicar filtros específicos
             query_obj = self._apply_filters(query_obj, filters)
             
-            # Aplicar ordenamiento
-            query_obj = self._apply_sorting(query_obj, sort_by, query)
-            
             # Obtener total de resultados
             total = query_obj.count()
             
+            # Aplicar ordenamiento
+            query_obj = self._apply_sorting(query_obj, sort_by, query, ranking)
+            if ranking is not None:
+                query_obj = query_obj.add_columns(ranking.c.rank)
+            
             # Aplicar paginación
             offset = (page - 1) * per_page
-            toys = query_obj.offset(offset).limit(per_page).all()
+            rows = query_obj.offset(offset).limit(per_page).all()
+            
+            # Popularidad de toda la página en una sola consulta
+            page_toys = [row[0] if ranking is not None else row for row in rows]
+            popularity = popularity_for(toy.id for toy in page_toys)
             
             # Convertir a diccionarios
             results = []
-            for toy in toys:
+            for row in rows:
+                toy, rank = (row[0], row[1]) if ranking is not None else (row, None)
                 toy_data = {
                     'id': toy.id,
                     'name': toy.name,
@@ -207,14 +222,18 @@ class AdvancedSearchEngine:
                     'price': float(toy.price),
                     'stock': toy.stock,
                     'category': toy.category,
-                    'image_url': url_for('static', filename=toy.image_url),
+                    'image_url': (
+                        url_for('static', filename=toy.image_url)
+                        if toy.image_url
+                        else url_for('static', filename='images/toys/default_toy.png')
+                    ),
                     'is_on_sale': toy.price < toy.original_price if hasattr(toy, 'original_price') else False,
-                    'popularity_score': self._calculate_popularity(toy.id)
+                    'popularity_score': float(popularity.get(toy.id, 0))
                 }
                 
-                # Calcular relevancia si hay búsqueda por texto
-                if query.strip():
-                    toy_data['relevance_score'] = self._calculate_relevance(toy, query)
+                # Relevancia bm25 (mayor es mejor) si hay búsqueda por texto
+                if rank is not None:
+                    toy_data['relevance_score'] = round(-rank, 4)
                 
                 results.append(toy_data)
             
@@ -243,7 +262,7 @@ class AdvancedSearchEngine:
                     'search_time': datetime.now().isoformat(),
                     'cache_hit': False
                 },
-                'facets': self._generate_facets(filters)
+                'facets': self._generate_facets(filters, query)
             }
             
             # Cachear resultado
@@ -285,7 +304,7 @@ class AdvancedSearchEngine:
         
         return query_obj
     
-    def _apply_sorting(self, query_obj, sort_by: str, search_query: str = ""):
+    def _apply_sorting(self, query_obj, sort_by: str, search_query: str = "", ranking=None):
         """Aplicar ordenamiento a la consulta"""
         
         if sort_by == 'name_asc':
@@ -301,21 +320,18 @@ class AdvancedSearchEngine:
         elif sort_by == 'stock_desc':
             return query_obj.order_by(desc(Toy.stock))
         elif sort_by == 'popular':
-            # Ordenar por popularidad (requiere subconsulta)
-            popularity_subquery = db.session.query(
-                OrderItem.toy_id,
-                func.sum(OrderItem.quantity).label('total_sold')
-            ).join(Order).filter(
-                Order.is_active == True
-            ).group_by(OrderItem.toy_id).subquery()
-            
-            query_obj = query_obj.outerjoin(
-                popularity_subquery,
-                Toy.id == popularity_subquery.c.toy_id
-            ).order_by(desc(popularity_subquery.c.total_sold))
-            
-            return query_obj
+            # Ordenar por popularidad materializada (toy_popularity)
+            return query_obj.outerjoin(
+                ToyPopularity,
+                Toy.id == ToyPopularity.toy_id
+            ).order_by(
+                desc(func.coalesce(ToyPopularity.total_sold, 0)),
+                desc(Toy.created_at)
+            )
         else:  # relevance o default
+            if ranking is not None:
+                # bm25: menor valor = más relevante
+                return query_obj.order_by(asc(ranking.c.rank), desc(Toy.created_at))
             if search_query.strip():
                 # Para relevancia, ordenar por coincidencias en nombre primero
                 return query_obj.order_by(
@@ -325,103 +341,27 @@ class AdvancedSearchEngine:
             else:
                 return query_obj.order_by(desc(Toy.created_at))
     
-    def _calculate_relevance(self, toy, query: str) -> float:
-        """Calcular score de relevancia para un juguete"""
-        score = 0.0
-        query_lower = query.lower()
+    def _generate_facets(self, current_filters: Dict, query: str = "") -> Dict:
+        """Generar facetas para refinamiento de búsqueda
         
-        # Coincidencia exacta en nombre (peso alto)
-        if query_lower in toy.name.lower():
-            score += 10.0
-        
-        # Coincidencia en descripción
-        if toy.description and query_lower in toy.description.lower():
-            score += 5.0
-        
-        # Coincidencia en categoría
-        if toy.category and query_lower in toy.category.lower():
-            score += 3.0
-        
-        # Bonus por stock disponible
-        if toy.stock > 0:
-            score += 1.0
-        
-        # Bonus por popularidad
-        score += self._calculate_popularity(toy.id) * 0.1
-        
-        return round(score, 2)
-    
-    def _calculate_popularity(self, toy_id: int) -> float:
-        """Calcular score de popularidad basado en ventas"""
-        try:
-            total_sold = db.session.query(
-                func.sum(OrderItem.quantity)
-            ).join(Order).filter(
-                OrderItem.toy_id == toy_id,
-                Order.is_active == True
-            ).scalar() or 0
-            
-            return float(total_sold)
-        except:
-            return 0.0
-    
-    def _generate_facets(self, current_filters: Dict) -> Dict:
-        """Generar facetas para refinamiento de búsqueda"""
-        facets = {}
-        
-        # Facetas de categorías
-        categories = self._get_categories()
-        facets['categories'] = [
-            {
-                'value': cat['value'],
-                'label': cat['label'],
-                'count': cat['count'],
-                'active': current_filters.get('category') == cat['value']
-            }
-            for cat in categories
-        ]
-        
-        # Facetas de rangos de edad
-        age_ranges = self._get_age_ranges()
-        facets['age_ranges'] = [
-            {
-                'value': ar['value'],
-                'label': ar['label'],
-                'count': ar['count'],
-                'active': current_filters.get('age_range') == ar['value']
-            }
-            for ar in age_ranges
-        ]
-
-        # Facetas de gnero
-        genders = self._get_gender_categories()
-        facets['genders'] = [
-            {
-                'value': g['value'],
-                'label': g['label'],
-                'count': g['count'],
-                'active': (current_filters.get('gender') or current_filters.get('gender_category')) == g['value']
-            }
-            for g in genders
-        ]
-
-        # Rangos de precio sugeridos
-        facets['price_ranges'] = [
-            {'label': 'Menos de $10', 'min': 0, 'max': 10},
-            {'label': '$10 - $25', 'min': 10, 'max': 25},
-            {'label': '$25 - $50', 'min': 25, 'max': 50},
-            {'label': '$50 - $100', 'min': 50, 'max': 100},
-            {'label': 'Más de $100', 'min': 100, 'max': None}
-        ]
-        
-        return facets
+        Los conteos se calculan en una sola pasada sobre el snapshot del
+        catálogo y reflejan la búsqueda y los demás filtros activos.
+        """
+        snapshot = get_catalog_snapshot()
+        matched_ids = search_toy_ids(query) if query.strip() else None
+        return compute_facets(
+            snapshot.toys,
+            current_filters,
+            ids=set(matched_ids) if matched_ids is not None else None,
+            text=query if matched_ids is None else None,
+        )
     
     def get_suggestions(self, partial_query: str, limit: int = 5) -> List[str]:
         """Obtener sugerencias de autocompletado"""
         if len(partial_query) < 2:
             return []
         
-        with self.app.app_context():
+        with self._app_context():
             # Buscar en nombres de juguetes
             suggestions = db.session.query(Toy.name).filter(
                 Toy.is_active == True,
@@ -432,12 +372,12 @@ class AdvancedSearchEngine:
     
     def get_popular_searches(self, limit: int = 10) -> List[Dict]:
         """Obtener búsquedas populares basadas en categorías más vendidas"""
-        with self.app.app_context():
+        with self._app_context():
             popular = db.session.query(
                 Toy.category,
-                func.sum(OrderItem.quantity).label('total_sold')
-            ).join(OrderItem).join(Order).filter(
-                Order.is_active == True,
+                func.sum(ToyPopularity.total_sold).label('total_sold')
+            ).join(ToyPopularity, ToyPopularity.toy_id == Toy.id).filter(
+                ToyPopularity.total_sold > 0,
                 Toy.is_active == True
             ).group_by(Toy.category).order_by(
                 desc('total_sold')
@@ -452,9 +392,27 @@ class AdvancedSearchEngine:
                 for cat in popular if cat.category
             ]
 
-def create_search_interface_data() -> Dict:
+def _count_options(toys, attribute: str) -> List[Dict]:
+    """Opciones de filtro con conteo a partir del snapshot del catálogo"""
+    counts = Counter(getattr(toy, attribute) for toy in toys)
+    return [
+        {'value': value, 'label': value, 'count': count}
+        for value, count in sorted(counts.items(), key=lambda item: item[0] or '')
+        if value
+    ]
+
+def get_search_engine(app=None) -> AdvancedSearchEngine:
+    """Motor de búsqueda de la aplicación (se crea una vez y se reutiliza)"""
+    app = app or current_app._get_current_object()
+    engine = app.extensions.get(AdvancedSearchEngine.EXTENSION_KEY)
+    if engine is None:
+        AdvancedSearchEngine(app)
+        engine = app.extensions[AdvancedSearchEngine.EXTENSION_KEY]
+    return engine
+
+def create_search_interface_data(engine: Optional[AdvancedSearchEngine] = None) -> Dict:
     """Crear datos para la interfaz de búsqueda avanzada"""
-    engine = AdvancedSearchEngine()
+    engine = engine or get_search_engine()
     
     return {
         'filters': engine.available_filters,
@@ -475,7 +433,8 @@ def test_search_engine():
     print("🔍 PROBANDO MOTOR DE BÚSQUEDA AVANZADA")
     print("=" * 50)
     
-    engine = AdvancedSearchEngine()
+    from app import create_app
+    engine = AdvancedSearchEngine(create_app())
     
     # Test 1: Búsqueda simple
     print("📝 Test 1: Búsqueda simple...")
@@ -521,7 +480,9 @@ def main():
     print("=" * 55)
     
     # Crear datos de interfaz
-    interface_data = create_search_interface_data()
+    from app import create_app
+    engine = AdvancedSearchEngine(create_app())
+    interface_data = create_search_interface_data(engine)
     
     print("📋 Filtros disponibles:")
     for key, filter_config in interface_data['filters'].items():
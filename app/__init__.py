@@ -9,12 +9,21 @@ from datetime import datetime
 from flask import Flask, request, session, redirect, url_for
 from flask_login import LoginManager, current_user
 from flask_wtf.csrf import CSRFProtect
-from flask_caching import Cache
 
 # Extensiones compartidas
 from .extensions import db, migrate, login_manager
-from .db_maintenance import ensure_order_table_columns
-from .utils.centers import collect_center_choices
+from .db_maintenance import (
+    ensure_order_indexes,
+    ensure_order_item_table_columns,
+    ensure_order_table_columns,
+    ensure_toy_table_columns,
+)
+from .utils.centers import get_center_registry
+from .utils.search_index import ensure_search_index
+from .utils.popularity import ensure_popularity_table
+from .utils.rollups import ensure_rollups, rollups_cli
+from .utils.analytics_export import analytics_cli
+from .utils.cart_store import get_cart_store, init_cart_store
 
 # Modelos y utilidades
 from . import models as models  # register once; access via models.User / models.Toy
@@ -22,7 +31,6 @@ from .security import secure_headers, log_security_event  # validate_session no
 
 # Inicializadores locales (no crear nuevas instancias globales de db/migrate aquí)
 csrf = CSRFProtect()
-cache = Cache()
 
 # Flask-Login: configuración base
 login_manager.login_view = 'auth.login'
@@ -135,18 +143,23 @@ def create_app(config_class=None):
     login_manager.init_app(app)
     csrf.init_app(app)
 
-    # Cache/Redis: usar Redis si existe, si no SimpleCache (evita warnings en dev)
+    # Redis para la cola de tareas (rq), si está disponible
     try:
         from redis import Redis
         import rq
         app.redis = Redis.from_url(app.config['REDIS_URL'])
         app.task_queue = rq.Queue('aloha-tasks', connection=app.redis)
-        cache.init_app(app, config={'CACHE_TYPE': 'redis', 'CACHE_REDIS_URL': app.config['REDIS_URL']})
     except Exception as e:
-        print("⚠️ No Redis; usando SimpleCache:", e)
+        print("⚠️ No Redis; sin cola de tareas:", e)
         app.redis = None
         app.task_queue = None
-        cache.init_app(app, config={'CACHE_TYPE': 'SimpleCache'})
+
+    # Cache de dos niveles (L1 en memoria + Redis o SQLite compartido)
+    try:
+        from cache_system import init_app as init_cache
+        init_cache(app)
+    except Exception as e:
+        app.logger.warning("No se pudo configurar el cache compartido: %s", e)
 
     # -------- Middleware de seguridad (migrado desde app/app.py) --------
     @app.before_request
@@ -156,7 +169,7 @@ def create_app(config_class=None):
             return
 
         # rutas públicas
-        public_routes = ['auth.login', 'auth.register', 'shop.index', 'shop.search', 'static']
+        public_routes = ['auth.login', 'auth.register', 'shop.index', 'shop.search', 'shop.search_page', 'static']
 
         # permitir rutas públicas
         if request.endpoint and request.endpoint in public_routes:
@@ -213,6 +226,10 @@ def create_app(config_class=None):
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(user_bp, url_prefix='/user')
 
+    # Comandos CLI: flask rollups rebuild|verify
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(analytics_cli)
+
     # -------- Filtros / globals para Jinja --------
     # Mantener tus filtros de .filters si existen
     try:
@@ -229,29 +246,32 @@ def create_app(config_class=None):
     # Exponer get_toy globalmente (lo tenías en app/app.py)
     app.jinja_env.globals.update(get_toy=get_toy)
 
+    # Carrito del lado del servidor (migra carritos antiguos en cookie)
+    init_cart_store(app)
+
     # Context processor global para cart_count (ya lo tenías)
     @app.context_processor
     def inject_cart_count():
+        # Conteo acumulado del carrito del lado del servidor (sin sumar líneas)
         cart_count = 0
-        if 'cart' in session and isinstance(session['cart'], dict):
-            cart_count = sum(item.get('quantity', 0) for item in session['cart'].values())
+        try:
+            if current_user.is_authenticated:
+                cart_count = get_cart_store().summary(current_user.id).count
+        except Exception:
+            cart_count = 0
         return dict(cart_count=cart_count)
 
     @app.context_processor
     def inject_centers():
+        # Registro en memoria con TTL: sin consultas por plantilla renderizada
         try:
-            centers = models.Center.query.order_by(models.Center.name.asc()).all()
-        except Exception:
-            centers = []
-        try:
-            center_choices, centers_map = collect_center_choices()
+            registry = get_center_registry()
         except Exception:
-            center_choices = []
-            centers_map = {}
+            return {'all_centers': [], 'center_choices': [], 'centers_by_slug': {}}
         return {
-            'all_centers': centers,
-            'center_choices': center_choices,
-            'centers_by_slug': centers_map,
+            'all_centers': registry.centers,
+            'center_choices': registry.choices,
+            'centers_by_slug': registry.by_slug,
         }
 
     # -------- Manejadores de error --------
@@ -306,6 +326,9 @@ def create_app(config_class=None):
     with app.app_context():
         db.create_all()
         ensure_order_table_columns()
+        ensure_order_item_table_columns()
+        ensure_toy_table_columns()
+        ensure_order_indexes()
         # Asegurar columna para forzar cambio de contraseña en usuarios existente
         try:
             from sqlalchemy import inspect, text
@@ -320,6 +343,23 @@ def create_app(config_class=None):
         except Exception:
             # Ignorar si no aplica (primera creación o SQLite limitado)
             pass
+        # Índice full-text de juguetes (FTS5); se rellena si está desfasado
+        try:
+            ensure_search_index()
+        except Exception as e:
+            app.logger.warning(f"No se pudo preparar el índice de búsqueda: {e}")
+        # Popularidad materializada por juguete; se reconstruye si está vacía
+        try:
+            ensure_popularity_table()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"No se pudo preparar la tabla de popularidad: {e}")
+        # Ventas diarias para el dashboard; se reconstruyen si están vacías
+        try:
+            ensure_rollups()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"No se pudieron preparar las tablas de ventas diarias: {e}")
 
     # Debug: ver a qué DB apunta
     try:
@@ -26,6 +26,41 @@ class Config:
 
     # PDF/Receipt assets
     PDF_LOGO_PATH = os.environ.get('PDF_LOGO_PATH')
+    # Recibos PDF ya generados (por defecto instance/receipts)
+    RECEIPT_CACHE_DIR = os.environ.get('RECEIPT_CACHE_DIR')
+
+    # Tareas tras el checkout (recibo PDF + resumen en orders/): auto, rq, thread, eager u off
+    ORDER_JOBS_MODE = os.environ.get('ORDER_JOBS_MODE')
+    ORDER_JOBS_WORKERS = int(os.environ.get('ORDER_JOBS_WORKERS', '2'))
+    ORDER_SUMMARY_DIR = os.environ.get('ORDER_SUMMARY_DIR')
+
+    # Catalog snapshot (segundos antes de reconstruir aunque no haya invalidación local)
+    CATALOG_SNAPSHOT_TTL = int(os.environ.get('CATALOG_SNAPSHOT_TTL', '60'))
+
+    # Registro de centros para plantillas/formularios (segundos; se invalida al editar centros)
+    CENTER_REGISTRY_TTL = int(os.environ.get('CENTER_REGISTRY_TTL', '300'))
+
+    # Carrito del lado del servidor: auto (Redis si responde, si no SQL), redis, sql o memory
+    CART_STORE_BACKEND = os.environ.get('CART_STORE_BACKEND', 'auto')
+    CART_STORE_TTL = int(os.environ.get('CART_STORE_TTL', str(30 * 24 * 3600)))
+
+    # Cache de dos niveles (cache_system): L2 auto (Redis si responde, si no SQLite), redis, sqlite o none;
+    # el L1 en memoria de cada worker guarda como máximo CACHE_L1_TTL segundos (por defecto 30 con Redis, 5 con SQLite)
+    CACHE_L2_BACKEND = os.environ.get('CACHE_L2_BACKEND')
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH')
+    CACHE_L1_TTL = float(os.environ['CACHE_L1_TTL']) if os.environ.get('CACHE_L1_TTL') else None
+    # Serialización de los valores cacheados: auto (msgpack si está instalado), msgpack o json; zlib por encima del umbral (bytes)
+    CACHE_SERIALIZER = os.environ.get('CACHE_SERIALIZER', 'auto')
+    CACHE_COMPRESS_THRESHOLD = int(os.environ.get('CACHE_COMPRESS_THRESHOLD', '1024'))
+    
+    # Pronóstico de reabastecimiento: ventana (días), método (mean o ewma) y vida media de la EWMA
+    INVENTORY_FORECAST_WINDOW = int(os.environ.get('INVENTORY_FORECAST_WINDOW', '30'))
+    INVENTORY_FORECAST_METHOD = os.environ.get('INVENTORY_FORECAST_METHOD', 'ewma')
+    INVENTORY_EWMA_HALFLIFE = float(os.environ.get('INVENTORY_EWMA_HALFLIFE', '7'))
+
+    # Exportación columnar de órdenes (por defecto instance/analytics); auto, parquet, arrow o csv
+    ANALYTICS_EXPORT_DIR = os.environ.get('ANALYTICS_EXPORT_DIR')
+    ANALYTICS_EXPORT_FORMAT = os.environ.get('ANALYTICS_EXPORT_FORMAT', 'auto')
     
     # Password Security
     PASSWORD_MIN_LENGTH = 8
@@ -13,6 +13,7 @@ from sqlalchemy import inspect, text
 from sqlalchemy.exc import SQLAlchemyError
 
 from .extensions import db
+from .models import Order, Toy
 
 
 def _existing_columns(table: str) -> set[str]:
@@ -25,6 +26,19 @@ def _existing_columns(table: str) -> set[str]:
     return existing
 
 
+def _ensure_model_index(table, name: str) -> None:
+    """Create a model-declared index on tables created before it existed."""
+    index = next((index for index in table.indexes if index.name == name), None)
+    if index is None:
+        return
+    try:
+        existing = {idx["name"] for idx in inspect(db.engine).get_indexes(table.name)}
+    except SQLAlchemyError:
+        return
+    if name not in existing:
+        index.create(bind=db.engine)
+
+
 def ensure_order_table_columns() -> None:
     """Ensure legacy ``order`` tables have the newest bookkeeping columns.
 
@@ -41,6 +55,7 @@ def ensure_order_table_columns() -> None:
         "discount_amount": "REAL NOT NULL DEFAULT 0",
         "discounted_total": "REAL NOT NULL DEFAULT 0",
         "discount_center": "VARCHAR(64)",
+        "center": "VARCHAR(64)",
         "updated_at": "DATETIME",
         "deleted_at": "DATETIME",
         "is_active": "INTEGER NOT NULL DEFAULT 1",
@@ -102,6 +117,21 @@ def ensure_order_table_columns() -> None:
                 )
             )
 
+        if "center" not in existing:
+            # Mejor aproximación para órdenes viejas: el centro actual del comprador
+            connection.execute(
+                text(
+                    """
+                    UPDATE "order"
+                    SET center = COALESCE(
+                        NULLIF(discount_center, ''),
+                        (SELECT "user".center FROM "user" WHERE "user".id = "order".user_id),
+                        ''
+                    )
+                    """
+                )
+            )
+
         if "is_active" not in existing:
             connection.execute(
                 text(
@@ -119,3 +149,73 @@ def ensure_order_table_columns() -> None:
     finally:
         connection.close()
 
+
+def ensure_order_item_table_columns() -> None:
+    """Ensure legacy ``order_item`` tables have the ``category`` snapshot column.
+
+    The daily rollups group sales by the category a toy had when it was
+    sold.  Existing lines are backfilled once with the toy's current
+    category, the closest value still available.
+    """
+
+    existing = _existing_columns("order_item")
+    if not existing or "category" in existing:
+        return
+
+    connection = db.engine.connect()
+    trans = connection.begin()
+    try:
+        connection.execute(text("ALTER TABLE order_item ADD COLUMN category VARCHAR(50)"))
+        connection.execute(
+            text(
+                """
+                UPDATE order_item
+                SET category = COALESCE(
+                    (SELECT toy.category FROM toy WHERE toy.id = order_item.toy_id),
+                    ''
+                )
+                """
+            )
+        )
+        trans.commit()
+    except SQLAlchemyError:
+        trans.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def ensure_toy_table_columns() -> None:
+    """Ensure legacy ``toy`` tables have the ``sku`` column and its unique index.
+
+    SQLite cannot add a ``UNIQUE`` column with ``ALTER TABLE``, so the
+    column is added as nullable and uniqueness comes from the same
+    ``ix_toy_sku`` index ``db.create_all()`` builds on new databases.
+    """
+
+    existing = _existing_columns("toy")
+    if not existing or "sku" in existing:
+        return
+
+    connection = db.engine.connect()
+    trans = connection.begin()
+    try:
+        connection.execute(text("ALTER TABLE toy ADD COLUMN sku VARCHAR(64)"))
+        trans.commit()
+    except SQLAlchemyError:
+        trans.rollback()
+        raise
+    finally:
+        connection.close()
+
+    _ensure_model_index(Toy.__table__, "ix_toy_sku")
+
+
+def ensure_order_indexes() -> None:
+    """Ensure legacy ``order`` tables have the ``(user_id, order_date)`` index.
+
+    The profile's order history pages through a user's orders newest first;
+    without the composite index every page scans all of the user's rows.
+    """
+
+    _ensure_model_index(Order.__table__, "ix_order_user_date")
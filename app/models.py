@@ -64,6 +64,8 @@ class Toy(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Unicode(100), nullable=False, index=True)
+    # Código del proveedor; clave estable para las cargas masivas en modo upsert
+    sku = db.Column(db.String(64), unique=True, index=True, nullable=True)
     description = db.Column(db.UnicodeText)
     price = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(200))
@@ -102,6 +104,8 @@ class Order(db.Model):
     discount_amount = db.Column(db.Float, nullable=False, default=0.0)
     discounted_total = db.Column(db.Float, nullable=False, default=0.0)
     discount_center = db.Column(db.String(64), nullable=True, index=True)
+    # Centro del comprador al momento de la compra ('' si no tenía); no cambia si el usuario se muda de centro
+    center = db.Column(db.String(64), nullable=True)
     total_price = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='completada', nullable=False)  # completada, en_proceso, cancelada
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -118,6 +122,8 @@ class Order(db.Model):
         CheckConstraint('discount_percentage >= 0'),
         CheckConstraint('discounted_total >= 0'),
         CheckConstraint('total_price >= 0'),
+        # Historial del usuario: WHERE user_id = ? ORDER BY order_date DESC
+        db.Index('ix_order_user_date', 'user_id', 'order_date'),
     )
 
 class OrderItem(db.Model):
@@ -128,6 +134,8 @@ class OrderItem(db.Model):
     toy_id = db.Column(db.Integer, db.ForeignKey('toy.id', ondelete='CASCADE'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
+    # Categoría del juguete al momento de la venta ('' si no tenía); no cambia al recategorizar
+    category = db.Column(db.Unicode(50), nullable=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, onupdate=datetime.now)
     is_active = db.Column(db.Boolean, default=True)
@@ -151,3 +159,67 @@ class ToyCenterAvailability(db.Model):
     __table_args__ = (
         db.UniqueConstraint('toy_id', 'center', name='uq_toy_center'),
     )
+
+
+class ToyPopularity(db.Model):
+    """Unidades vendidas por juguete (pedidos activos), mantenido en checkout/devoluciones."""
+    __tablename__ = 'toy_popularity'
+
+    toy_id = db.Column(db.Integer, db.ForeignKey('toy.id', ondelete='CASCADE'), primary_key=True)
+    total_sold = db.Column(db.Integer, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+
+class CartItem(db.Model):
+    """Línea del carrito del lado del servidor (backend SQL del cart store)."""
+    __tablename__ = 'cart_item'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    toy_id = db.Column(db.Integer, db.ForeignKey('toy.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    # Precio unitario al agregar, en centavos para totales exactos
+    unit_price_cents = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (CheckConstraint('quantity > 0'),)
+
+
+class CartTotal(db.Model):
+    """Conteo y total acumulados del carrito de un usuario (evita sumar líneas por request)."""
+    __tablename__ = 'cart_total'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_cents = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+
+class SalesDailyCategory(db.Model):
+    """Ventas diarias por categoría de juguete (pedidos activos), mantenido en checkout/cancelación."""
+    __tablename__ = 'sales_daily_category'
+
+    day = db.Column(db.Date, primary_key=True)
+    # Categoría al momento de la venta ('' si el juguete no tenía)
+    category = db.Column(db.Unicode(50), primary_key=True, default='')
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class SalesDailyCenter(db.Model):
+    """Pedidos y ventas diarias por centro (centro del descuento o del comprador)."""
+    __tablename__ = 'sales_daily_center'
+
+    day = db.Column(db.Date, primary_key=True)
+    center = db.Column(db.String(64), primary_key=True, default='')
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class SalesDailyToy(db.Model):
+    """Unidades e importe vendidos por juguete y día."""
+    __tablename__ = 'sales_daily_toy'
+
+    day = db.Column(db.Date, primary_key=True)
+    toy_id = db.Column(db.Integer, db.ForeignKey('toy.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
@@ -1,8 +1,20 @@
 """Utility helpers for the Tiendita app."""
 
-from .centers import collect_center_choices, normalize_center_slug
+from .catalog import get_catalog_snapshot, invalidate_catalog
+from .centers import (
+    cached_center_choices,
+    collect_center_choices,
+    get_center_registry,
+    invalidate_centers,
+    normalize_center_slug,
+)
 
 __all__ = [
+    "cached_center_choices",
     "collect_center_choices",
+    "get_catalog_snapshot",
+    "get_center_registry",
+    "invalidate_catalog",
+    "invalidate_centers",
     "normalize_center_slug",
 ]
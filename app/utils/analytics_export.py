@@ -0,0 +1,328 @@
+"""Columnar analytics export of the order history, partitioned by month.
+
+Finance used to download ``export_orders`` CSVs and re-join them by hand
+with the inventory.  :func:`export_analytics` writes one denormalized row
+per order line (order, buyer center, discounts, toy and line amounts) as a
+dataset under ``ANALYTICS_EXPORT_DIR`` (default ``instance/analytics``)::
+
+    order_lines/month=2025-01/part-0.parquet
+    order_lines/month=2025-02/part-0.parquet
+    manifest.json
+
+* Parquet when ``pyarrow.parquet`` is available, Arrow IPC files when only
+  ``pyarrow`` is, and gzip-compressed CSV otherwise, so the export still
+  works on servers without the optional dependency.
+* Every month is read with its own sargable ``order_date`` range query,
+  iterated with ``yield_per`` and written in record batches of
+  ``BATCH_ROWS`` rows, so memory does not grow with the history.
+* ``manifest.json`` keeps a fingerprint per month (orders, id sum, totals
+  and last update, from one grouped query).  Incremental runs rewrite only
+  the months whose fingerprint changed and drop months left without orders.
+* ``center`` and ``toy_category`` are the values stored at checkout
+  (``Order.center``, ``OrderItem.category``), like the daily rollups;
+  ``user_center`` is the buyer's current center.
+"""
+from __future__ import annotations
+
+import csv
+import gzip
+import json
+import os
+import shutil
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import case, func, select
+
+from ..extensions import db
+from ..models import Order, OrderItem, Toy, User
+from .sales import as_date
+
+try:  # Dependencia opcional
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - depende del entorno
+    pa = None
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depende del entorno
+    pq = None
+
+DATASET = 'order_lines'
+MANIFEST = 'manifest.json'
+SCHEMA_VERSION = 2
+BATCH_ROWS = 5000
+FORMATS = ('parquet', 'arrow', 'csv')
+_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow', 'csv': 'csv.gz'}
+
+# (columna, tipo Arrow); el orden es el de los archivos
+COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ('order_id', 'int64'),
+    ('order_date', 'timestamp'),
+    ('month', 'string'),
+    ('status', 'string'),
+    ('order_active', 'bool'),
+    ('user_id', 'int64'),
+    ('user_center', 'string'),
+    ('discount_center', 'string'),
+    ('center', 'string'),
+    ('discount_percentage', 'float64'),
+    ('discount_amount', 'float64'),
+    ('subtotal_price', 'float64'),
+    ('total_price', 'float64'),
+    ('toy_id', 'int64'),
+    ('toy_sku', 'string'),
+    ('toy_name', 'string'),
+    ('toy_category', 'string'),
+    ('quantity', 'int64'),
+    ('unit_price', 'float64'),
+    ('line_total', 'float64'),
+)
+
+
+class ExportSummary(NamedTuple):
+    format: str
+    path: str
+    written: List[str]
+    unchanged: List[str]
+    removed: List[str]
+    rows: int
+
+
+def available_format(preferred: Optional[str] = None) -> str:
+    """Best format the installed libraries support (``preferred`` if possible)."""
+    if preferred not in (None, 'auto') and preferred not in FORMATS:
+        raise ValueError(f"Formato no soportado: {preferred}")
+    supported = [
+        fmt for fmt, ok in (('parquet', pq is not None), ('arrow', pa is not None), ('csv', True)) if ok
+    ]
+    if preferred in supported:
+        return preferred
+    return supported[0]
+
+
+def export_dir(app=None) -> str:
+    app = app or current_app
+    return app.config.get('ANALYTICS_EXPORT_DIR') or os.path.join(app.instance_path, 'analytics')
+
+
+def month_key(day: date) -> str:
+    return day.strftime('%Y-%m')
+
+
+def month_range(key: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(key, '%Y-%m')
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start, end
+
+
+def month_fingerprints() -> Dict[str, str]:
+    """Fingerprint per month from one grouped query (days folded into months)."""
+    day = func.date(Order.order_date)
+    rows = db.session.execute(
+        select(
+            day,
+            func.count(Order.id),
+            func.sum(Order.id),
+            func.sum(Order.total_price),
+            func.sum(case((Order.is_active == False, 0), else_=1)),  # noqa: E712
+            func.max(func.coalesce(Order.updated_at, Order.created_at)),
+        ).group_by(day)
+    ).all()
+
+    months: Dict[str, List] = {}
+    for raw_day, count, id_sum, total, active, last_update in rows:
+        entry = months.setdefault(month_key(as_date(raw_day)), [0, 0, 0.0, 0, ''])
+        entry[0] += int(count or 0)
+        entry[1] += int(id_sum or 0)
+        entry[2] += float(total or 0)
+        entry[3] += int(active or 0)
+        entry[4] = max(entry[4], str(last_update or ''))
+    return {
+        key: f"{count}:{id_sum}:{total:.2f}:{active}:{last_update}"
+        for key, (count, id_sum, total, active, last_update) in months.items()
+    }
+
+
+def month_rows(key: str) -> Iterator[Dict]:
+    """Denormalized order lines of one month, streamed in id order."""
+    start, end = month_range(key)
+    statement = (
+        select(
+            Order.id, Order.order_date, Order.status, Order.is_active, Order.user_id,
+            User.center, Order.discount_center, Order.center,
+            Order.discount_percentage, Order.discount_amount, Order.subtotal_price, Order.total_price,
+            OrderItem.toy_id, Toy.sku, Toy.name, OrderItem.category, OrderItem.quantity, OrderItem.price,
+        )
+        .select_from(Order)
+        .outerjoin(User, User.id == Order.user_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Toy, Toy.id == OrderItem.toy_id)
+        .where(Order.order_date >= start, Order.order_date < end)
+        .order_by(Order.id, OrderItem.id)
+    )
+    for (order_id, order_date, status, is_active, user_id, user_center, discount_center, center,
+         discount_percentage, discount_amount, subtotal, total,
+         toy_id, sku, name, category, quantity, price) in db.session.execute(
+            statement, execution_options={'yield_per': BATCH_ROWS}):
+        yield {
+            'order_id': order_id,
+            'order_date': order_date,
+            'month': key,
+            'status': status,
+            'order_active': is_active is not False,
+            'user_id': user_id,
+            'user_center': user_center,
+            'discount_center': discount_center,
+            'center': center,
+            'discount_percentage': discount_percentage,
+            'discount_amount': discount_amount,
+            'subtotal_price': subtotal,
+            'total_price': total,
+            'toy_id': toy_id,
+            'toy_sku': sku,
+            'toy_name': name,
+            'toy_category': category,
+            'quantity': quantity,
+            'unit_price': price,
+            'line_total': round(price * quantity, 2) if price is not None and quantity is not None else None,
+        }
+
+
+def _batches(rows: Iterator[Dict], size: int = BATCH_ROWS) -> Iterator[List[Dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def arrow_schema():
+    types = {
+        'int64': pa.int64(),
+        'float64': pa.float64(),
+        'string': pa.string(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('us'),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def _write_partition(path: str, fmt: str, rows: Iterator[Dict]) -> int:
+    """Write one month to ``path`` batch by batch; returns the row count."""
+    count = 0
+    if fmt == 'csv':
+        names = [name for name, _ in COLUMNS]
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as fh:
+            writer = csv.DictWriter(fh, fieldnames=names)
+            writer.writeheader()
+            for batch in _batches(rows):
+                writer.writerows(batch)
+                count += len(batch)
+        return count
+
+    schema = arrow_schema()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(path, schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    try:
+        for batch in _batches(rows):
+            columns = {name: [row[name] for row in batch] for name, _ in COLUMNS}
+            writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+            count += len(batch)
+    finally:
+        writer.close()
+    return count
+
+
+def _load_manifest(root: str) -> Dict:
+    try:
+        with open(os.path.join(root, MANIFEST), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(root: str, manifest: Dict) -> None:
+    tmp = os.path.join(root, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+
+def export_analytics(target_dir: Optional[str] = None, *, incremental: bool = True,
+                     fmt: Optional[str] = None) -> ExportSummary:
+    """Write (or refresh) the monthly order-line dataset; see the module docstring."""
+    root = target_dir or export_dir()
+    fmt = available_format(fmt or current_app.config.get('ANALYTICS_EXPORT_FORMAT'))
+    dataset = os.path.join(root, DATASET)
+    os.makedirs(dataset, exist_ok=True)
+
+    manifest = _load_manifest(root)
+    # Cambiar de formato o de esquema obliga a reescribir todo
+    if manifest.get('format') != fmt or manifest.get('schema_version') != SCHEMA_VERSION:
+        incremental = False
+    previous = manifest.get('months', {}) if incremental else {}
+
+    fingerprints = month_fingerprints()
+    written, unchanged, removed = [], [], []
+    months: Dict[str, Dict] = {}
+    rows = 0
+    for key in sorted(fingerprints):
+        if previous.get(key, {}).get('fingerprint') == fingerprints[key]:
+            unchanged.append(key)
+            months[key] = previous[key]
+            continue
+        folder = os.path.join(dataset, f'month={key}')
+        os.makedirs(folder, exist_ok=True)
+        filename = f'part-0.{_EXTENSIONS[fmt]}'
+        tmp = os.path.join(folder, f'.{filename}.tmp')
+        count = _write_partition(tmp, fmt, month_rows(key))
+        for stale in os.listdir(folder):
+            if stale.startswith('part-'):
+                os.remove(os.path.join(folder, stale))
+        os.replace(tmp, os.path.join(folder, filename))
+        written.append(key)
+        rows += count
+        months[key] = {
+            'fingerprint': fingerprints[key],
+            'rows': count,
+            'file': f'{DATASET}/month={key}/{filename}',
+            'exported_at': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    for entry in os.listdir(dataset):
+        if entry.startswith('month=') and entry[len('month='):] not in fingerprints:
+            shutil.rmtree(os.path.join(dataset, entry))
+            removed.append(entry[len('month='):])
+
+    _save_manifest(root, {
+        'dataset': DATASET,
+        'format': fmt,
+        'schema_version': SCHEMA_VERSION,
+        'columns': [name for name, _ in COLUMNS],
+        'months': months,
+    })
+    return ExportSummary(fmt, root, written, unchanged, sorted(removed), rows)
+
+
+analytics_cli = AppGroup('analytics', help='Exportación columnar de órdenes para análisis.')
+
+
+@analytics_cli.command('export')
+@click.option('--full', is_flag=True, help='Reescribir todos los meses.')
+@click.option('--format', 'fmt', type=click.Choice(('auto',) + FORMATS), default=None)
+@click.option('--path', 'target_dir', default=None, help='Directorio destino.')
+def export_command(full, fmt, target_dir):
+    """Escribir las líneas de orden particionadas por mes."""
+    summary = export_analytics(target_dir, incremental=not full, fmt=fmt)
+    click.echo(
+        f"{summary.format}: {len(summary.written)} meses escritos ({summary.rows} filas), "
+        f"{len(summary.unchanged)} sin cambios, {len(summary.removed)} eliminados en {summary.path}"
+    )
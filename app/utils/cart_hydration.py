@@ -0,0 +1,121 @@
+"""Turn cart lines and order items into priced lines with one query.
+
+``view_cart`` and ``checkout`` used to call ``Toy.query.get`` once per cart
+line, and the checkout POST repeated that with ``with_for_update()``, so a
+classroom-sized order cost one round trip (and one lock) per line.
+:func:`hydrate_cart` loads every toy of the cart with a single
+``IN (...)`` query; with ``lock=True`` the same statement takes the row
+locks, ordered by id so concurrent checkouts always lock in the same order
+and cannot deadlock each other.
+
+:class:`PricedLine` is the shape shared by the cart page, checkout and the
+receipt (:func:`order_lines`); amounts are kept in cents like the cart
+store.
+"""
+from __future__ import annotations
+
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+from ..extensions import db
+from ..models import OrderItem, Toy
+from .cart_store import CartLine, to_cents
+
+
+class PricedLine(NamedTuple):
+    toy_id: int
+    name: str
+    quantity: int
+    unit_price_cents: int
+    toy: Optional[Toy] = None
+
+    @property
+    def unit_price(self) -> float:
+        return self.unit_price_cents / 100.0
+
+    @property
+    def subtotal_cents(self) -> int:
+        return self.quantity * self.unit_price_cents
+
+    @property
+    def subtotal(self) -> float:
+        return self.subtotal_cents / 100.0
+
+    # Alias usados por las plantillas (cart.html / checkout.html)
+    price = unit_price
+    total = subtotal
+
+
+class HydratedCart(NamedTuple):
+    lines: List[PricedLine]
+    # Juguetes del carrito que ya no existen o no están activos
+    missing: List[int]
+
+    @property
+    def subtotal_cents(self) -> int:
+        return sum(line.subtotal_cents for line in self.lines)
+
+    @property
+    def subtotal(self) -> float:
+        return self.subtotal_cents / 100.0
+
+    @property
+    def count(self) -> int:
+        return sum(line.quantity for line in self.lines)
+
+    def __bool__(self) -> bool:
+        return bool(self.lines)
+
+
+def load_toys(toy_ids: Iterable[int], *, lock: bool = False) -> dict:
+    """Return ``{id: Toy}`` for ``toy_ids`` in one query, locking rows if asked.
+
+    Rows are requested in ascending id order so ``FOR UPDATE`` acquires the
+    locks deterministically.
+    """
+    ids = sorted({int(toy_id) for toy_id in toy_ids})
+    if not ids:
+        return {}
+    query = Toy.query.filter(Toy.id.in_(ids)).order_by(Toy.id)
+    if lock:
+        query = query.with_for_update()
+    return {toy.id: toy for toy in query.all()}
+
+
+def hydrate_cart(lines: Sequence[CartLine], *, lock: bool = False) -> HydratedCart:
+    """Price ``lines`` (from the cart store) against the catalog in one query.
+
+    The unit price is the one stored when the toy was added to the cart,
+    as before.  Lines whose toy was deleted or deactivated are reported in
+    ``missing`` instead of raising.
+    """
+    toys = load_toys((line.toy_id for line in lines), lock=lock)
+    priced: List[PricedLine] = []
+    missing: List[int] = []
+    for line in lines:
+        toy = toys.get(line.toy_id)
+        if toy is None or not toy.is_active:
+            missing.append(line.toy_id)
+            continue
+        priced.append(PricedLine(toy.id, toy.name, line.quantity, line.unit_price_cents, toy))
+    return HydratedCart(priced, missing)
+
+
+def order_lines(order_id: int) -> List[PricedLine]:
+    """Priced lines of an order (receipt, summaries) with the toys joined in."""
+    rows = (
+        db.session.query(OrderItem, Toy)
+        .outerjoin(Toy, Toy.id == OrderItem.toy_id)
+        .filter(OrderItem.order_id == order_id)
+        .order_by(OrderItem.id)
+        .all()
+    )
+    return [
+        PricedLine(
+            item.toy_id,
+            toy.name if toy is not None else f"Toy ID {item.toy_id}",
+            item.quantity or 0,
+            to_cents(item.price),
+            toy,
+        )
+        for item, toy in rows
+    ]
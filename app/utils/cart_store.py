@@ -0,0 +1,455 @@
+"""Server-side shopping cart store.
+
+The cart used to live in ``session['cart']``: a signed cookie re-serialized
+on every request, summed in Python on every page and prone to lost updates
+when two tabs wrote at once.  Carts now live on the server, keyed by user
+id, behind a small backend interface:
+
+* ``RedisCartBackend`` keeps each cart in one hash and mutates it with Lua
+  scripts, so increments, stock caps and the running count/total change
+  atomically.
+* ``SQLCartBackend`` stores lines in ``cart_item`` and the running totals
+  in ``cart_total`` (same database as the shop, works without Redis).
+* ``MemoryCartBackend`` is a process-local dict, useful for development.
+
+``CART_STORE_BACKEND`` selects the backend (``auto`` uses Redis when it
+answers a ping and SQL otherwise).  Amounts are kept in cents so totals are
+exact; :class:`CartLine` and :class:`CartSummary` expose them as floats.
+"""
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from flask import current_app, session
+from flask_login import current_user
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ..extensions import db
+from ..models import CartItem, CartTotal
+from .counters import increment_counters
+
+_EXTENSION_KEY = "cart_store"
+
+
+def to_cents(amount) -> int:
+    return int(round(float(amount or 0) * 100))
+
+
+class CartLine(NamedTuple):
+    toy_id: int
+    quantity: int
+    unit_price_cents: int
+
+    @property
+    def unit_price(self) -> float:
+        return self.unit_price_cents / 100.0
+
+    @property
+    def subtotal(self) -> float:
+        return self.quantity * self.unit_price_cents / 100.0
+
+
+class CartSummary(NamedTuple):
+    count: int
+    total_cents: int
+
+    @property
+    def total(self) -> float:
+        return self.total_cents / 100.0
+
+
+EMPTY_SUMMARY = CartSummary(0, 0)
+
+
+class CartBackend:
+    """Interface shared by the cart backends; all methods are per user."""
+
+    name = "base"
+
+    def lines(self, user_id: int) -> List[CartLine]:
+        raise NotImplementedError
+
+    def add(self, user_id: int, toy_id: int, quantity: int, unit_price_cents: int,
+            max_quantity: Optional[int] = None) -> Optional[int]:
+        """Atomically add ``quantity``; return the new line quantity or None if over ``max_quantity``."""
+        raise NotImplementedError
+
+    def set_quantity(self, user_id: int, toy_id: int, quantity: int) -> bool:
+        """Set a line's quantity (``< 1`` removes it); False if the line does not exist."""
+        raise NotImplementedError
+
+    def remove(self, user_id: int, toy_id: int) -> bool:
+        return self.set_quantity(user_id, toy_id, 0)
+
+    def clear(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    def summary(self, user_id: int) -> CartSummary:
+        raise NotImplementedError
+
+
+class MemoryCartBackend(CartBackend):
+    """Process-local carts guarded by a lock."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._carts: Dict[int, Dict[int, List[int]]] = {}
+        self._summaries: Dict[int, CartSummary] = {}
+        self._lock = threading.Lock()
+
+    def _bump(self, user_id: int, count: int, cents: int) -> None:
+        current = self._summaries.get(user_id, EMPTY_SUMMARY)
+        self._summaries[user_id] = CartSummary(current.count + count, current.total_cents + cents)
+
+    def lines(self, user_id):
+        with self._lock:
+            cart = self._carts.get(user_id, {})
+            return [CartLine(toy_id, qty, price) for toy_id, (qty, price) in sorted(cart.items())]
+
+    def add(self, user_id, toy_id, quantity, unit_price_cents, max_quantity=None):
+        with self._lock:
+            cart = self._carts.setdefault(user_id, {})
+            line = cart.get(toy_id)
+            current = line[0] if line else 0
+            if max_quantity is not None and current + quantity > max_quantity:
+                return None
+            if line is None:
+                line = cart[toy_id] = [0, unit_price_cents]
+            line[0] += quantity
+            self._bump(user_id, quantity, quantity * line[1])
+            return line[0]
+
+    def set_quantity(self, user_id, toy_id, quantity):
+        with self._lock:
+            cart = self._carts.get(user_id, {})
+            line = cart.get(toy_id)
+            if line is None:
+                return False
+            new_quantity = max(0, quantity)
+            delta = new_quantity - line[0]
+            self._bump(user_id, delta, delta * line[1])
+            if new_quantity == 0:
+                del cart[toy_id]
+            else:
+                line[0] = new_quantity
+            return True
+
+    def clear(self, user_id):
+        with self._lock:
+            self._carts.pop(user_id, None)
+            self._summaries.pop(user_id, None)
+
+    def summary(self, user_id):
+        return self._summaries.get(user_id, EMPTY_SUMMARY)
+
+
+class SQLCartBackend(CartBackend):
+    """Carts in ``cart_item`` with running totals in ``cart_total``.
+
+    Increments are a single conditional ``UPDATE`` (the stock cap is part of
+    the ``WHERE``), so concurrent requests never lose units.  Every write
+    commits its own transaction.
+    """
+
+    name = "sql"
+
+    def lines(self, user_id):
+        rows = db.session.execute(
+            select(CartItem.toy_id, CartItem.quantity, CartItem.unit_price_cents)
+            .where(CartItem.user_id == user_id)
+            .order_by(CartItem.toy_id)
+        ).all()
+        return [CartLine(row.toy_id, row.quantity, row.unit_price_cents) for row in rows]
+
+    def _increment(self, user_id, toy_id, quantity, max_quantity):
+        condition = [CartItem.user_id == user_id, CartItem.toy_id == toy_id]
+        if max_quantity is not None:
+            condition.append(CartItem.quantity + quantity <= max_quantity)
+        result = db.session.execute(
+            update(CartItem)
+            .where(*condition)
+            .values(quantity=CartItem.quantity + quantity, updated_at=datetime.now())
+        )
+        return result.rowcount
+
+    def add(self, user_id, toy_id, quantity, unit_price_cents, max_quantity=None):
+        try:
+            if not self._increment(user_id, toy_id, quantity, max_quantity):
+                exists = db.session.execute(
+                    select(CartItem.quantity).where(CartItem.user_id == user_id, CartItem.toy_id == toy_id)
+                ).first()
+                if exists is not None or (max_quantity is not None and quantity > max_quantity):
+                    db.session.rollback()
+                    return None
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(CartItem(
+                            user_id=user_id,
+                            toy_id=toy_id,
+                            quantity=quantity,
+                            unit_price_cents=unit_price_cents,
+                        ))
+                except IntegrityError:
+                    # Otra petición creó la línea primero: reintentar como incremento
+                    if not self._increment(user_id, toy_id, quantity, max_quantity):
+                        db.session.rollback()
+                        return None
+
+            row = db.session.execute(
+                select(CartItem.quantity, CartItem.unit_price_cents)
+                .where(CartItem.user_id == user_id, CartItem.toy_id == toy_id)
+            ).one()
+            increment_counters(
+                CartTotal,
+                [{"user_id": user_id, "item_count": quantity, "total_cents": quantity * row.unit_price_cents}],
+                key_columns=("user_id",),
+                counter_columns=("item_count", "total_cents"),
+                extra_values={"updated_at": datetime.now()},
+            )
+            db.session.commit()
+            return row.quantity
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _refresh_total(self, user_id):
+        count, cents = db.session.execute(
+            select(func.coalesce(func.sum(CartItem.quantity), 0),
+                   func.coalesce(func.sum(CartItem.quantity * CartItem.unit_price_cents), 0))
+            .where(CartItem.user_id == user_id)
+        ).one()
+        updated = db.session.execute(
+            update(CartTotal)
+            .where(CartTotal.user_id == user_id)
+            .values(item_count=count, total_cents=cents, updated_at=datetime.now())
+        )
+        if not updated.rowcount:
+            db.session.add(CartTotal(user_id=user_id, item_count=count, total_cents=cents))
+
+    def set_quantity(self, user_id, toy_id, quantity):
+        try:
+            condition = (CartItem.user_id == user_id, CartItem.toy_id == toy_id)
+            if quantity < 1:
+                result = db.session.execute(delete(CartItem).where(*condition))
+            else:
+                result = db.session.execute(
+                    update(CartItem).where(*condition).values(quantity=quantity, updated_at=datetime.now())
+                )
+            if not result.rowcount:
+                db.session.rollback()
+                return False
+            self._refresh_total(user_id)
+            db.session.commit()
+            return True
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def clear(self, user_id):
+        try:
+            db.session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+            db.session.execute(delete(CartTotal).where(CartTotal.user_id == user_id))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def summary(self, user_id):
+        row = db.session.execute(
+            select(CartTotal.item_count, CartTotal.total_cents).where(CartTotal.user_id == user_id)
+        ).first()
+        if row is None:
+            return EMPTY_SUMMARY
+        return CartSummary(int(row.item_count or 0), int(row.total_cents or 0))
+
+
+# Scripts Lua: cada operación lee y actualiza el hash del carrito de forma atómica.
+# Campos del hash: q:<toy_id> cantidad, p:<toy_id> precio en centavos, _count y _total.
+_REDIS_ADD = """
+local qfield = 'q:' .. ARGV[1]
+local pfield = 'p:' .. ARGV[1]
+local current = tonumber(redis.call('HGET', KEYS[1], qfield) or '0')
+local add = tonumber(ARGV[2])
+local max = tonumber(ARGV[4])
+if max >= 0 and current + add > max then
+    return -1
+end
+local price = redis.call('HGET', KEYS[1], pfield)
+if not price then
+    price = ARGV[3]
+    redis.call('HSET', KEYS[1], pfield, price)
+end
+local quantity = redis.call('HINCRBY', KEYS[1], qfield, add)
+redis.call('HINCRBY', KEYS[1], '_count', add)
+redis.call('HINCRBY', KEYS[1], '_total', add * tonumber(price))
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return quantity
+"""
+
+_REDIS_SET = """
+local qfield = 'q:' .. ARGV[1]
+local pfield = 'p:' .. ARGV[1]
+local current = redis.call('HGET', KEYS[1], qfield)
+if not current then
+    return 0
+end
+current = tonumber(current)
+local price = tonumber(redis.call('HGET', KEYS[1], pfield) or '0')
+local quantity = tonumber(ARGV[2])
+if quantity < 1 then
+    quantity = 0
+    redis.call('HDEL', KEYS[1], qfield, pfield)
+else
+    redis.call('HSET', KEYS[1], qfield, quantity)
+end
+local delta = quantity - current
+redis.call('HINCRBY', KEYS[1], '_count', delta)
+redis.call('HINCRBY', KEYS[1], '_total', delta * price)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class RedisCartBackend(CartBackend):
+    """Carts as Redis hashes (``cart:<user_id>``) mutated through Lua scripts."""
+
+    name = "redis"
+
+    def __init__(self, client, ttl: int = 30 * 24 * 3600):
+        self.client = client
+        self.ttl = ttl
+        self._add = client.register_script(_REDIS_ADD)
+        self._set = client.register_script(_REDIS_SET)
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"cart:{user_id}"
+
+    def lines(self, user_id):
+        raw = {_text(k): int(v) for k, v in self.client.hgetall(self._key(user_id)).items()}
+        lines = []
+        for field, quantity in raw.items():
+            if field.startswith("q:") and quantity > 0:
+                toy_id = int(field[2:])
+                lines.append(CartLine(toy_id, quantity, raw.get(f"p:{toy_id}", 0)))
+        return sorted(lines)
+
+    def add(self, user_id, toy_id, quantity, unit_price_cents, max_quantity=None):
+        result = int(self._add(
+            keys=[self._key(user_id)],
+            args=[toy_id, quantity, unit_price_cents, -1 if max_quantity is None else max_quantity, self.ttl],
+        ))
+        return None if result < 0 else result
+
+    def set_quantity(self, user_id, toy_id, quantity):
+        return bool(int(self._set(keys=[self._key(user_id)], args=[toy_id, quantity, self.ttl])))
+
+    def clear(self, user_id):
+        self.client.delete(self._key(user_id))
+
+    def summary(self, user_id):
+        count, cents = self.client.hmget(self._key(user_id), "_count", "_total")
+        return CartSummary(int(count or 0), int(cents or 0))
+
+
+class CartStore:
+    """Facade used by the views; wraps the configured backend."""
+
+    def __init__(self, backend: CartBackend):
+        self.backend = backend
+
+    @property
+    def backend_name(self) -> str:
+        return self.backend.name
+
+    def lines(self, user_id: int) -> List[CartLine]:
+        return self.backend.lines(user_id)
+
+    def add(self, user_id: int, toy_id: int, quantity: int, unit_price, max_quantity: Optional[int] = None) -> Optional[int]:
+        if quantity < 1:
+            return None
+        return self.backend.add(user_id, int(toy_id), int(quantity), to_cents(unit_price), max_quantity)
+
+    def set_quantity(self, user_id: int, toy_id: int, quantity: int) -> bool:
+        return self.backend.set_quantity(user_id, int(toy_id), int(quantity))
+
+    def remove(self, user_id: int, toy_id: int) -> bool:
+        return self.backend.remove(user_id, int(toy_id))
+
+    def clear(self, user_id: int) -> None:
+        self.backend.clear(user_id)
+
+    def summary(self, user_id: int) -> CartSummary:
+        return self.backend.summary(user_id)
+
+    def merge_legacy(self, user_id: int, legacy_cart: Dict) -> None:
+        """Import a pre-existing ``session['cart']`` (``{toy_id: {quantity, price}}`` or ``{toy_id: qty}``)."""
+        for toy_id, item in (legacy_cart or {}).items():
+            if isinstance(item, dict):
+                quantity, price = item.get("quantity", 0), item.get("price", 0)
+            else:
+                quantity, price = item, 0
+            try:
+                self.add(user_id, int(toy_id), int(quantity), price)
+            except (TypeError, ValueError):
+                continue
+
+
+def _redis_client(app):
+    client = getattr(app, "redis", None)
+    if client is None:
+        return None
+    try:
+        client.ping()
+        return client
+    except Exception:
+        return None
+
+
+def _create_backend(app) -> CartBackend:
+    choice = (app.config.get("CART_STORE_BACKEND") or "auto").lower()
+    if choice == "memory":
+        return MemoryCartBackend()
+    if choice in ("redis", "auto"):
+        client = _redis_client(app)
+        if client is not None:
+            return RedisCartBackend(client, ttl=app.config.get("CART_STORE_TTL", 30 * 24 * 3600))
+        if choice == "redis":
+            app.logger.warning("CART_STORE_BACKEND=redis pero Redis no responde; usando SQL")
+    return SQLCartBackend()
+
+
+def get_cart_store(app=None) -> CartStore:
+    """Return the app's cart store, creating the backend on first use."""
+    app = app or current_app._get_current_object()
+    store = app.extensions.get(_EXTENSION_KEY)
+    if store is None:
+        store = app.extensions.setdefault(_EXTENSION_KEY, CartStore(_create_backend(app)))
+    return store
+
+
+def _migrate_session_cart():
+    """Move a legacy cookie cart into the server-side store once per session."""
+    if "cart" not in session:
+        return
+    try:
+        if not current_user.is_authenticated:
+            return
+    except Exception:
+        return
+    legacy = session.pop("cart", None)
+    if isinstance(legacy, dict) and legacy:
+        get_cart_store().merge_legacy(current_user.id, legacy)
+
+
+def init_cart_store(app) -> None:
+    """Register the legacy-cart migration hook for ``app``."""
+    app.before_request(_migrate_session_cart)
@@ -0,0 +1,362 @@
+"""In-process snapshot of the active toy catalog.
+
+The storefront (``shop.index`` and ``basic_search``) is read far more often
+than the catalog is written, so instead of rebuilding the same filtered
+query on every hit we keep a versioned, per-app snapshot of the active toys
+and their center availability.  Writers call :func:`invalidate_catalog`
+after committing and the next reader rebuilds the snapshot with two plain
+``SELECT`` statements.  A short TTL (``CATALOG_SNAPSHOT_TTL``) bounds the
+staleness seen by other worker processes.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Callable, Collection, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from flask import current_app
+
+from ..extensions import db
+from ..models import Toy, ToyCenterAvailability
+from .centers import normalize_center_slug
+
+_EXTENSION_KEY = "catalog_snapshot"
+
+# Modos de orden con paginación por cursor (keyset sobre (clave, id))
+SORT_MODES = ("name", "price_asc", "price_desc", "newest")
+
+# Registro compacto de un juguete; expone los mismos atributos que usan las plantillas.
+CatalogToy = namedtuple(
+    "CatalogToy",
+    (
+        "id",
+        "name",
+        "description",
+        "price",
+        "image_url",
+        "category",
+        "age_range",
+        "gender_category",
+        "stock",
+        "created_at",
+    ),
+)
+
+
+class SnapshotPagination:
+    """Pagination object compatible with ``flask_sqlalchemy.Pagination``."""
+
+    def __init__(self, items: Sequence[CatalogToy], page: int, per_page: int, total: int):
+        self.items = list(items)
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self) -> int:
+        if self.per_page <= 0 or self.total == 0:
+            return 0
+        return int(math.ceil(self.total / float(self.per_page)))
+
+    @property
+    def has_prev(self) -> bool:
+        return self.page > 1
+
+    @property
+    def prev_num(self) -> Optional[int]:
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self) -> bool:
+        return self.page < self.pages
+
+    @property
+    def next_num(self) -> Optional[int]:
+        return self.page + 1 if self.has_next else None
+
+
+class CatalogSnapshot:
+    """Immutable view of the active catalog built from a single version."""
+
+    def __init__(self, toys: Sequence[CatalogToy], centers: Dict[int, FrozenSet[str]], version: int):
+        # ``toys`` llega ordenado por fecha de creación descendente (orden del index).
+        self.version = version
+        self.built_at = time.monotonic()
+        self.toys: Tuple[CatalogToy, ...] = tuple(toys)
+        self.by_id: Dict[int, CatalogToy] = {toy.id: toy for toy in self.toys}
+        self.centers: Dict[int, FrozenSet[str]] = centers
+        self.categories: List[str] = sorted(
+            {toy.category.strip() for toy in self.toys if toy.category and toy.category.strip()}
+        )
+        # Órdenes precalculados por modo, creados bajo demanda
+        self._ordered: Dict[str, Tuple[Tuple[CatalogToy, ...], List[tuple]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.toys)
+
+    # ------------------------------------------------------------------
+    # Filtros
+    # ------------------------------------------------------------------
+    def is_available_in(self, toy_id: int, center: str | None) -> bool:
+        """Un juguete sin centros asignados está disponible en todos."""
+        if not center:
+            return True
+        toy_centers = self.centers.get(toy_id)
+        return not toy_centers or center in toy_centers
+
+    def filter(
+        self,
+        *,
+        center: str | None = None,
+        category: str | None = None,
+        age_range: str | None = None,
+        gender: str | None = None,
+        text: str | None = None,
+        ids: Collection[int] | None = None,
+        predicate: Callable[[CatalogToy], bool] | None = None,
+        toys: Iterable[CatalogToy] | None = None,
+    ) -> List[CatalogToy]:
+        """Return the toys matching every given filter, preserving order.
+
+        ``ids`` restricts the result to a precomputed set (e.g. full-text
+        matches); ``text`` is the substring fallback when no index exists.
+        """
+        matches = self._matcher(
+            center=center,
+            category=category,
+            age_range=age_range,
+            gender=gender,
+            text=text,
+            ids=ids,
+            predicate=predicate,
+        )
+        return [toy for toy in (self.toys if toys is None else toys) if matches(toy)]
+
+    def _matcher(
+        self,
+        *,
+        center: str | None = None,
+        category: str | None = None,
+        age_range: str | None = None,
+        gender: str | None = None,
+        text: str | None = None,
+        ids: Collection[int] | None = None,
+        predicate: Callable[[CatalogToy], bool] | None = None,
+    ) -> Callable[[CatalogToy], bool]:
+        normalized_center = normalize_center_slug(center)
+        normalized_category = (category or "").strip().lower()
+        needle = (text or "").strip().casefold()
+
+        def matches(toy: CatalogToy) -> bool:
+            if normalized_center and not self.is_available_in(toy.id, normalized_center):
+                return False
+            if normalized_category and (toy.category or "").strip().lower() != normalized_category:
+                return False
+            if age_range and toy.age_range != age_range:
+                return False
+            if gender and toy.gender_category != gender:
+                return False
+            if ids is not None and toy.id not in ids:
+                return False
+            if needle and not _matches_text(toy, needle):
+                return False
+            if predicate is not None and not predicate(toy):
+                return False
+            return True
+
+        return matches
+
+    # ------------------------------------------------------------------
+    # Orden y paginación
+    # ------------------------------------------------------------------
+    @staticmethod
+    def sort_key(toy: CatalogToy, sort: str) -> tuple:
+        """Ascending ``(sort value, id)`` key for ``sort``; unique per toy."""
+        if sort == "name":
+            return (toy.name or "", toy.id)
+        if sort == "price_asc":
+            return (toy.price, toy.id)
+        if sort == "price_desc":
+            return (-toy.price, -toy.id)
+        # newest: más recientes primero
+        created = toy.created_at.timestamp() if toy.created_at else 0.0
+        return (-created, -toy.id)
+
+    def ordered(self, sort: str) -> Tuple[Tuple[CatalogToy, ...], List[tuple]]:
+        """Toys presorted for ``sort`` plus their keys (computed once per snapshot)."""
+        sort = sort if sort in SORT_MODES else "newest"
+        cached = self._ordered.get(sort)
+        if cached is None:
+            decorated = sorted(((self.sort_key(toy, sort), toy) for toy in self.toys), key=lambda pair: pair[0])
+            cached = (tuple(toy for _key, toy in decorated), [key for key, _toy in decorated])
+            self._ordered[sort] = cached
+        return cached
+
+    @classmethod
+    def sort(cls, toys: List[CatalogToy], sort: str) -> List[CatalogToy]:
+        """Sort toys using the same modes as ``basic_search``."""
+        if sort not in SORT_MODES or sort == "newest":
+            # Por defecto: más recientes primero (orden natural del snapshot)
+            return list(toys)
+        return sorted(toys, key=lambda toy: cls.sort_key(toy, sort))
+
+    def page_after(
+        self,
+        sort: str,
+        after: Optional[tuple] = None,
+        limit: int = 12,
+        **filters,
+    ) -> Tuple[List[CatalogToy], Optional[tuple]]:
+        """Keyset page: up to ``limit`` matching toys whose key is after ``after``.
+
+        The start position is found with a binary search over the presorted
+        keys, so the cost depends on the page size (and filter selectivity),
+        not on how deep the cursor is.  Returns the items and the key to pass
+        as ``after`` for the next page (None on the last page).
+        """
+        limit = max(1, limit)
+        toys, keys = self.ordered(sort)
+        start = 0
+        if after is not None:
+            try:
+                start = bisect_right(keys, tuple(after))
+            except TypeError:
+                # Cursor con tipos incompatibles: empezar desde el principio
+                start = 0
+
+        matches = self._matcher(**filters)
+        items: List[CatalogToy] = []
+        last_key = None
+        for index in range(start, len(toys)):
+            toy = toys[index]
+            if not matches(toy):
+                continue
+            if len(items) == limit:
+                return items, last_key
+            items.append(toy)
+            last_key = keys[index]
+        return items, None
+
+    @staticmethod
+    def paginate(toys: Sequence[CatalogToy], page: int, per_page: int) -> SnapshotPagination:
+        page = max(1, page)
+        per_page = max(1, per_page)
+        start = (page - 1) * per_page
+        return SnapshotPagination(toys[start:start + per_page], page, per_page, len(toys))
+
+
+def _matches_text(toy: CatalogToy, needle: str) -> bool:
+    for value in (toy.name, toy.description, toy.category):
+        if value and needle in value.casefold():
+            return True
+    return False
+
+
+class _SnapshotHolder:
+    """Per-app holder that rebuilds the snapshot lazily when its version changes."""
+
+    def __init__(self):
+        self.version = 0
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self.lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.version += 1
+
+    def get(self, ttl: float) -> CatalogSnapshot:
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == self.version and not _expired(snapshot, ttl):
+            return snapshot
+
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.version != self.version or _expired(snapshot, ttl):
+                snapshot = _build_snapshot(self.version)
+                self.snapshot = snapshot
+            return snapshot
+
+
+def _expired(snapshot: CatalogSnapshot, ttl: float) -> bool:
+    return bool(ttl) and (time.monotonic() - snapshot.built_at) > ttl
+
+
+def _build_snapshot(version: int) -> CatalogSnapshot:
+    rows = (
+        db.session.query(
+            Toy.id,
+            Toy.name,
+            Toy.description,
+            Toy.price,
+            Toy.image_url,
+            Toy.category,
+            Toy.age_range,
+            Toy.gender_category,
+            Toy.stock,
+            Toy.created_at,
+        )
+        .filter(Toy.is_active == True)  # noqa: E712
+        .order_by(Toy.created_at.desc(), Toy.id.desc())
+        .all()
+    )
+    toys = [
+        CatalogToy(
+            id=row.id,
+            name=row.name,
+            description=row.description,
+            price=float(row.price or 0.0),
+            image_url=row.image_url,
+            category=row.category,
+            age_range=row.age_range,
+            gender_category=row.gender_category,
+            stock=row.stock or 0,
+            created_at=row.created_at,
+        )
+        for row in rows
+    ]
+
+    active_ids = {toy.id for toy in toys}
+    grouped: Dict[int, set] = {}
+    availability = db.session.query(ToyCenterAvailability.toy_id, ToyCenterAvailability.center).all()
+    for toy_id, center in availability:
+        if toy_id not in active_ids:
+            continue
+        slug = normalize_center_slug(center)
+        if slug:
+            grouped.setdefault(toy_id, set()).add(slug)
+
+    centers = {toy_id: frozenset(slugs) for toy_id, slugs in grouped.items()}
+    return CatalogSnapshot(toys, centers, version)
+
+
+def _holder(app=None) -> _SnapshotHolder:
+    app = app or current_app._get_current_object()
+    holder = app.extensions.get(_EXTENSION_KEY)
+    if holder is None:
+        holder = app.extensions.setdefault(_EXTENSION_KEY, _SnapshotHolder())
+    return holder
+
+
+def get_catalog_snapshot() -> CatalogSnapshot:
+    """Return the current catalog snapshot, rebuilding it if it is stale."""
+    ttl = current_app.config.get("CATALOG_SNAPSHOT_TTL", 60)
+    return _holder().get(ttl)
+
+
+def invalidate_catalog(app=None) -> None:
+    """Mark the catalog snapshot as stale after toys, stock or centers change."""
+    try:
+        _holder(app).invalidate()
+    except RuntimeError:
+        # Fuera de un contexto de aplicación no hay snapshot que invalidar.
+        pass
+
+    # Las búsquedas cacheadas en cache_system dependen de la generación del catálogo
+    try:
+        from cache_system import ToyCache
+    except ImportError:
+        return
+    ToyCache.invalidate_catalog()
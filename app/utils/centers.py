@@ -1,8 +1,12 @@
 """Utilities for collecting and normalizing center information."""
 from __future__ import annotations
 
-from typing import Dict, Iterable, List, Sequence, Tuple
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
+from flask import current_app
 from sqlalchemy import func
 
 from ..extensions import db
@@ -60,3 +64,93 @@ def collect_center_choices() -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
 
     choices = sorted(((slug, name) for slug, name in slug_to_name.items()), key=lambda item: item[1].lower())
     return choices, slug_to_name
+
+
+# Copia de solo lectura de un Center, segura para usar fuera de la sesión
+CenterEntry = namedtuple("CenterEntry", ("id", "slug", "name", "discount_percentage"))
+
+_REGISTRY_KEY = "center_registry"
+
+
+class CenterRegistrySnapshot:
+    """Centers, choices and slug lookup captured from one load."""
+
+    def __init__(self, centers: Sequence[CenterEntry], choices: List[Tuple[str, str]], by_slug: Dict[str, str]):
+        self.loaded_at = time.monotonic()
+        self.centers: Tuple[CenterEntry, ...] = tuple(centers)
+        self.choices = choices
+        self.by_slug = by_slug
+
+
+class CenterRegistry:
+    """Per-app cache of center data used by templates and forms.
+
+    Centers change a few times a year, so the registry is reloaded only when
+    its TTL (``CENTER_REGISTRY_TTL``) expires or a writer calls
+    :func:`invalidate_centers` after committing.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.snapshot: Optional[CenterRegistrySnapshot] = None
+        self._snapshot_version = -1
+        self.lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.version += 1
+
+    def _fresh(self, ttl: float) -> bool:
+        snapshot = self.snapshot
+        if snapshot is None or self._snapshot_version != self.version:
+            return False
+        return not ttl or (time.monotonic() - snapshot.loaded_at) <= ttl
+
+    def get(self, ttl: float) -> CenterRegistrySnapshot:
+        if self._fresh(ttl):
+            return self.snapshot
+        with self.lock:
+            if not self._fresh(ttl):
+                version = self.version
+                self.snapshot = _load_registry()
+                self._snapshot_version = version
+            return self.snapshot
+
+
+def _load_registry() -> CenterRegistrySnapshot:
+    try:
+        rows = db.session.query(Center.id, Center.slug, Center.name, Center.discount_percentage).order_by(Center.name.asc()).all()
+        centers = [CenterEntry(row.id, row.slug, row.name, row.discount_percentage) for row in rows]
+    except Exception:
+        centers = []
+    choices, by_slug = collect_center_choices()
+    return CenterRegistrySnapshot(centers, choices, by_slug)
+
+
+def _registry(app=None) -> CenterRegistry:
+    app = app or current_app._get_current_object()
+    registry = app.extensions.get(_REGISTRY_KEY)
+    if registry is None:
+        registry = app.extensions.setdefault(_REGISTRY_KEY, CenterRegistry())
+    return registry
+
+
+def get_center_registry() -> CenterRegistrySnapshot:
+    """Return cached center data, reloading it when stale."""
+    ttl = current_app.config.get("CENTER_REGISTRY_TTL", 300)
+    return _registry().get(ttl)
+
+
+def cached_center_choices() -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
+    """Cached equivalent of :func:`collect_center_choices`."""
+    registry = get_center_registry()
+    return registry.choices, registry.by_slug
+
+
+def invalidate_centers(app=None) -> None:
+    """Mark center data as stale after centers or user/toy centers change."""
+    try:
+        _registry(app).invalidate()
+    except RuntimeError:
+        # Fuera de un contexto de aplicación no hay registro que invalidar.
+        pass
@@ -0,0 +1,151 @@
+"""Checkout engine: conditional stock and balance updates.
+
+The checkout used to lock each toy with ``with_for_update()``, compare
+``toy.stock`` in Python and decrement it on the ORM object, then subtract
+the total from ``current_user.balance``.  SQLite ignores ``FOR UPDATE``,
+so two concurrent checkouts could both pass the Python check and oversell.
+
+:func:`place_order` instead lets the database check and decrement in one
+statement per line::
+
+    UPDATE toy SET stock = stock - :q WHERE id = :id AND stock >= :q
+
+and debits the balance the same way (``... AND balance >= :amount``).  A
+statement that matches no row means the line (or the balance) failed;
+every line is attempted so the caller gets the full list of failures in
+:class:`CheckoutError`, and rolls the transaction back.  Lines are updated
+in toy id order so row locks are taken deterministically.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import select, update
+
+from ..extensions import db
+from ..models import Order, OrderItem, Toy, User
+from .cart_hydration import PricedLine
+from .popularity import record_sales
+from .rollups import record_order
+
+
+class LineFailure(NamedTuple):
+    toy_id: int
+    name: str
+    requested: int
+    available: int
+
+    @property
+    def message(self) -> str:
+        return (
+            f"Stock insuficiente para {self.name}. "
+            f"Disponible: {self.available}, Solicitado: {self.requested}"
+        )
+
+
+class CheckoutError(Exception):
+    """The order could not be placed; nothing was applied once rolled back."""
+
+    def __init__(self, message: str, failures: Sequence[LineFailure] = (), reason: str = "stock"):
+        super().__init__(message)
+        self.failures = list(failures)
+        self.reason = reason
+
+    @property
+    def messages(self) -> List[str]:
+        return [failure.message for failure in self.failures] or [str(self)]
+
+
+def reserve_stock(lines: Sequence[PricedLine]) -> List[LineFailure]:
+    """Decrement stock for every line that still fits; return the ones that did not."""
+    table = Toy.__table__
+    failed: List[PricedLine] = []
+    for line in sorted(lines, key=lambda line: line.toy_id):
+        result = db.session.execute(
+            update(table)
+            .where(table.c.id == line.toy_id, table.c.stock >= line.quantity)
+            .values(stock=table.c.stock - line.quantity)
+        )
+        if result.rowcount != 1:
+            failed.append(line)
+    if not failed:
+        return []
+
+    available = dict(
+        db.session.execute(
+            select(table.c.id, table.c.stock).where(table.c.id.in_([line.toy_id for line in failed]))
+        ).all()
+    )
+    return [
+        LineFailure(line.toy_id, line.name, line.quantity, int(available.get(line.toy_id) or 0))
+        for line in failed
+    ]
+
+
+def debit_balance(user_id: int, amount: float) -> bool:
+    """Subtract ``amount`` from the user's balance only if it covers it."""
+    table = User.__table__
+    result = db.session.execute(
+        update(table)
+        .where(table.c.id == user_id, table.c.balance >= amount)
+        .values(balance=table.c.balance - amount)
+    )
+    return result.rowcount == 1
+
+
+def place_order(
+    user_id: int,
+    lines: Sequence[PricedLine],
+    *,
+    subtotal: float,
+    total: float,
+    discount_percentage: float = 0.0,
+    discount_amount: float = 0.0,
+    discount_center: Optional[str] = None,
+) -> Order:
+    """Create the order for ``lines`` inside the caller's transaction.
+
+    Raises :class:`CheckoutError` (``reason`` ``"empty"``, ``"stock"`` or
+    ``"balance"``); the caller must roll back in that case and commit
+    otherwise.
+    """
+    if not lines:
+        raise CheckoutError("Tu carrito está vacío", reason="empty")
+
+    failures = reserve_stock(lines)
+    if failures:
+        raise CheckoutError("Stock insuficiente", failures, reason="stock")
+
+    if not debit_balance(user_id, total):
+        raise CheckoutError("No tienes suficientes ALOHA Dollars", reason="balance")
+
+    # Centro y categorías al momento de la venta (los rollups no releen al usuario ni al juguete)
+    buyer_center = db.session.execute(select(User.center).where(User.id == user_id)).scalar()
+    categories = {line.toy_id: line.toy.category for line in lines if line.toy is not None}
+    unknown = [line.toy_id for line in lines if line.toy is None]
+    if unknown:
+        categories.update(db.session.execute(select(Toy.id, Toy.category).where(Toy.id.in_(unknown))).all())
+
+    order = Order(
+        user_id=user_id,
+        subtotal_price=subtotal,
+        discount_percentage=discount_percentage,
+        discount_amount=discount_amount,
+        discounted_total=total,
+        discount_center=discount_center,
+        center=discount_center or buyer_center or '',
+        total_price=total,
+        order_date=datetime.now(),
+        status='completada',
+    )
+    db.session.add(order)
+    for line in lines:
+        db.session.add(OrderItem(order=order, toy_id=line.toy_id, quantity=line.quantity, price=line.unit_price,
+                                 category=categories.get(line.toy_id) or ''))
+
+    # Popularidad y ventas diarias materializadas (misma transacción que la orden)
+    record_sales((line.toy_id, line.quantity) for line in lines)
+    db.session.flush()
+    record_order(order)
+    return order
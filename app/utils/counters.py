@@ -0,0 +1,57 @@
+"""Helpers for maintaining additive counter tables (popularity, rollups)."""
+from __future__ import annotations
+
+from typing import Iterable, Mapping, Sequence
+
+from sqlalchemy import update
+
+from ..extensions import db
+
+
+def _dialect_insert(table):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(table)
+
+
+def increment_counters(
+    model,
+    rows: Iterable[Mapping],
+    key_columns: Sequence[str],
+    counter_columns: Sequence[str],
+    extra_values: Mapping | None = None,
+) -> None:
+    """Add ``counter_columns`` of each row onto the matching record.
+
+    Rows are matched on ``key_columns``; missing records are inserted.  The
+    statement runs inside the caller's transaction so counters commit (or
+    roll back) together with the change that produced them.  On SQLite and
+    PostgreSQL this is a single ``INSERT ... ON CONFLICT DO UPDATE`` per row;
+    other dialects use ``UPDATE`` and fall back to ``INSERT``.
+    """
+    table = model.__table__
+    extra_values = dict(extra_values or {})
+    rows = [dict(row) for row in rows]
+    if not rows:
+        return
+
+    stmt = _dialect_insert(table)
+    if stmt is not None:
+        set_ = {name: table.c[name] + stmt.excluded[name] for name in counter_columns}
+        set_.update({name: stmt.excluded[name] for name in extra_values})
+        stmt = stmt.on_conflict_do_update(index_elements=list(key_columns), set_=set_)
+        db.session.execute(stmt, [{**row, **extra_values} for row in rows])
+        return
+
+    for row in rows:
+        condition = [table.c[name] == row[name] for name in key_columns]
+        values = {name: table.c[name] + row[name] for name in counter_columns}
+        values.update(extra_values)
+        result = db.session.execute(update(table).where(*condition).values(**values))
+        if not result.rowcount:
+            db.session.execute(table.insert().values(**row, **extra_values))
@@ -0,0 +1,215 @@
+"""Streaming CSV exports for the admin panel.
+
+``export_orders`` and ``export_inventory`` used to build the whole file in
+an ``io.StringIO`` before answering, and ``export_orders`` lazy-loaded
+``order.items`` and ``order.user`` for every order (one query per order
+and relationship).  Year-end exports timed out and held the full history in
+worker memory.
+
+Here each export is a single query (orders join their user and an
+``order_item`` subquery pre-aggregated per order) iterated with
+``yield_per`` so rows are fetched in batches, turned into CSV text every
+``CHUNK_ROWS`` rows and sent with ``stream_with_context``.  The optional
+gzip output compresses chunk by chunk as well, so memory stays flat no
+matter how many rows are exported.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import zlib
+from datetime import date, datetime, timedelta
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence
+from urllib.parse import quote
+
+from flask import Response, stream_with_context
+from werkzeug.utils import secure_filename
+from sqlalchemy import exists, func, select
+
+from ..extensions import db
+from ..models import Order, OrderItem, Toy, ToyCenterAvailability, User
+from .centers import normalize_center_slug
+
+CHUNK_ROWS = 500
+YIELD_PER = 1000
+ORDER_HEADER = ['ID', 'Fecha', 'Usuario', 'Centro', 'Total', 'Items']
+INVENTORY_HEADER = ['ID', 'Nombre', 'Categoría', 'Precio', 'Stock', 'Activo']
+INVENTORY_STATUSES = ('active', 'inactive')
+ALL = 'all'
+
+
+def _parse_day(value: Optional[str], label: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Fecha {label} inválida: '{value}' (use AAAA-MM-DD)")
+
+
+class ExportFilters(NamedTuple):
+    start: Optional[date] = None
+    end: Optional[date] = None
+    center: Optional[str] = None
+    status: Optional[str] = None
+
+    @classmethod
+    def from_args(cls, args) -> "ExportFilters":
+        """Read ``start``, ``end`` (inclusive), ``center`` and ``status``; raises ``ValueError``."""
+        start = _parse_day(args.get('start'), 'inicial')
+        end = _parse_day(args.get('end'), 'final')
+        if start and end and start > end:
+            raise ValueError('La fecha inicial es posterior a la final')
+        center = args.get('center') or None
+        status = args.get('status') or None
+        return cls(
+            start=start,
+            end=end,
+            center=normalize_center_slug(center) if center and center != ALL else None,
+            status=status if status != ALL else None,
+        )
+
+    def filename(self, base: str) -> str:
+        parts = [base]
+        if self.start or self.end:
+            parts.append(f"{self.start or 'inicio'}_{self.end or 'hoy'}")
+        # centro y estado vienen de la URL: solo caracteres seguros para la cabecera
+        for value in (self.center, self.status):
+            safe = secure_filename(value or '')
+            if safe:
+                parts.append(safe)
+        return '_'.join(parts) + '.csv'
+
+
+def _order_conditions(filters: ExportFilters) -> List:
+    # Rango sargable sobre order_date (usa el índice)
+    conditions = []
+    if filters.start:
+        conditions.append(Order.order_date >= datetime.combine(filters.start, datetime.min.time()))
+    if filters.end:
+        conditions.append(Order.order_date < datetime.combine(filters.end + timedelta(days=1), datetime.min.time()))
+    if filters.status:
+        conditions.append(Order.status == filters.status)
+    return conditions
+
+
+def _stream(statement, format_row) -> Iterator[list]:
+    """Run ``statement`` lazily, fetching ``YIELD_PER`` rows at a time."""
+    result = db.session.execute(statement, execution_options={'yield_per': YIELD_PER})
+    for row in result:
+        yield format_row(*row)
+
+
+def order_rows(filters: ExportFilters = ExportFilters()) -> Iterator[list]:
+    """Orders (newest first) as CSV rows, from one streamed query."""
+    conditions = _order_conditions(filters)
+    item_counts = (
+        select(OrderItem.order_id, func.sum(OrderItem.quantity).label('item_count'))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(*conditions)
+        .group_by(OrderItem.order_id)
+        .subquery()
+    )
+    statement = (
+        select(
+            Order.id,
+            Order.order_date,
+            User.username,
+            User.center,
+            Order.total_price,
+            func.coalesce(item_counts.c.item_count, 0),
+        )
+        .select_from(Order)
+        .outerjoin(User, User.id == Order.user_id)
+        .outerjoin(item_counts, item_counts.c.order_id == Order.id)
+        .where(*conditions)
+        .order_by(Order.order_date.desc(), Order.id.desc())
+    )
+    if filters.center:
+        statement = statement.where(User.center == filters.center)
+
+    return _stream(statement, lambda order_id, order_date, username, center, total, items: [
+        order_id,
+        order_date.strftime('%Y-%m-%d %H:%M') if order_date else '',
+        username or '',
+        center or '',
+        f"{total or 0:.2f}",
+        int(items or 0),
+    ])
+
+
+def inventory_rows(filters: ExportFilters = ExportFilters()) -> Iterator[list]:
+    """Non-deleted toys (by name) as CSV rows, from one streamed query.
+
+    Filters are validated right away; the query only runs when iterated.
+    """
+    if filters.status and filters.status not in INVENTORY_STATUSES:
+        raise ValueError(f"Estado no soportado: {filters.status}")
+    statement = (
+        select(Toy.id, Toy.name, Toy.category, Toy.price, Toy.stock, Toy.is_active)
+        .where(Toy.deleted_at.is_(None))
+        .order_by(Toy.name.asc(), Toy.id)
+    )
+    if filters.status:
+        statement = statement.where(Toy.is_active == (filters.status == 'active'))
+    if filters.center:
+        statement = statement.where(
+            exists().where(
+                ToyCenterAvailability.toy_id == Toy.id,
+                ToyCenterAvailability.center == filters.center,
+            )
+        )
+
+    return _stream(statement, lambda toy_id, name, category, price, stock, is_active: [
+        toy_id, name, category, f"{price or 0:.2f}", stock, 'Sí' if is_active else 'No',
+    ])
+
+
+def csv_chunks(header: Sequence[str], rows: Iterable[Sequence], chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """CSV text in pieces of ``chunk_rows`` rows (header included in the first)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """Compress a stream of text chunks into one gzip member, incrementally."""
+    # wbits=31: cabecera y cola gzip en lugar de zlib
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def csv_response(filename: str, header: Sequence[str], rows: Iterable[Sequence], *,
+                 compress: bool = False) -> Response:
+    """Streamed CSV download (``.csv.gz`` when ``compress``)."""
+    chunks = csv_chunks(header, rows)
+    if compress:
+        body, mimetype, filename = gzip_chunks(chunks), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = (chunk.encode('utf-8') for chunk in chunks), 'text/csv'
+    # Nombre seguro entre comillas; si hubo que cambiarlo, el original va en filename* (RFC 5987)
+    fallback = secure_filename(filename) or 'export.csv'
+    disposition = f'attachment; filename="{fallback}"'
+    if fallback != filename:
+        disposition += f"; filename*=UTF-8''{quote(filename)}"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': disposition,
+            # Evitar que un proxy acumule la respuesta completa
+            'X-Accel-Buffering': 'no',
+        },
+    )
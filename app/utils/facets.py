@@ -0,0 +1,152 @@
+"""Drill-down facet counts for toy search computed over the catalog snapshot.
+
+Instead of one ``GROUP BY`` per facet over the whole table, the counts are
+built in a single pass over :class:`~app.utils.catalog.CatalogSnapshot`
+toys.  Each toy is checked against every active filter; a toy that fails
+no filter counts in every facet, and a toy that fails exactly one facet
+filter still counts in *that* facet.  This gives the usual faceted-search
+behaviour: the counts of a facet reflect the query and every other filter,
+so shoppers can see how many results they would get by switching value.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+from .catalog import CatalogToy
+
+# (etiqueta, mínimo, máximo); ambos extremos son inclusivos, como los filtros
+# price_min/price_max, así que un precio justo en el límite cuenta en los dos
+# rangos vecinos.  None significa sin límite.
+PRICE_BUCKETS: Tuple[Tuple[str, float, Optional[float]], ...] = (
+    ('Menos de $10', 0, 10),
+    ('$10 - $25', 10, 25),
+    ('$25 - $50', 25, 50),
+    ('$50 - $100', 50, 100),
+    ('Más de $100', 100, None),
+)
+
+# (nombre de la faceta, atributo del juguete)
+VALUE_FACETS: Tuple[Tuple[str, str], ...] = (
+    ('categories', 'category'),
+    ('age_ranges', 'age_range'),
+    ('genders', 'gender_category'),
+)
+
+PRICE_FACET = 'price_ranges'
+
+
+def _to_float(value) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _price_buckets(price: float) -> List[int]:
+    """Rangos que devolverían este precio al elegirlos como price_min/price_max"""
+    return [
+        index
+        for index, (_label, low, high) in enumerate(PRICE_BUCKETS)
+        if price >= low and (high is None or price <= high)
+    ]
+
+
+def _text_matcher(text: Optional[str]):
+    """All words must appear in name, description or category (like the ilike fallback)."""
+    terms = [term.casefold() for term in (text or '').split()]
+    if not terms:
+        return None
+
+    def matches(toy: CatalogToy) -> bool:
+        haystack = ' '.join(value for value in (toy.name, toy.description, toy.category) if value).casefold()
+        return all(term in haystack for term in terms)
+
+    return matches
+
+
+def compute_facets(
+    toys: Iterable[CatalogToy],
+    filters: Optional[Dict] = None,
+    *,
+    ids: Optional[Collection[int]] = None,
+    text: Optional[str] = None,
+) -> Dict:
+    """Return category, age range, gender and price facets for the current search.
+
+    ``ids`` restricts the base result set to precomputed matches (full-text
+    index); ``text`` is the substring fallback when no index is available.
+    ``filters`` uses the same keys as ``AdvancedSearchEngine._apply_filters``.
+    """
+    filters = filters or {}
+    selected = {
+        'categories': filters.get('category') or None,
+        'age_ranges': filters.get('age_range') or None,
+        'genders': filters.get('gender') or filters.get('gender_category') or None,
+    }
+    price_min = _to_float(filters.get('price_min'))
+    price_max = _to_float(filters.get('price_max'))
+    in_stock = bool(filters.get('in_stock'))
+    matches_text = _text_matcher(text) if ids is None else None
+
+    counts = {name: Counter() for name, _attribute in VALUE_FACETS}
+    price_counts: Counter = Counter()
+    known_values = {name: set() for name, _attribute in VALUE_FACETS}
+
+    for toy in toys:
+        for name, attribute in VALUE_FACETS:
+            value = getattr(toy, attribute)
+            if value:
+                known_values[name].add(value)
+
+        # Filtros que no son facetas: texto y stock
+        if ids is not None and toy.id not in ids:
+            continue
+        if matches_text is not None and not matches_text(toy):
+            continue
+        if in_stock and toy.stock <= 0:
+            continue
+
+        failed = [
+            name
+            for name, attribute in VALUE_FACETS
+            if selected[name] is not None and getattr(toy, attribute) != selected[name]
+        ]
+        if (price_min is not None and toy.price < price_min) or (price_max is not None and toy.price > price_max):
+            failed.append(PRICE_FACET)
+        if len(failed) > 1:
+            continue
+
+        for name, attribute in VALUE_FACETS:
+            if not failed or failed[0] == name:
+                value = getattr(toy, attribute)
+                if value:
+                    counts[name][value] += 1
+        if not failed or failed[0] == PRICE_FACET:
+            for bucket in _price_buckets(toy.price):
+                price_counts[bucket] += 1
+
+    facets: Dict[str, List[Dict]] = {}
+    for name, _attribute in VALUE_FACETS:
+        facets[name] = [
+            {
+                'value': value,
+                'label': value,
+                'count': counts[name][value],
+                'active': selected[name] == value,
+            }
+            for value in sorted(known_values[name])
+        ]
+    facets[PRICE_FACET] = [
+        {
+            'label': label,
+            'min': low,
+            'max': high,
+            'count': price_counts[index],
+            'active': price_min == low and price_max == high,
+        }
+        for index, (label, low, high) in enumerate(PRICE_BUCKETS)
+    ]
+    return facets
@@ -0,0 +1,144 @@
+"""Background jobs run after checkout (receipt PDF and text summary).
+
+``create_app`` sets ``app.task_queue`` to an ``rq.Queue`` when ``rq`` is
+installed.  :class:`JobRunner` sends jobs there if Redis answers a ping;
+otherwise (or when an ``enqueue`` fails) it uses an in-process
+``ThreadPoolExecutor`` so the checkout request still returns as soon as
+the order commits.  ``ORDER_JOBS_MODE`` picks the strategy:
+
+* ``auto`` (default): rq when available, otherwise the thread pool.
+* ``rq`` / ``thread``: force one of them (``rq`` falls back to threads).
+* ``eager``: run inline; handy in tests and scripts.
+* ``off``: do nothing; the receipt is rendered on first download instead.
+
+Under ``TESTING`` the default is ``off`` so test runs do not write files.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from flask import current_app, has_app_context
+
+from ..extensions import db
+from ..models import Order
+
+_EXTENSION_KEY = "job_runner"
+_worker_app = None
+_worker_app_lock = threading.Lock()
+
+
+def order_summary_path(app, order_id: int) -> str:
+    folder = app.config.get('ORDER_SUMMARY_DIR') or os.path.join(os.path.dirname(app.root_path), 'orders')
+    return os.path.join(folder, f"order_{order_id}.txt")
+
+
+def _render_order_documents(order_id: int) -> bool:
+    from utils import save_order_summary
+    from .receipts import get_receipt_renderer
+
+    app = current_app._get_current_object()
+    order = db.session.get(Order, order_id)
+    if order is None or not order.items:
+        app.logger.warning(f"Orden {order_id} no encontrada para generar documentos")
+        return False
+    get_receipt_renderer(app).get(order)
+    return save_order_summary(order, order_summary_path(app, order_id))
+
+
+def _get_worker_app():
+    """App used by rq workers, which run outside any Flask context."""
+    global _worker_app
+    with _worker_app_lock:
+        if _worker_app is None:
+            from app import create_app
+            _worker_app = create_app()
+    return _worker_app
+
+
+def render_order_documents(order_id: int) -> bool:
+    """Job: render the PDF receipt into the cache and write ``orders/order_<id>.txt``."""
+    if has_app_context():
+        return _render_order_documents(order_id)
+    with _get_worker_app().app_context():
+        return _render_order_documents(order_id)
+
+
+def _reachable_queue(app):
+    """``app.task_queue`` if its Redis connection answers, else ``None``."""
+    queue = getattr(app, 'task_queue', None)
+    if queue is None:
+        return None
+    try:
+        queue.connection.ping()
+        return queue
+    except Exception:
+        return None
+
+
+class JobRunner:
+    """Dispatches jobs to rq, a local thread pool, or runs them inline."""
+
+    def __init__(self, app, mode: str, max_workers: int = 2):
+        self.app = app
+        self.queue = _reachable_queue(app) if mode in ('auto', 'rq') else None
+        if mode == 'rq' and self.queue is None:
+            app.logger.warning("ORDER_JOBS_MODE=rq pero Redis no responde; usando hilos locales")
+        self.mode = 'rq' if self.queue is not None else ('thread' if mode in ('auto', 'rq') else mode)
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _run_in_app(self, func, *args):
+        with self.app.app_context():
+            try:
+                return func(*args)
+            except Exception:
+                self.app.logger.exception(f"Error en tarea en segundo plano {func.__name__}{args}")
+                raise
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='aloha-jobs')
+            return self._executor
+
+    def submit(self, func, *args):
+        """Run ``func(*args)`` according to the configured mode."""
+        if self.mode == 'off':
+            return None
+        if self.mode == 'eager':
+            return func(*args)
+        if self.mode == 'rq':
+            try:
+                return self.queue.enqueue(func, *args)
+            except Exception as exc:
+                # Redis se cayó después de arrancar: no perder el trabajo
+                self.app.logger.warning(f"No se pudo encolar {func.__name__} en rq, usando hilos locales: {exc}")
+        return self._get_executor().submit(self._run_in_app, func, *args)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def get_job_runner(app=None) -> JobRunner:
+    """Return the app's job runner, created on first use."""
+    app = app or current_app._get_current_object()
+    runner = app.extensions.get(_EXTENSION_KEY)
+    if runner is None:
+        mode = (app.config.get('ORDER_JOBS_MODE') or ('off' if app.testing else 'auto')).lower()
+        runner = app.extensions.setdefault(
+            _EXTENSION_KEY,
+            JobRunner(app, mode, max_workers=int(app.config.get('ORDER_JOBS_WORKERS', 2))),
+        )
+    return runner
+
+
+def enqueue_order_documents(order_id: int, app=None):
+    """Queue the receipt/summary job for a freshly committed order."""
+    return get_job_runner(app).submit(render_order_documents, order_id)
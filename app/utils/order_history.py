@@ -0,0 +1,113 @@
+"""Paginated order history for the user profile.
+
+``user.profile`` used to load every order of the user and then touch
+``order.items`` per order to add up quantities (one extra query per
+order, no pagination).  :func:`order_history` returns one page with a
+single aggregate query: orders outer-joined with their items and grouped
+per order, filtered by ``user_id`` and walked newest first with a keyset
+cursor on ``(order_date, id)`` so every page is served by the
+``ix_order_user_date`` index instead of an ``OFFSET`` scan.
+
+The profile renders the first page; "load more" asks ``/user/orders``
+for the next one with the opaque ``cursor`` returned by the previous page,
+built with the same codec as the catalog cursors in ``pagination_helpers``.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select
+
+from pagination_helpers import decode_cursor as decode_keyset, encode_cursor as encode_keyset
+
+from ..extensions import db
+from ..filters import format_currency
+from ..models import Order, OrderItem
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Orden del cursor; un cursor de otro listado no se acepta
+CURSOR_SORT = 'order_history'
+
+
+class OrderRow(NamedTuple):
+    id: int
+    order_date: datetime
+    status: str
+    total_price: float
+    item_count: int
+
+    def as_dict(self) -> Dict:
+        """Formato de la vista de perfil (también usado por el JSON)."""
+        return {
+            'id': self.id,
+            'order_date': self.order_date.strftime('%d/%m/%Y %H:%M'),
+            'order_date_iso': self.order_date.isoformat(),
+            'total': format_currency(self.total_price),
+            'status': self.status,
+            'item_count': self.item_count,
+        }
+
+
+class OrderPage(NamedTuple):
+    orders: List[OrderRow]
+    next_cursor: Optional[str]
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_cursor is not None
+
+
+def encode_cursor(order_date: datetime, order_id: int) -> str:
+    return encode_keyset(CURSOR_SORT, (order_date.isoformat(), order_id))
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of :func:`encode_cursor`; raises ``ValueError`` on bad input."""
+    key = decode_keyset(cursor, CURSOR_SORT)
+    try:
+        order_date, order_id = key
+        return datetime.fromisoformat(order_date), int(order_id)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f'Cursor inválido: {cursor}') from exc
+
+
+def order_history(user_id: int, *, limit: int = DEFAULT_PAGE_SIZE,
+                  cursor: Optional[str] = None) -> OrderPage:
+    """One page of the user's orders, newest first, with item counts."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    item_count = func.coalesce(func.sum(OrderItem.quantity), 0)
+    statement = (
+        select(Order.id, Order.order_date, Order.status, Order.total_price, item_count)
+        .select_from(Order)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.user_id == user_id)
+        .group_by(Order.id, Order.order_date, Order.status, Order.total_price)
+        .order_by(Order.order_date.desc(), Order.id.desc())
+        # Una fila extra indica si hay otra página
+        .limit(limit + 1)
+    )
+    if cursor:
+        after_date, after_id = decode_cursor(cursor)
+        statement = statement.where(or_(
+            Order.order_date < after_date,
+            and_(Order.order_date == after_date, Order.id < after_id),
+        ))
+
+    rows = [
+        OrderRow(order_id, order_date, status, float(total or 0), int(count or 0))
+        for order_id, order_date, status, total, count in db.session.execute(statement)
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].order_date, rows[-1].id)
+    return OrderPage(rows, next_cursor)
+
+
+def order_count(user_id: int) -> int:
+    """Number of orders of the user (index-only count)."""
+    return int(
+        db.session.execute(select(func.count(Order.id)).where(Order.user_id == user_id)).scalar() or 0
+    )
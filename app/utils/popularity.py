@@ -0,0 +1,112 @@
+"""Materialized per-toy popularity (units sold in active orders).
+
+``toy_popularity`` keeps one row per toy with ``SUM(OrderItem.quantity)``
+over active orders, so search and the ``popular`` sort read a single
+indexed value instead of aggregating ``order_item`` per result.  Checkout
+calls :func:`record_sales` and ``delete_order`` calls :func:`revert_sales`
+inside their own transactions; :func:`rebuild_popularity` recomputes the
+table from scratch with one ``GROUP BY``.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, Mapping, Tuple
+
+from sqlalchemy import func
+
+from ..extensions import db
+from ..models import Order, OrderItem, ToyPopularity
+from .counters import increment_counters
+
+
+def _normalize(quantities) -> Dict[int, int]:
+    if isinstance(quantities, Mapping):
+        pairs: Iterable[Tuple[int, int]] = quantities.items()
+    else:
+        pairs = quantities
+    totals: Counter = Counter()
+    for toy_id, quantity in pairs:
+        if toy_id is not None and quantity:
+            totals[int(toy_id)] += int(quantity)
+    return dict(totals)
+
+
+def _apply(quantities, sign: int) -> None:
+    totals = _normalize(quantities)
+    if not totals:
+        return
+    increment_counters(
+        ToyPopularity,
+        ({"toy_id": toy_id, "total_sold": sign * quantity} for toy_id, quantity in sorted(totals.items())),
+        key_columns=("toy_id",),
+        counter_columns=("total_sold",),
+        extra_values={"updated_at": datetime.now()},
+    )
+
+
+def record_sales(quantities) -> None:
+    """Add sold units; ``quantities`` is a ``{toy_id: qty}`` map or ``(toy_id, qty)`` pairs."""
+    _apply(quantities, 1)
+
+
+def revert_sales(quantities) -> None:
+    """Subtract units of a cancelled/deleted order."""
+    _apply(quantities, -1)
+
+
+def popularity_for(toy_ids: Iterable[int]) -> Dict[int, int]:
+    """Return ``{toy_id: total_sold}`` for the given ids in a single query."""
+    ids = {int(toy_id) for toy_id in toy_ids if toy_id is not None}
+    if not ids:
+        return {}
+    rows = (
+        db.session.query(ToyPopularity.toy_id, ToyPopularity.total_sold)
+        .filter(ToyPopularity.toy_id.in_(ids))
+        .all()
+    )
+    popularity = {toy_id: 0 for toy_id in ids}
+    popularity.update({row.toy_id: row.total_sold or 0 for row in rows})
+    return popularity
+
+
+def _aggregate_sales() -> Dict[int, int]:
+    rows = (
+        db.session.query(OrderItem.toy_id, func.sum(OrderItem.quantity))
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(Order.is_active == True)  # noqa: E712
+        .group_by(OrderItem.toy_id)
+        .all()
+    )
+    return {toy_id: int(total or 0) for toy_id, total in rows}
+
+
+def rebuild_popularity() -> int:
+    """Recompute the whole table from ``order_item`` and commit."""
+    totals = _aggregate_sales()
+    now = datetime.now()
+    db.session.query(ToyPopularity).delete(synchronize_session=False)
+    if totals:
+        db.session.execute(
+            ToyPopularity.__table__.insert(),
+            [{"toy_id": toy_id, "total_sold": total, "updated_at": now} for toy_id, total in totals.items()],
+        )
+    db.session.commit()
+    return len(totals)
+
+
+def ensure_popularity_table() -> None:
+    """Backfill ``toy_popularity`` on startup when it is empty but there are sales."""
+    has_rows = db.session.query(ToyPopularity.toy_id).limit(1).first() is not None
+    if has_rows:
+        return
+    has_sales = (
+        db.session.query(OrderItem.id)
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(Order.is_active == True)  # noqa: E712
+        .limit(1)
+        .first()
+        is not None
+    )
+    if has_sales:
+        rebuild_popularity()
@@ -0,0 +1,339 @@
+"""PDF receipt rendering with process-wide assets and an on-disk cache.
+
+``generate_pdf`` used to re-resolve the logo, re-register the Futura fonts
+and rebuild a ``getSampleStyleSheet()`` on every download, then lay out the
+whole document again.  Receipts rarely change once an order exists, so:
+
+* :func:`get_receipt_assets` registers fonts, builds the paragraph styles
+  and reads the logo image once per process (per logo path).
+* :class:`ReceiptRenderer` stores each rendered PDF under
+  ``RECEIPT_CACHE_DIR`` with a content-addressed name derived from the
+  order id and ``updated_at`` (``created_at`` for never-edited orders).
+  Editing or cancelling an order bumps ``updated_at`` and therefore the
+  key; stale files for the same order are removed when a new one is written.
+
+The key doubles as the ETag of the download route, so repeated downloads
+answer ``304 Not Modified`` without touching the file.
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import io
+import os
+import threading
+from decimal import Decimal, InvalidOperation
+from typing import Dict, NamedTuple, Optional
+
+from flask import current_app
+
+from ..models import Center
+from .cart_hydration import order_lines
+
+_EXTENSION_KEY = "receipt_renderer"
+# Cambiar si cambia el diseño del recibo para invalidar los PDFs ya guardados
+RENDER_VERSION = "1"
+
+_assets_lock = threading.Lock()
+_assets: Dict[str, "ReceiptAssets"] = {}
+
+
+def format_currency(amount) -> str:
+    return f"A$ {amount:,.2f}"
+
+
+class ReceiptAssets(NamedTuple):
+    font_normal: str
+    font_bold: str
+    styles: object
+    logo: Optional[bytes]
+
+
+def _resolve_logo_path(app) -> str:
+    static_folder = os.path.join(app.root_path, 'static')
+    default_logo_filename = 'ALOHALogo12.png'
+    configured = app.config.get('PDF_LOGO_PATH')
+    if not configured:
+        return os.path.join(static_folder, 'images', default_logo_filename)
+
+    path = os.path.normpath(configured)
+    if not os.path.isabs(path):
+        path = os.path.join(app.root_path, path)
+    if os.path.isdir(path):
+        return os.path.join(path, default_logo_filename)
+    _, ext = os.path.splitext(path)
+    return path if ext else os.path.join(path, default_logo_filename)
+
+
+def _register_fonts(app):
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    fonts_folder = os.path.join(app.root_path, 'static', 'fonts')
+    try:
+        for name, filename in (('Futura', 'Futura-Medium.ttf'), ('Futura-Bold', 'Futura-Bold.ttf')):
+            path = os.path.join(fonts_folder, filename)
+            if os.path.exists(path) and name not in pdfmetrics.getRegisteredFontNames():
+                pdfmetrics.registerFont(TTFont(name, path))
+    except Exception as exc:
+        app.logger.warning(f"Error al registrar fuentes Futura: {exc}. Se usarán fuentes por defecto.")
+
+    registered = pdfmetrics.getRegisteredFontNames()
+    return (
+        'Futura' if 'Futura' in registered else 'Helvetica',
+        'Futura-Bold' if 'Futura-Bold' in registered else 'Helvetica-Bold',
+    )
+
+
+def _build_styles(font_normal: str, font_bold: str):
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    base = getSampleStyleSheet()
+    definitions = {
+        'Title': {'parent': base['Heading1'], 'fontName': font_bold, 'fontSize': 18, 'leading': 22, 'spaceAfter': 10, 'alignment': TA_CENTER, 'textColor': colors.HexColor('#00796B')},
+        'Center': {'parent': base['Normal'], 'fontName': font_normal, 'alignment': TA_CENTER},
+        'Normal': {'parent': base['Normal'], 'fontName': font_normal, 'fontSize': 10, 'leading': 12},
+        'NormalBold': {'parent': base['Normal'], 'fontName': font_bold, 'fontSize': 10, 'leading': 12},
+        'Subtitle': {'parent': base['Normal'], 'fontName': font_bold, 'fontSize': 14, 'leading': 16, 'spaceAfter': 15, 'alignment': TA_CENTER, 'textColor': colors.HexColor('#004D40')},
+        'TableHeader': {'parent': base['Normal'], 'fontName': font_bold, 'fontSize': 10, 'textColor': colors.white, 'alignment': TA_CENTER, 'background': colors.HexColor('#4CAF50')},
+        'TableCell': {'parent': base['Normal'], 'fontName': font_normal, 'fontSize': 9},
+        'TotalText': {'parent': base['Normal'], 'fontName': font_bold, 'fontSize': 12, 'alignment': TA_RIGHT},
+    }
+    return {name: ParagraphStyle(name=f"Receipt{name}", **params) for name, params in definitions.items()}
+
+
+def get_receipt_assets(app=None) -> ReceiptAssets:
+    """Fonts, styles and logo bytes, loaded once per process and logo path."""
+    app = app or current_app._get_current_object()
+    logo_path = _resolve_logo_path(app)
+    assets = _assets.get(logo_path)
+    if assets is not None:
+        return assets
+    with _assets_lock:
+        assets = _assets.get(logo_path)
+        if assets is None:
+            font_normal, font_bold = _register_fonts(app)
+            logo = None
+            if os.path.exists(logo_path):
+                with open(logo_path, 'rb') as fh:
+                    logo = fh.read()
+            else:
+                app.logger.warning(f"Logo no encontrado en {logo_path}")
+            assets = ReceiptAssets(font_normal, font_bold, _build_styles(font_normal, font_bold), logo)
+            _assets[logo_path] = assets
+    return assets
+
+
+def receipt_key(order) -> str:
+    """Content address of an order's receipt (also used as its ETag)."""
+    stamp = order.updated_at or order.created_at or order.order_date
+    raw = f"{order.id}:{stamp.isoformat() if stamp else ''}:{RENDER_VERSION}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def render_receipt(order, assets: Optional[ReceiptAssets] = None) -> bytes:
+    """Lay out the receipt for ``order`` and return the PDF bytes."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    assets = assets or get_receipt_assets()
+    styles = assets.styles
+    buffer = io.BytesIO()
+    try:
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=letter,
+            rightMargin=36,
+            leftMargin=36,
+            topMargin=36,
+            bottomMargin=36
+        )
+        elements = []
+
+        # --- Logo de ALOHA ---
+        if assets.logo:
+            aloha_logo = Image(io.BytesIO(assets.logo), width=1.5*72, height=0.75*72)
+            aloha_logo.hAlign = 'LEFT'
+            elements.append(aloha_logo)
+            elements.append(Spacer(1, 12))
+        else:
+            elements.append(Paragraph("Tiendita ALOHA", styles["Title"]))
+
+        elements.append(Paragraph("Recibo de Compra", styles["Subtitle"]))
+        elements.append(Spacer(1, 20))
+
+        # Información de la orden
+        elements.append(Paragraph("<b>Información de la Orden</b>", styles["NormalBold"]))
+        elements.append(Paragraph(f"<b>Orden #:</b> {order.id}", styles["Normal"]))
+        elements.append(Paragraph(f"<b>Fecha:</b> {order.order_date.strftime('%d/%m/%Y %H:%M')}", styles["Normal"]))
+        elements.append(Spacer(1, 12))
+
+        # Información del usuario asociado
+        elements.append(Paragraph("<b>Información del Cliente</b>", styles["NormalBold"]))
+        user = getattr(order, "user", None)
+        if user:
+            user_details = [
+                ("Nombre de usuario", getattr(user, "username", "N/A") or "N/A"),
+                ("ID de usuario", getattr(user, "id", "N/A") or "N/A"),
+                ("Email", getattr(user, "email", None) or "No registrado"),
+                ("Centro", getattr(user, "center", None) or "No asignado"),
+            ]
+            for label, value in user_details:
+                elements.append(Paragraph(f"<b>{label}:</b> {value}", styles["Normal"]))
+        else:
+            elements.append(Paragraph("No hay información del usuario asociada a esta orden.", styles["Normal"]))
+
+        elements.append(Spacer(1, 20))
+
+        # Tabla de productos
+        data = [["Producto", "Cantidad", "Precio", "Subtotal"]]
+        for line in order_lines(order.id):
+            data.append([
+                line.name,
+                str(line.quantity),
+                format_currency(line.unit_price),
+                format_currency(line.subtotal)
+            ])
+        data = [[str(cell) for cell in row] for row in data]
+
+        header = styles['TableHeader']
+        table_style = [
+            ('BACKGROUND', (0, 0), (-1, 0), header.background),
+            ('TEXTCOLOR', (0, 0), (-1, 0), header.textColor),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), header.fontName),
+            ('FONTSIZE', (0, 0), (-1, 0), header.fontSize),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+            ('FONTNAME', (0, 1), (-1, -1), styles['TableCell'].fontName),
+            ('FONTSIZE', (0, 1), (-1, -1), styles['TableCell'].fontSize),
+            ('ALIGN', (0, 1), (0, -1), 'LEFT'),      # Columna Producto a la izquierda
+            ('ALIGN', (1, 1), (1, -1), 'CENTER'),  # Columna Cantidad al centro
+            ('ALIGN', (2, 1), (3, -1), 'RIGHT'),   # Columnas Precio y Subtotal a la derecha
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#DDDDDD'))
+        ]
+        table = Table(data, colWidths=[doc.width*0.5, doc.width*0.15, doc.width*0.15, doc.width*0.2])
+        table.setStyle(TableStyle(table_style))
+        elements.append(table)
+        elements.append(Spacer(1, 20))
+
+        subtotal_display = format_currency(getattr(order, 'subtotal_price', None) or order.total_price)
+        elements.append(Paragraph(f"<b>Subtotal:</b> {subtotal_display}", styles["TotalText"]))
+
+        discount_amount = getattr(order, 'discount_amount', 0) or 0
+        if discount_amount:
+            center_label = None
+            if getattr(order, 'discount_center', None):
+                center_obj = Center.query.filter_by(slug=order.discount_center).first()
+                center_label = center_obj.name if center_obj else order.discount_center
+            percent = getattr(order, 'discount_percentage', 0) or 0
+            label = ""
+            if center_label:
+                label = center_label
+                if percent:
+                    label = f"{label} ({percent:.0f}%)"
+            elif percent:
+                label = f"{percent:.0f}%"
+            prefix = f"<b>Descuento {label}:</b>" if label else "<b>Descuento:</b>"
+            elements.append(Paragraph(f"{prefix} -{format_currency(discount_amount)}", styles["TotalText"]))
+
+        elements.append(Paragraph(f"<b>Total:</b> {format_currency(order.total_price)}", styles["TotalText"]))
+        elements.append(Spacer(1, 30))
+
+        # Saldos del usuario relacionados a la compra
+        user_balance = getattr(user, "balance", None) if user else None
+        balance_before_purchase = None
+        if user_balance is not None:
+            try:
+                balance_before_purchase = Decimal(str(user_balance)) + Decimal(str(order.total_price or 0))
+            except (InvalidOperation, TypeError):
+                balance_before_purchase = None
+
+        if balance_before_purchase is not None:
+            elements.append(Paragraph(
+                f"<b>Saldo disponible antes de la compra:</b> {format_currency(float(balance_before_purchase))}",
+                styles["Normal"]
+            ))
+        if user_balance is not None:
+            elements.append(Paragraph(
+                f"<b>Saldo disponible despu&eacute;s de la compra:</b> {format_currency(user_balance)}",
+                styles["Normal"]
+            ))
+        if balance_before_purchase is not None or user_balance is not None:
+            elements.append(Spacer(1, 20))
+
+        # Mensaje de agradecimiento y datos de contacto
+        footer_lines = [
+            "&iexcl;Gracias por comprar en Tiendita ALOHA!",
+            "Si necesita ayuda, escr&iacute;banos a info@alohapanama.com o visite alohapanama.com."
+        ]
+        for line in footer_lines:
+            elements.append(Paragraph(line, styles["Center"]))
+
+        doc.build(elements)
+        pdf = buffer.getvalue()
+        if not pdf:
+            raise ValueError("No se pudo generar el PDF: el buffer está vacío")
+        return pdf
+    finally:
+        buffer.close()
+
+
+class CachedReceipt(NamedTuple):
+    path: str
+    etag: str
+
+
+class ReceiptRenderer:
+    """Renders receipts once and keeps them on disk, keyed by :func:`receipt_key`."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+
+    def path_for(self, order_id: int, key: str) -> str:
+        return os.path.join(self.cache_dir, f"receipt-{order_id}-{key}.pdf")
+
+    def cached(self, order) -> Optional[CachedReceipt]:
+        key = receipt_key(order)
+        path = self.path_for(order.id, key)
+        return CachedReceipt(path, key) if os.path.exists(path) else None
+
+    def get(self, order) -> CachedReceipt:
+        """Return the cached receipt for ``order``, rendering it if needed."""
+        hit = self.cached(order)
+        if hit is not None:
+            return hit
+
+        key = receipt_key(order)
+        path = self.path_for(order.id, key)
+        pdf = render_receipt(order)
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as fh:
+                fh.write(pdf)
+            os.replace(tmp_path, path)
+            # Quitar versiones anteriores del recibo de esta orden
+            for stale in glob.glob(os.path.join(self.cache_dir, f"receipt-{order.id}-*.pdf")):
+                if stale != path:
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+        return CachedReceipt(path, key)
+
+
+def get_receipt_renderer(app=None) -> ReceiptRenderer:
+    """Return the app's receipt renderer (cache in ``RECEIPT_CACHE_DIR``)."""
+    app = app or current_app._get_current_object()
+    renderer = app.extensions.get(_EXTENSION_KEY)
+    if renderer is None:
+        cache_dir = app.config.get('RECEIPT_CACHE_DIR') or os.path.join(app.instance_path, 'receipts')
+        renderer = app.extensions.setdefault(_EXTENSION_KEY, ReceiptRenderer(cache_dir))
+    return renderer
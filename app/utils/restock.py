@@ -0,0 +1,206 @@
+"""Set-based restock forecasting over the toy × day sales matrix.
+
+``InventoryManager.predict_restock_needs`` used to aggregate ``order_item``
+and then load every sold toy with its own query, using a flat 30-day mean.
+:func:`forecast_restock` reads the active catalog and the per-day units
+from ``sales_daily_toy`` (see :mod:`app.utils.rollups`) in one joined query,
+builds a toys × days matrix and derives, for every toy at once:
+
+* the daily sales rate (flat mean or exponentially weighted, newest days
+  weighing more),
+* days of stock coverage, low/critical flags,
+* predicted demand for the horizon and the suggested order quantity.
+
+NumPy is used when installed; otherwise the same weighted sums run in pure
+Python, so results do not depend on the optional dependency.
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import and_, case, func, select
+
+from ..extensions import db
+from ..models import SalesDailyToy, Toy
+from .sales import as_date
+
+try:  # Dependencia opcional
+    import numpy as np
+except ImportError:  # pragma: no cover - depende del entorno
+    np = None
+
+METHODS = ("mean", "ewma")
+
+
+class ForecastSettings(NamedTuple):
+    window_days: int = 30
+    method: str = "ewma"
+    # Vida media de la EWMA en días: una venta de hace ``halflife`` días pesa la mitad
+    halflife_days: float = 7.0
+    low_threshold: int = 5
+    critical_threshold: int = 2
+    safety_buffer: int = 10
+    min_order: int = 20
+
+    @classmethod
+    def from_config(cls, config, **overrides) -> "ForecastSettings":
+        values = {
+            "window_days": int(config.get("INVENTORY_FORECAST_WINDOW", cls._field_defaults["window_days"])),
+            "method": config.get("INVENTORY_FORECAST_METHOD", cls._field_defaults["method"]),
+            "halflife_days": float(config.get("INVENTORY_EWMA_HALFLIFE", cls._field_defaults["halflife_days"])),
+        }
+        values.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**values)
+
+
+class ToyForecast(NamedTuple):
+    toy_id: int
+    name: str
+    category: Optional[str]
+    stock: int
+    price: float
+    units_sold: int
+    daily_rate: float
+    coverage_days: Optional[float]
+    predicted_demand: float
+    needs_restock: bool
+    suggested_order_qty: int
+    alert_level: Optional[str]
+    urgency: str
+
+
+def window_weights(window_days: int, method: str, halflife_days: float) -> List[float]:
+    """Weights (oldest day first) that turn a daily series into a daily rate."""
+    if method not in METHODS:
+        raise ValueError(f"Método de pronóstico no soportado: {method}")
+    if method == "mean":
+        return [1.0 / window_days] * window_days
+    decay = 0.5 ** (1.0 / halflife_days)
+    raw = [decay ** age for age in range(window_days - 1, -1, -1)]
+    total = sum(raw)
+    return [weight / total for weight in raw]
+
+
+def _load_matrix(window_days: int, today: date):
+    """Active toys plus their per-day units in the window, in one query."""
+    first_day = today - timedelta(days=window_days - 1)
+    rows = db.session.execute(
+        select(
+            Toy.id, Toy.name, Toy.category, Toy.stock, Toy.price,
+            SalesDailyToy.day, SalesDailyToy.quantity,
+        )
+        .select_from(Toy)
+        .outerjoin(
+            SalesDailyToy,
+            and_(
+                SalesDailyToy.toy_id == Toy.id,
+                SalesDailyToy.day >= first_day,
+                SalesDailyToy.day <= today,
+            ),
+        )
+        .where(Toy.is_active == True)  # noqa: E712
+        .order_by(Toy.id)
+    ).all()
+
+    toys, index = [], {}
+    cells = []
+    for toy_id, name, category, stock, price, day, quantity in rows:
+        if toy_id not in index:
+            index[toy_id] = len(toys)
+            toys.append((toy_id, name, category, int(stock or 0), float(price or 0)))
+        if day is not None and quantity:
+            cells.append((index[toy_id], (as_date(day) - first_day).days, int(quantity)))
+    return toys, cells
+
+
+def _rates(n_toys: int, cells, weights: Sequence[float]):
+    """Units sold and weighted daily rate per toy."""
+    if np is not None:
+        matrix = np.zeros((n_toys, len(weights)))
+        for row, col, quantity in cells:
+            matrix[row, col] += quantity
+        return matrix.sum(axis=1).tolist(), (matrix @ np.asarray(weights)).tolist()
+
+    units = [0.0] * n_toys
+    rates = [0.0] * n_toys
+    for row, col, quantity in cells:
+        units[row] += quantity
+        rates[row] += quantity * weights[col]
+    return units, rates
+
+
+def forecast_restock(days_ahead: int = 30, settings: Optional[ForecastSettings] = None,
+                     *, today: Optional[date] = None) -> List[ToyForecast]:
+    """Forecast every active toy; callers filter on ``needs_restock``/``alert_level``."""
+    settings = settings or ForecastSettings()
+    today = today or date.today()
+    weights = window_weights(settings.window_days, settings.method, settings.halflife_days)
+    toys, cells = _load_matrix(settings.window_days, today)
+    units, rates = _rates(len(toys), cells, weights)
+
+    forecasts = []
+    for (toy_id, name, category, stock, price), sold, rate in zip(toys, units, rates):
+        # Quitar el ruido de punto flotante de la suma ponderada
+        rate = round(rate, 9)
+        demand = rate * days_ahead
+        needs_restock = sold > 0 and stock < demand
+        suggested = max(int(demand - stock + settings.safety_buffer), settings.min_order) if needs_restock else 0
+        if stock <= settings.critical_threshold:
+            alert_level = "CRÍTICO"
+        elif stock <= settings.low_threshold:
+            alert_level = "BAJO"
+        else:
+            alert_level = None
+        forecasts.append(ToyForecast(
+            toy_id=toy_id,
+            name=name,
+            category=category,
+            stock=stock,
+            price=price,
+            units_sold=int(sold),
+            daily_rate=rate,
+            coverage_days=round(stock / rate, 1) if rate > 0 else None,
+            predicted_demand=demand,
+            needs_restock=needs_restock,
+            suggested_order_qty=suggested,
+            alert_level=alert_level,
+            urgency="ALTA" if stock < rate * 7 else "MEDIA",
+        ))
+    return forecasts
+
+
+def inventory_stats(low_threshold: int, critical_threshold: int) -> Dict:
+    """Catalog totals and low-stock counts by category with one grouped query."""
+    low = case((Toy.stock <= low_threshold, 1), else_=0)
+    critical = case((Toy.stock <= critical_threshold, 1), else_=0)
+    rows = db.session.execute(
+        select(
+            Toy.category,
+            func.count(Toy.id),
+            func.coalesce(func.sum(Toy.stock), 0),
+            func.coalesce(func.sum(Toy.stock * Toy.price), 0),
+            func.sum(low),
+            func.sum(critical),
+        )
+        .where(Toy.is_active == True)  # noqa: E712
+        .group_by(Toy.category)
+    ).all()
+
+    stats = {
+        "total_products": 0,
+        "total_stock_units": 0,
+        "total_inventory_value": 0.0,
+        "low_stock_count": 0,
+        "critical_stock_count": 0,
+        "categories_with_low_stock": {},
+    }
+    for category, count, stock, value, low_count, critical_count in rows:
+        stats["total_products"] += int(count or 0)
+        stats["total_stock_units"] += int(stock or 0)
+        stats["total_inventory_value"] += float(value or 0)
+        stats["low_stock_count"] += int(low_count or 0)
+        stats["critical_stock_count"] += int(critical_count or 0)
+        if low_count:
+            stats["categories_with_low_stock"][category] = int(low_count)
+    return stats
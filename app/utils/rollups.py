@@ -0,0 +1,260 @@
+"""Daily sales rollups (by category, by center and by toy).
+
+The dashboard used to recompute ``SUM/COUNT/AVG`` over every order plus a
+``Toy ⋈ OrderItem ⋈ Order`` join for sales by category on every cache
+miss, so it slowed down as the order history grew.  Three small tables keep
+the same numbers per day instead:
+
+* ``sales_daily_category``: units and amount per toy category,
+* ``sales_daily_center``: orders and amount per center,
+* ``sales_daily_toy``: units and amount per toy.
+
+Checkout calls :func:`record_order` and ``delete_order`` calls
+:func:`revert_order` inside their own transactions, so the rollups always
+match the active orders.  Both, like rebuild and verify, use the category
+(``OrderItem.category``) and center (``Order.center``) stored at checkout,
+so recategorizing a toy or moving a user to another center never shifts
+past sales between buckets; the live toy and user rows are only read for
+rows created before those columns existed.  Amounts are kept in cents.  ``flask rollups
+rebuild`` recomputes everything from the order tables and ``flask rollups
+verify`` reports any drift.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+
+from ..extensions import db
+from ..models import (
+    Order,
+    OrderItem,
+    SalesDailyCategory,
+    SalesDailyCenter,
+    SalesDailyToy,
+    Toy,
+    User,
+)
+from .cart_store import to_cents
+from .counters import increment_counters
+from .sales import as_date
+
+# (modelo, columnas clave, columnas contador)
+_TABLES = (
+    (SalesDailyCategory, ("day", "category"), ("quantity", "amount_cents")),
+    (SalesDailyCenter, ("day", "center"), ("order_count", "amount_cents")),
+    (SalesDailyToy, ("day", "toy_id"), ("quantity", "amount_cents")),
+)
+
+
+class Contributions:
+    """Counters one or more orders add to each rollup table."""
+
+    def __init__(self):
+        self.tables: Dict[type, Dict[Tuple, Counter]] = {model: {} for model, _, _ in _TABLES}
+
+    def _add(self, model, key: Tuple, **counters) -> None:
+        bucket = self.tables[model].setdefault(key, Counter())
+        bucket.update(counters)
+
+    def add_order(self, day, center: Optional[str], total_price, items: Iterable[Tuple]) -> None:
+        """``items`` are ``(toy_id, category, quantity, price)`` tuples."""
+        day = as_date(day)
+        self._add(SalesDailyCenter, (day, center or ""), order_count=1, amount_cents=to_cents(total_price))
+        for toy_id, category, quantity, price in items:
+            quantity = int(quantity or 0)
+            cents = to_cents(price) * quantity
+            self._add(SalesDailyCategory, (day, category or ""), quantity=quantity, amount_cents=cents)
+            self._add(SalesDailyToy, (day, toy_id), quantity=quantity, amount_cents=cents)
+
+    def rows(self, model, sign: int = 1) -> List[Dict]:
+        _, key_columns, counter_columns = next(entry for entry in _TABLES if entry[0] is model)
+        return [
+            {
+                **dict(zip(key_columns, key)),
+                **{name: sign * counters.get(name, 0) for name in counter_columns},
+            }
+            for key, counters in sorted(self.tables[model].items(), key=lambda entry: entry[0])
+        ]
+
+
+def _order_contributions(order) -> Contributions:
+    items = list(order.items)
+    # Valores guardados en la venta; los vivos solo para filas sin ellos
+    toy_ids = {item.toy_id for item in items if item.category is None}
+    categories = dict(
+        db.session.execute(select(Toy.id, Toy.category).where(Toy.id.in_(toy_ids))).all()
+    ) if toy_ids else {}
+    center = order.center
+    if center is None:
+        center = order.discount_center
+        if not center and order.user_id is not None:
+            user = db.session.get(User, order.user_id)
+            center = user.center if user else None
+
+    contributions = Contributions()
+    contributions.add_order(
+        order.order_date,
+        center,
+        order.total_price,
+        (
+            (item.toy_id, item.category if item.category is not None else categories.get(item.toy_id),
+             item.quantity, item.price)
+            for item in items
+        ),
+    )
+    return contributions
+
+
+def _apply(contributions: Contributions, sign: int) -> None:
+    for model, key_columns, counter_columns in _TABLES:
+        rows = contributions.rows(model, sign)
+        if rows:
+            increment_counters(model, rows, key_columns=key_columns, counter_columns=counter_columns)
+
+
+def record_order(order) -> None:
+    """Add a just-placed order to the rollups (caller's transaction)."""
+    _apply(_order_contributions(order), 1)
+
+
+def revert_order(order) -> None:
+    """Subtract a cancelled order from the rollups (caller's transaction)."""
+    _apply(_order_contributions(order), -1)
+
+
+def _expected_contributions() -> Contributions:
+    """Recompute every rollup from the active orders with one streamed query."""
+    rows = db.session.execute(
+        select(
+            Order.id,
+            Order.order_date,
+            Order.total_price,
+            func.coalesce(Order.center, Order.discount_center, User.center),
+            OrderItem.toy_id,
+            func.coalesce(OrderItem.category, Toy.category),
+            OrderItem.quantity,
+            OrderItem.price,
+        )
+        .select_from(Order)
+        .outerjoin(User, User.id == Order.user_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Toy, Toy.id == OrderItem.toy_id)
+        .where(Order.is_active == True)  # noqa: E712
+        .order_by(Order.id),
+        execution_options={"yield_per": 1000},
+    )
+
+    contributions = Contributions()
+    current, header, items = None, None, []
+    for order_id, order_date, total_price, center, toy_id, category, quantity, price in rows:
+        if order_id != current:
+            if header is not None:
+                contributions.add_order(*header, items)
+            current, header, items = order_id, (order_date, center, total_price), []
+        if toy_id is not None:
+            items.append((toy_id, category, quantity, price))
+    if header is not None:
+        contributions.add_order(*header, items)
+    return contributions
+
+
+def _stored(model, key_columns, counter_columns) -> Dict[Tuple, Dict[str, int]]:
+    columns = [getattr(model, name) for name in key_columns + counter_columns]
+    stored = {}
+    for row in db.session.execute(select(*columns)).all():
+        key = (as_date(row[0]),) + tuple(row[1:len(key_columns)])
+        counters = {name: int(value or 0) for name, value in zip(counter_columns, row[len(key_columns):])}
+        if any(counters.values()):
+            stored[key] = counters
+    return stored
+
+
+def rebuild_rollups() -> Dict[str, int]:
+    """Recompute all rollup tables from the orders and commit; returns row counts."""
+    expected = _expected_contributions()
+    counts = {}
+    for model, key_columns, counter_columns in _TABLES:
+        db.session.query(model).delete(synchronize_session=False)
+        rows = expected.rows(model)
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+        counts[model.__tablename__] = len(rows)
+    db.session.commit()
+    return counts
+
+
+def verify_rollups() -> List[str]:
+    """Compare the rollups with the orders; returns one line per mismatch."""
+    expected = _expected_contributions()
+    problems = []
+    for model, key_columns, counter_columns in _TABLES:
+        want = {
+            tuple(row[name] for name in key_columns): {name: row[name] for name in counter_columns}
+            for row in expected.rows(model)
+            if any(row[name] for name in counter_columns)
+        }
+        have = _stored(model, key_columns, counter_columns)
+        for key in sorted(set(want) | set(have), key=lambda key: tuple(str(part) for part in key)):
+            if want.get(key) != have.get(key):
+                problems.append(f"{model.__tablename__} {key}: esperado {want.get(key)}, guardado {have.get(key)}")
+    return problems
+
+
+def ensure_rollups() -> None:
+    """Backfill the rollups on startup when they are empty but there are orders."""
+    if db.session.query(SalesDailyCenter.day).limit(1).first() is not None:
+        return
+    if db.session.query(Order.id).filter(Order.is_active == True).limit(1).first() is not None:  # noqa: E712
+        rebuild_rollups()
+
+
+def dashboard_totals() -> Dict:
+    """Total sales, order count, average order and sales by category from the rollups."""
+    amount_cents, order_count = db.session.query(
+        func.coalesce(func.sum(SalesDailyCenter.amount_cents), 0),
+        func.coalesce(func.sum(SalesDailyCenter.order_count), 0),
+    ).one()
+    amount_sum = func.sum(SalesDailyCategory.amount_cents)
+    by_category = (
+        db.session.query(SalesDailyCategory.category, func.sum(SalesDailyCategory.quantity), amount_sum)
+        .group_by(SalesDailyCategory.category)
+        .having(amount_sum != 0)
+        .order_by(amount_sum.desc())
+        .all()
+    )
+    total_sales = int(amount_cents or 0) / 100.0
+    order_count = int(order_count or 0)
+    return {
+        'total_sales': total_sales,
+        'total_orders': order_count,
+        'avg_order_value': total_sales / order_count if order_count else 0,
+        'sales_by_category': [
+            {'category': category or None, 'quantity': int(quantity or 0), 'amount': int(cents or 0) / 100.0}
+            for category, quantity, cents in by_category
+        ],
+    }
+
+
+rollups_cli = AppGroup('rollups', help='Tablas de ventas diarias del dashboard.')
+
+
+@rollups_cli.command('rebuild')
+def rebuild_command():
+    """Recalcular las tablas de ventas diarias desde las órdenes."""
+    for table, count in rebuild_rollups().items():
+        click.echo(f"{table}: {count} filas")
+
+
+@rollups_cli.command('verify')
+def verify_command():
+    """Comparar las tablas de ventas diarias con las órdenes."""
+    problems = verify_rollups()
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise click.exceptions.Exit(1)
+    click.echo("Rollups consistentes con las órdenes")
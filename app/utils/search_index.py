@@ -0,0 +1,189 @@
+"""Full-text search index for toys backed by SQLite FTS5.
+
+The index mirrors ``Toy.name``, ``Toy.description`` and ``Toy.category`` of
+active toys in the ``toy_search`` virtual table, using the ``unicode61``
+tokenizer with ``remove_diacritics`` so that "munecas" matches "Muñecas".
+Results are ranked with ``bm25`` weighting the name above the description
+and the category.  Admin views keep the index up to date incrementally
+(``index_toy`` / ``remove_toy``) inside the same transaction as the toy
+change; ``ensure_search_index`` creates and backfills it at startup.
+
+On databases without FTS5 (e.g. PostgreSQL) every helper degrades
+gracefully and callers fall back to ``ilike`` filtering.
+"""
+from __future__ import annotations
+
+import re
+from typing import Iterable, List, Optional
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..extensions import db
+from ..models import Toy
+
+FTS_TABLE = "toy_search"
+
+# Pesos bm25 por columna: name, description, category
+BM25_WEIGHTS = (10.0, 5.0, 3.0)
+
+_EXTENSION_KEY = "toy_search_index"
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_index_available() -> bool:
+    """Return True when the FTS5 index exists for the current app."""
+    try:
+        return bool(current_app.extensions.get(_EXTENSION_KEY))
+    except RuntimeError:
+        return False
+
+
+def ensure_search_index() -> bool:
+    """Create the FTS5 table if needed and backfill it when out of sync."""
+    available = False
+    if db.engine.dialect.name == "sqlite":
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                        "USING fts5(name, description, category, "
+                        "tokenize='unicode61 remove_diacritics 2')"
+                    )
+                )
+            available = True
+        except SQLAlchemyError:
+            # SQLite compilado sin FTS5
+            available = False
+
+    current_app.extensions[_EXTENSION_KEY] = available
+    if not available:
+        return False
+
+    try:
+        indexed = db.session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar() or 0
+        active = db.session.query(db.func.count(Toy.id)).filter(Toy.is_active == True).scalar() or 0  # noqa: E712
+        if indexed != active:
+            rebuild_search_index()
+        else:
+            db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+    return True
+
+
+def rebuild_search_index() -> int:
+    """Rebuild the whole index from the active toys and commit."""
+    if not search_index_available():
+        return 0
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    rows = (
+        db.session.query(Toy.id, Toy.name, Toy.description, Toy.category)
+        .filter(Toy.is_active == True)  # noqa: E712
+        .all()
+    )
+    if rows:
+        db.session.execute(
+            text(
+                f"INSERT INTO {FTS_TABLE}(rowid, name, description, category) "
+                "VALUES (:id, :name, :description, :category)"
+            ),
+            [
+                {"id": row.id, "name": row.name or "", "description": row.description or "", "category": row.category or ""}
+                for row in rows
+            ],
+        )
+    db.session.commit()
+    return len(rows)
+
+
+def index_toy(toy: Toy) -> None:
+    """Insert or refresh a toy in the index (inside the caller's transaction).
+
+    Inactive toys are removed instead.  The caller must flush first so that
+    new toys already have an id.
+    """
+    index_toys([toy])
+
+
+def index_toys(toys: Iterable[Toy]) -> None:
+    """Bulk variant of :func:`index_toy`."""
+    if not search_index_available():
+        return
+    toys = [toy for toy in toys if toy.id is not None]
+    if not toys:
+        return
+    db.session.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"),
+        [{"id": toy.id} for toy in toys],
+    )
+    active = [toy for toy in toys if toy.is_active is not False and toy.deleted_at is None]
+    if active:
+        db.session.execute(
+            text(
+                f"INSERT INTO {FTS_TABLE}(rowid, name, description, category) "
+                "VALUES (:id, :name, :description, :category)"
+            ),
+            [
+                {"id": toy.id, "name": toy.name or "", "description": toy.description or "", "category": toy.category or ""}
+                for toy in active
+            ],
+        )
+
+
+def remove_toy(toy_id: int) -> None:
+    """Remove a toy from the index (inside the caller's transaction)."""
+    if not search_index_available():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": toy_id})
+
+
+def build_match_query(raw_query: str) -> Optional[str]:
+    """Translate user input into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term and all terms are required,
+    matching the previous "all words must appear" behaviour.
+    """
+    tokens = _TOKEN_RE.findall(raw_query or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def ranked_subquery(raw_query: str):
+    """Return a ``(toy_id, rank)`` subquery for joining, or None if unavailable.
+
+    ``rank`` is the bm25 score: lower is more relevant.
+    """
+    match = build_match_query(raw_query)
+    if match is None or not search_index_available():
+        return None
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    return (
+        text(
+            f"SELECT rowid AS toy_id, bm25({FTS_TABLE}, {weights}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        )
+        .bindparams(match=match)
+        .columns(toy_id=db.Integer, rank=db.Float)
+        .subquery("toy_search_rank")
+    )
+
+
+def search_toy_ids(raw_query: str) -> Optional[List[int]]:
+    """Return matching toy ids ordered by relevance.
+
+    Returns None when the index is not available so callers can fall back
+    to substring matching.
+    """
+    subquery = ranked_subquery(raw_query)
+    if subquery is None:
+        if build_match_query(raw_query) is None and search_index_available():
+            return []
+        return None
+    rows = db.session.execute(
+        db.select(subquery.c.toy_id).order_by(subquery.c.rank.asc())
+    ).all()
+    return [row.toy_id for row in rows]
@@ -0,0 +1,563 @@
+"""Streaming, batched CSV import of toys.
+
+``bulk_upload_toys`` used to read the whole upload into memory, build a
+list of every row and commit twice per row (toy, then center
+availability) while printing progress.  :func:`import_toys` instead:
+
+* decodes the upload as a stream (UTF-8 with BOM, falling back to
+  Latin-1) and validates rows in chunks of ``chunk_size``;
+* inserts each chunk's toys with one ``executemany`` ``INSERT ...
+  RETURNING id``, its center availability with another, refreshes the
+  search index for the chunk and commits once per chunk;
+* reports problems per CSV line (:class:`RowError`) instead of aborting;
+* with ``dry_run=True`` only parses and validates, returning a preview for
+  ``bulk_upload_preview.html``.
+
+If a chunk fails as a whole (e.g. a constraint the validation did not
+catch), it is retried row by row with savepoints so only the bad rows are
+reported.
+
+:func:`upsert_toys` is the mode for re-uploading a vendor list: rows are
+matched to existing toys by ``sku`` or, failing that, by normalized name
+(see :func:`normalize_toy_name`) against one bulk fetch of the catalog.
+The diff (new, changed, unchanged and active toys missing from the file)
+is computed in memory and only changed rows are written: one
+``executemany`` ``UPDATE`` for the toys, center availability synced by set
+difference, and the new rows inserted like :func:`import_toys` does.
+"""
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import re
+import unicodedata
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from ..extensions import db
+from ..models import Toy, ToyCenterAvailability
+from .centers import normalize_center_slug
+from .search_index import index_toys
+
+DEFAULT_CHUNK_SIZE = 500
+PREVIEW_LIMIT = 200
+SKU_MAX_LENGTH = 64
+_CENTER_SPLIT = re.compile(r'[;,]')
+
+
+class ImportRow(NamedTuple):
+    line: int
+    name: str
+    description: str
+    price: float
+    stock: int
+    age_range: Optional[str]
+    gender_category: Optional[str]
+    category: Optional[str]
+    # None si la celda ``center`` venía vacía (en modo upsert: no tocar los centros)
+    centers: Optional[Tuple[str, ...]]
+    sku: Optional[str] = None
+
+    @property
+    def center(self) -> str:
+        """Centros como texto (para la vista previa)."""
+        return ', '.join(self.centers or ())
+
+    def toy_values(self, now: datetime) -> Dict:
+        return {
+            'name': self.name,
+            'sku': self.sku,
+            'description': self.description,
+            'price': self.price,
+            'stock': self.stock,
+            'age_range': self.age_range,
+            'gender_category': self.gender_category,
+            'category': self.category,
+            'image_url': None,
+            'is_active': True,
+            'created_at': now,
+            'updated_at': now,
+        }
+
+
+class RowError(NamedTuple):
+    line: int
+    name: str
+    message: str
+
+    def __str__(self) -> str:
+        label = f" ({self.name})" if self.name else ""
+        return f"Fila {self.line}{label}: {self.message}"
+
+
+class ImportResult(NamedTuple):
+    total_rows: int
+    valid_rows: int
+    created: int
+    errors: List[RowError]
+    preview: List[ImportRow]
+    # Id del juguete de cada fila válida, en orden (None si la fila falló al insertar)
+    row_ids: List[Optional[int]]
+    dry_run: bool
+
+
+class _IndexedToy(NamedTuple):
+    """Minimal stand-in for :class:`Toy` accepted by :func:`index_toys`."""
+    id: int
+    name: str
+    description: str
+    category: Optional[str]
+    is_active: bool = True
+    deleted_at: Optional[datetime] = None
+
+
+def open_csv_text(stream, sample_size: int = 64 * 1024) -> io.TextIOBase:
+    """Wrap a binary upload as text, picking UTF-8 (with BOM) or Latin-1."""
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.BytesIO(stream)
+    sample = stream.read(sample_size)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'latin-1'
+    stream.seek(0)
+    return io.TextIOWrapper(stream, encoding=encoding, newline='')
+
+
+def parse_centers(raw: str, valid_centers: Set[str]) -> Optional[Tuple[str, ...]]:
+    """``ALL`` means every known center; unknown slugs are ignored; blank is ``None``."""
+    centers = [normalize_center_slug(c) for c in _CENTER_SPLIT.split(raw or '') if c.strip()]
+    if not centers:
+        return None
+    if 'all' in centers:
+        return tuple(sorted(valid_centers))
+    return tuple(dict.fromkeys(center for center in centers if center in valid_centers))
+
+
+def parse_row(line: int, raw: Dict[str, str], valid_centers: Set[str]) -> ImportRow:
+    """Validate one CSV record; raises ``ValueError`` with a user-facing message."""
+    data = {k.strip().lower(): (v or '').strip() for k, v in raw.items() if k}
+    name = data.get('name')
+    if not name:
+        raise ValueError('sin nombre, omitida')
+    try:
+        price = float(data.get('price') or 0)
+    except ValueError:
+        raise ValueError(f"precio inválido '{data.get('price')}'")
+    if price <= 0:
+        raise ValueError('el precio debe ser mayor que 0')
+    try:
+        stock = int(data.get('stock') or 0)
+    except ValueError:
+        raise ValueError(f"stock inválido '{data.get('stock')}'")
+    if stock < 0:
+        raise ValueError('el stock no puede ser negativo')
+    sku = data.get('sku') or None
+    if sku and len(sku) > SKU_MAX_LENGTH:
+        raise ValueError(f'el SKU no puede superar {SKU_MAX_LENGTH} caracteres')
+
+    return ImportRow(
+        line=line,
+        name=name,
+        description=data.get('description', ''),
+        price=price,
+        stock=stock,
+        age_range=data.get('age range') or data.get('age_range') or None,
+        gender_category=data.get('gender category') or data.get('gender_category') or None,
+        category=data.get('category') or None,
+        centers=parse_centers(data.get('center', ''), valid_centers),
+        sku=sku,
+    )
+
+
+def iter_chunks(text_stream, valid_centers: Set[str],
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[List[ImportRow], List[RowError], int]]:
+    """Yield ``(valid_rows, errors, rows_read)`` for every ``chunk_size`` CSV records."""
+    reader = csv.DictReader(text_stream)
+    valid: List[ImportRow] = []
+    errors: List[RowError] = []
+    read = 0
+    for index, raw in enumerate(reader, start=1):
+        read += 1
+        try:
+            valid.append(parse_row(index, raw, valid_centers))
+        except ValueError as exc:
+            errors.append(RowError(index, (raw.get('name') or '').strip(), str(exc)))
+        if read == chunk_size:
+            yield valid, errors, read
+            valid, errors, read = [], [], 0
+    if read:
+        yield valid, errors, read
+
+
+def _insert_rows(rows: Sequence[ImportRow], now: datetime) -> List[int]:
+    """Bulk insert toys and their centers; returns the new ids in row order."""
+    table = Toy.__table__
+    ids = db.session.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True),
+        [row.toy_values(now) for row in rows],
+    ).scalars().all()
+
+    availability = [
+        {'toy_id': toy_id, 'center': center}
+        for toy_id, row in zip(ids, rows)
+        for center in row.centers or ()
+    ]
+    if availability:
+        db.session.execute(insert(ToyCenterAvailability.__table__), availability)
+    index_toys(
+        _IndexedToy(toy_id, row.name, row.description, row.category)
+        for toy_id, row in zip(ids, rows)
+    )
+    return list(ids)
+
+
+def _insert_chunk(rows: List[ImportRow], errors: List[RowError]) -> List[Optional[int]]:
+    now = datetime.now()
+    try:
+        ids: List[Optional[int]] = _insert_rows(rows, now)
+        db.session.commit()
+        return ids
+    except Exception:
+        db.session.rollback()
+
+    # Reintentar fila por fila para aislar las que fallan
+    ids = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                ids.extend(_insert_rows([row], now))
+        except Exception as exc:
+            errors.append(RowError(row.line, row.name, str(getattr(exc, 'orig', exc))))
+            ids.append(None)
+    db.session.commit()
+    return ids
+
+
+def import_toys(stream, valid_centers: Iterable[str], *, dry_run: bool = False,
+                chunk_size: int = DEFAULT_CHUNK_SIZE, preview_limit: int = PREVIEW_LIMIT) -> ImportResult:
+    """Import (or, with ``dry_run``, just validate) a toys CSV upload."""
+    valid_centers = set(valid_centers)
+    total = valid_count = 0
+    errors: List[RowError] = []
+    preview: List[ImportRow] = []
+    row_ids: List[Optional[int]] = []
+
+    text_stream = open_csv_text(stream)
+    try:
+        for rows, chunk_errors, read in iter_chunks(text_stream, valid_centers, chunk_size):
+            total += read
+            valid_count += len(rows)
+            errors.extend(chunk_errors)
+            if len(preview) < preview_limit:
+                preview.extend(rows[:preview_limit - len(preview)])
+            if rows and not dry_run:
+                row_ids.extend(_insert_chunk(rows, errors))
+    except (UnicodeDecodeError, csv.Error) as exc:
+        errors.append(RowError(total + 1, '', f'no se pudo leer el CSV: {exc}'))
+    finally:
+        text_stream.detach()
+
+    errors.sort(key=lambda error: error.line)
+    return ImportResult(
+        total_rows=total,
+        valid_rows=valid_count,
+        created=sum(1 for toy_id in row_ids if toy_id is not None),
+        errors=errors,
+        preview=preview,
+        row_ids=row_ids,
+        dry_run=dry_run,
+    )
+
+
+# --- Modo upsert -------------------------------------------------------------
+
+MODES = ('create', 'upsert')
+# Campos de texto que en modo upsert solo se actualizan si la fila trae valor
+_OPTIONAL_FIELDS = ('description', 'age_range', 'gender_category', 'category')
+_UPDATE_COLUMNS = ('name', 'sku', 'price', 'stock') + _OPTIONAL_FIELDS + ('is_active',)
+_INDEXED_FIELDS = {'name', 'description', 'category', 'is_active'}
+FIELD_LABELS = {
+    'name': 'nombre',
+    'sku': 'SKU',
+    'description': 'descripción',
+    'price': 'precio',
+    'stock': 'stock',
+    'age_range': 'edad',
+    'gender_category': 'género',
+    'category': 'categoría',
+    'is_active': 'reactivado',
+    'centers': 'centros',
+}
+
+
+def normalize_toy_name(name: str) -> str:
+    """Casefolded name without accents or repeated whitespace (matching key)."""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.casefold().split())
+
+
+class _ExistingToy(NamedTuple):
+    id: int
+    sku: Optional[str]
+    name: str
+    description: Optional[str]
+    price: float
+    stock: int
+    age_range: Optional[str]
+    gender_category: Optional[str]
+    category: Optional[str]
+    is_active: bool
+    centers: Set[str]
+
+
+class ToyChange(NamedTuple):
+    line: int
+    toy_id: Optional[int]
+    status: str  # 'new', 'changed' o 'unchanged'
+    fields: Tuple[str, ...] = ()
+
+    @property
+    def label(self) -> str:
+        if self.status == 'changed':
+            return 'Cambia: ' + ', '.join(FIELD_LABELS.get(field, field) for field in self.fields)
+        return 'Nuevo' if self.status == 'new' else 'Sin cambios'
+
+
+class UpsertResult(NamedTuple):
+    total_rows: int
+    valid_rows: int
+    # Con dry_run: lo que se haría; sin dry_run: lo que se escribió
+    created: int
+    updated: int
+    unchanged: int
+    deactivated: int
+    # Juguetes activos que no aparecen en el archivo
+    missing: int
+    errors: List[RowError]
+    preview: List[ImportRow]
+    changes: Dict[int, ToyChange]
+    row_ids: List[Optional[int]]
+    dry_run: bool
+
+
+def _load_existing() -> List[_ExistingToy]:
+    """Every toy with its centers, in one outer-joined query."""
+    rows = db.session.execute(
+        select(
+            Toy.id, Toy.sku, Toy.name, Toy.description, Toy.price, Toy.stock,
+            Toy.age_range, Toy.gender_category, Toy.category, Toy.is_active,
+            ToyCenterAvailability.center,
+        )
+        .select_from(Toy)
+        .outerjoin(ToyCenterAvailability, ToyCenterAvailability.toy_id == Toy.id)
+        .order_by(Toy.id)
+    ).all()
+
+    toys: Dict[int, _ExistingToy] = {}
+    for (toy_id, sku, name, description, price, stock,
+         age_range, gender_category, category, is_active, center) in rows:
+        toy = toys.get(toy_id)
+        if toy is None:
+            toy = toys[toy_id] = _ExistingToy(
+                toy_id, sku, name, description, float(price or 0), int(stock or 0),
+                age_range, gender_category, category, is_active is not False, set(),
+            )
+        if center is not None:
+            toy.centers.add(center)
+    return list(toys.values())
+
+
+class _Catalog:
+    """Existing toys indexed by SKU and by normalized name."""
+
+    def __init__(self, toys: List[_ExistingToy]):
+        self.toys = toys
+        self.by_sku = {toy.sku: toy for toy in toys if toy.sku}
+        self.by_name: Dict[str, _ExistingToy] = {}
+        # Con nombres repetidos gana el juguete activo de menor id
+        for toy in sorted(toys, key=lambda toy: (not toy.is_active, toy.id)):
+            self.by_name.setdefault(normalize_toy_name(toy.name), toy)
+
+    def match(self, row: ImportRow) -> Optional[_ExistingToy]:
+        if row.sku and row.sku in self.by_sku:
+            return self.by_sku[row.sku]
+        toy = self.by_name.get(normalize_toy_name(row.name))
+        if toy is not None and row.sku and toy.sku and toy.sku != row.sku:
+            # Mismo nombre pero otro SKU: es otro producto
+            return None
+        return toy
+
+
+def _target_values(row: ImportRow, toy: _ExistingToy) -> Dict:
+    """Values the row asks for; blank optional fields keep the stored ones."""
+    values = {
+        # Solo se renombra si cambia algo más que mayúsculas, acentos o espacios
+        'name': toy.name if normalize_toy_name(row.name) == normalize_toy_name(toy.name) else row.name,
+        'sku': row.sku or toy.sku,
+        'price': row.price,
+        'stock': row.stock,
+        'is_active': True,
+    }
+    for field in _OPTIONAL_FIELDS:
+        values[field] = getattr(row, field) or getattr(toy, field)
+    return values
+
+
+def diff_row(row: ImportRow, toy: _ExistingToy) -> Tuple[str, ...]:
+    """Names of the fields (plus ``centers``) the row would change."""
+    changed = [
+        field for field, value in _target_values(row, toy).items()
+        if (round(value, 2) != round(toy.price, 2) if field == 'price' else value != getattr(toy, field))
+    ]
+    if row.centers is not None and set(row.centers) != toy.centers:
+        changed.append('centers')
+    return tuple(changed)
+
+
+def _apply_changes(updates: List[Dict], center_adds: List[Dict], center_removes: List[Dict],
+                   deactivate_ids: List[int], reindex: List[_IndexedToy], now: datetime) -> None:
+    """Write the computed diff inside the caller's transaction."""
+    table = Toy.__table__
+    if updates:
+        values = {column: bindparam(f'new_{column}') for column in _UPDATE_COLUMNS}
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam('toy_id'))
+            .values(**values, updated_at=now, deleted_at=None),
+            updates,
+        )
+    availability = ToyCenterAvailability.__table__
+    if center_removes:
+        db.session.execute(
+            delete(availability).where(
+                availability.c.toy_id == bindparam('toy_id'),
+                availability.c.center == bindparam('old_center'),
+            ),
+            center_removes,
+        )
+    if center_adds:
+        db.session.execute(insert(availability), center_adds)
+    if deactivate_ids:
+        db.session.execute(
+            update(table)
+            .where(table.c.id.in_(deactivate_ids))
+            .values(is_active=False, deleted_at=now, updated_at=now)
+        )
+    index_toys(reindex)
+
+
+def upsert_toys(stream, valid_centers: Iterable[str], *, dry_run: bool = False,
+                deactivate_missing: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                preview_limit: int = PREVIEW_LIMIT) -> UpsertResult:
+    """Create new toys and update the changed ones from a CSV upload.
+
+    With ``deactivate_missing`` active toys absent from the file are
+    deactivated, but only when every row was valid: a row that failed
+    validation may well be one of those toys.
+    """
+    valid_centers = set(valid_centers)
+    catalog = _Catalog(_load_existing())
+    now = datetime.now()
+    total = 0
+    errors: List[RowError] = []
+    preview: List[ImportRow] = []
+    changes: Dict[int, ToyChange] = {}
+    row_ids: List[Optional[int]] = []
+    new_rows: List[Tuple[int, ImportRow]] = []
+    updates: List[Dict] = []
+    center_adds: List[Dict] = []
+    center_removes: List[Dict] = []
+    reindex: List[_IndexedToy] = []
+    seen: Dict[Tuple, int] = {}
+    unchanged = 0
+
+    text_stream = open_csv_text(stream)
+    try:
+        for rows, chunk_errors, read in iter_chunks(text_stream, valid_centers, chunk_size):
+            total += read
+            errors.extend(chunk_errors)
+            for row in rows:
+                toy = catalog.match(row)
+                if toy is not None:
+                    key = ('toy', toy.id)
+                else:
+                    key = ('sku', row.sku) if row.sku else ('name', normalize_toy_name(row.name))
+                if key in seen:
+                    errors.append(RowError(row.line, row.name, f'repetida en el archivo (ver fila {seen[key]})'))
+                    continue
+                seen[key] = row.line
+                if len(preview) < preview_limit:
+                    preview.append(row)
+
+                if toy is None:
+                    changes[row.line] = ToyChange(row.line, None, 'new')
+                    new_rows.append((len(row_ids), row))
+                    row_ids.append(None)
+                    continue
+
+                row_ids.append(toy.id)
+                fields = diff_row(row, toy)
+                if not fields:
+                    unchanged += 1
+                    changes[row.line] = ToyChange(row.line, toy.id, 'unchanged')
+                    continue
+                changes[row.line] = ToyChange(row.line, toy.id, 'changed', fields)
+                target = _target_values(row, toy)
+                if set(fields) - {'centers'}:
+                    updates.append({'toy_id': toy.id, **{f'new_{k}': v for k, v in target.items()}})
+                if 'centers' in fields:
+                    wanted = set(row.centers)
+                    center_adds.extend({'toy_id': toy.id, 'center': c} for c in sorted(wanted - toy.centers))
+                    center_removes.extend({'toy_id': toy.id, 'old_center': c} for c in sorted(toy.centers - wanted))
+                if _INDEXED_FIELDS.intersection(fields):
+                    reindex.append(_IndexedToy(toy.id, target['name'], target['description'], target['category']))
+    except (UnicodeDecodeError, csv.Error) as exc:
+        errors.append(RowError(total + 1, '', f'no se pudo leer el CSV: {exc}'))
+    finally:
+        text_stream.detach()
+
+    claimed = {key[1] for key in seen if key[0] == 'toy'}
+    missing = [toy for toy in catalog.toys if toy.is_active and toy.id not in claimed]
+    deactivate = missing if deactivate_missing and not errors else []
+    reindex.extend(
+        _IndexedToy(toy.id, toy.name, toy.description, toy.category, is_active=False, deleted_at=now)
+        for toy in deactivate
+    )
+
+    created = len(new_rows)
+    if not dry_run:
+        try:
+            _apply_changes(updates, center_adds, center_removes, [toy.id for toy in deactivate], reindex, now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for start in range(0, len(new_rows), chunk_size):
+            chunk = new_rows[start:start + chunk_size]
+            ids = _insert_chunk([row for _, row in chunk], errors)
+            for (position, row), toy_id in zip(chunk, ids):
+                row_ids[position] = toy_id
+                changes[row.line] = changes[row.line]._replace(toy_id=toy_id)
+        created = sum(1 for _, row in new_rows if changes[row.line].toy_id is not None)
+
+    errors.sort(key=lambda error: error.line)
+    return UpsertResult(
+        total_rows=total,
+        valid_rows=len(row_ids),
+        created=created,
+        updated=sum(1 for change in changes.values() if change.status == 'changed'),
+        unchanged=unchanged,
+        deactivated=len(deactivate),
+        missing=len(missing),
+        errors=errors,
+        preview=preview,
+        changes=changes,
+        row_ids=row_ids,
+        dry_run=dry_run,
+    )
@@ -5,6 +5,7 @@ Incluye: dashboard, gestión de juguetes (CRUD), inventario inteligente
 
 import os
 import logging
+import uuid
 from werkzeug.utils import secure_filename
 from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, jsonify, abort, Response, session
 from flask_login import login_required, current_user, login_user, logout_user
@@ -19,7 +20,16 @@ from app.extensions import db
 from app.forms import ToyForm, AddUserForm, EditUserForm
 from pagination_helpers import PaginationHelper, paginate_query
 from utils import normalize_email
-from app.utils.centers import collect_center_choices, normalize_center_slug
+from app.utils.centers import cached_center_choices, invalidate_centers, normalize_center_slug
+from app.utils.catalog import invalidate_catalog
+from app.utils.search_index import index_toy, remove_toy
+from app.utils.popularity import revert_sales
+from app.utils.rollups import dashboard_totals, revert_order
+from app.utils.cart_hydration import order_lines
+from app.utils.toy_import import MODES as IMPORT_MODES, import_toys, upsert_toys
+from app.utils.sales import TOTAL_SERIES, sales_series
+from app.utils.exports import ExportFilters, ORDER_HEADER, INVENTORY_HEADER, csv_response, inventory_rows, order_rows
+from app.utils.analytics_export import export_analytics
 
 # 💾 Importar Sistema de Backup Simplificado
 try:
@@ -31,7 +41,7 @@ except ImportError:
 
 # Importar sistemas avanzados
 try:
-    from inventory_system import InventoryManager
+    from inventory_system import get_inventory_manager
     from cache_system import DashboardCache
     ADVANCED_SYSTEMS_AVAILABLE = True
 except ImportError:
@@ -86,23 +96,8 @@ def dashboard():
     inventory_data = {}
     if ADVANCED_SYSTEMS_AVAILABLE:
         try:
-            # Intentar obtener del cache primero
-            inventory_data = DashboardCache.get_stats()
-            
-            if not inventory_data:
-                # Generar datos de inventario
-                inventory_manager = InventoryManager()
-                inventory_report = inventory_manager.generate_inventory_report()
-                
-                inventory_data = {
-                    'alerts': inventory_report['alerts'][:5],  # Top 5 alertas
-                    'predictions': inventory_report['predictions'][:3],  # Top 3 predicciones
-                    'stats': inventory_report['stats'],
-                    'summary': inventory_report['summary']
-                }
-                
-                # Cachear por 5 minutos
-                DashboardCache.set_stats(inventory_data, ttl=300)
+            # Cache de 5 minutos; al vencer solo una petición regenera el reporte
+            inventory_data = DashboardCache.get_or_compute_stats(_build_inventory_summary, ttl=300)
         except Exception as e:
             print(f"⚠️ Error en sistema de inventario: {str(e)}")
             inventory_data = {'error': 'Sistema de inventario no disponible'}
@@ -148,72 +143,48 @@ def dashboard():
                          admins_count=admins_count,
                          inactive_count=inactive_count)
 
-def get_dashboard_stats_optimized():
-    """Obtener estadísticas con caché manual (5 min)"""
-    from flask import current_app
-    cache = current_app.extensions.get('cache')
+def _build_inventory_summary():
+    """Resumen del reporte de inventario para el dashboard (sin caché)"""
+    inventory_report = get_inventory_manager().generate_inventory_report()
+    return {
+        'alerts': inventory_report['alerts'][:5],  # Top 5 alertas
+        'predictions': inventory_report['predictions'][:3],  # Top 3 predicciones
+        'stats': inventory_report['stats'],
+        'summary': inventory_report['summary']
+    }
 
-    if cache:
-        cached = cache.get('dashboard_stats')
-        if cached:
-            return cached
 
-    sales_stats = {
+def _empty_sales_stats():
+    return {
         'total_sales': 0,
         'total_orders': 0,
         'total_users': 0,
         'avg_order_value': 0,
         'sales_by_category': []
     }
-    
+
+
+def _build_sales_stats():
+    """Totales de ventas del dashboard (sin caché)"""
+    sales_stats = _empty_sales_stats()
+    # Totales y ventas por categoría desde las tablas de ventas diarias
+    sales_stats.update(dashboard_totals())
+    # Total de usuarios activos (usa índice idx_user_active_created)
+    sales_stats['total_users'] = User.query.filter_by(is_active=True).count()
+    return sales_stats
+
+
+def get_dashboard_stats_optimized():
+    """Obtener estadísticas con caché compartido entre workers (5 min, un solo recálculo)"""
     try:
-        # Estadísticas principales con una sola consulta (usa índices optimizados)
-        main_stats = db.session.query(
-            db.func.sum(Order.total_price).label('total_sales'),
-            db.func.count(Order.id).label('total_orders'),
-            db.func.avg(Order.total_price).label('avg_order_value')
-        ).filter(Order.is_active == True).first()
-        
-        sales_stats['total_sales'] = main_stats.total_sales or 0
-        sales_stats['total_orders'] = main_stats.total_orders or 0
-        sales_stats['avg_order_value'] = main_stats.avg_order_value or 0
-        
-        # Total de usuarios activos (usa índice idx_user_active_created)
-        sales_stats['total_users'] = User.query.filter_by(is_active=True).count()
-        
-        # Ventas por categoría optimizada (usa índices idx_orderitem_toy_active)
-        sales_by_category = db.session.query(
-            Toy.category,
-            db.func.sum(OrderItem.quantity).label('quantity'),
-            db.func.sum(OrderItem.quantity * OrderItem.price).label('amount')
-        ).join(OrderItem).join(Order).filter(
-            Order.is_active == True,
-            OrderItem.is_active == True,
-            Toy.is_active == True
-        ).group_by(Toy.category).order_by(
-            db.func.sum(OrderItem.quantity * OrderItem.price).desc()
-        ).all()
-        
-        sales_stats['sales_by_category'] = [
-            {
-                'category': cat,
-                'quantity': int(qty or 0),
-                'amount': float(amt or 0)
-            } for cat, qty, amt in sales_by_category
-        ]
-        
+        if ADVANCED_SYSTEMS_AVAILABLE:
+            return DashboardCache.get_or_compute_sales_stats(_build_sales_stats, ttl=300)
+        return _build_sales_stats()
     except Exception as e:
+        # Las estadísticas incompletas no se cachean
         print(f"Error al obtener estadísticas: {str(e)}")
         flash('Error al cargar estadísticas', 'error')
-    
-    # Guardar en caché durante 5 min (si el backend lo permite)
-    if cache:
-        if hasattr(cache, 'set'):
-            cache.set('dashboard_stats', sales_stats, timeout=300)
-        elif isinstance(cache, dict):
-            cache['dashboard_stats'] = sales_stats
-    
-    return sales_stats
+        return _empty_sales_stats()
 
 
 @admin_bp.route('/centers', methods=['GET', 'POST'])
@@ -263,6 +234,7 @@ def centers_admin():
                             )
                             db.session.add(new_center)
                             db.session.commit()
+                            invalidate_centers()
                             flash(f'Centro "{name}" creado exitosamente.', 'success')
             elif action == 'update_discount':
                 center_id_raw = request.form.get('center_id')
@@ -290,6 +262,7 @@ def centers_admin():
                         else:
                             center.discount_percentage = discount_value
                             db.session.commit()
+                            invalidate_centers()
                             flash(f'Descuento actualizado para {center.name}.', 'success')
             else:
                 flash('Acción no reconocida.', 'error')
@@ -486,41 +459,38 @@ def centers_admin():
     )
 
 
-def get_sales_chart_data():
-    """Obtener datos para el gráfico de ventas de los últimos 7 días"""
-    dates = []
-    sales_data = []
-
+def get_sales_chart_data(days=7, bucket='day'):
+    """Obtener datos para el gráfico de ventas (por defecto últimos 7 días, una sola consulta)"""
     try:
-        # Ventas de los últimos 7 días (usa índice idx_order_active_date)
-        for i in range(7):
-            date = datetime.now() - timedelta(days=i)
-            dates.append(date.strftime('%Y-%m-%d'))
-            
-            daily_sales = db.session.query(
-                db.func.sum(Order.total_price)
-            ).filter(
-                Order.is_active == True,
-                db.func.date(Order.order_date) == date.date()
-            ).scalar() or 0
-            
-            sales_data.append(float(daily_sales))
-        
-        # Invertir las listas para mostrar en orden cronológico
-        dates.reverse()
-        sales_data.reverse()
-        
+        data = sales_series(days, bucket)
+        return {'dates': data['labels'], 'sales_data': data['series'][TOTAL_SERIES]}
     except Exception as e:
         print(f"Error al obtener datos del gráfico: {str(e)}")
-        dates = ['Sin datos'] * 7
-        sales_data = [0] * 7
-    
-    return {'dates': dates, 'sales_data': sales_data}
+        return {'dates': ['Sin datos'] * 7, 'sales_data': [0] * 7}
+
+
+@admin_bp.route('/api/sales_series')
+@login_required
+def sales_series_api():
+    """Serie de ventas en JSON: ?days=7|30|90&bucket=day|week|month&split=center|category"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Acceso denegado'}), 403
+
+    try:
+        data = sales_series(
+            request.args.get('days', 7, type=int),
+            request.args.get('bucket', 'day'),
+            request.args.get('split') or None,
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    return jsonify({'success': True, **data})
 
 
 def get_center_choices(include_lookup: bool = False):
     try:
-        choices, lookup = collect_center_choices()
+        choices, lookup = cached_center_choices()
         if include_lookup:
             return choices, lookup
         return choices
@@ -532,7 +502,7 @@ def get_center_choices(include_lookup: bool = False):
 
 def get_center_slug_set():
     try:
-        choices, _ = collect_center_choices()
+        choices, _ = cached_center_choices()
         return {slug for slug, _ in choices}
     except Exception:
         return set()
@@ -789,7 +759,11 @@ def add_toy():
                         continue
                     seen.add(center)
                     db.session.add(ToyCenterAvailability(toy_id=new_toy.id, center=center))
+            index_toy(new_toy)
             db.session.commit()
+            invalidate_catalog()
+            if selected_centers:
+                invalidate_centers()
             flash('¡Juguete agregado exitosamente!', 'success')
             
         except Exception as e:
@@ -802,105 +776,173 @@ def add_toy():
     
     return redirect(url_for('admin.toys_page'))
 
+MAX_FLASHED_IMPORT_ERRORS = 10
+# Vistas previas sin confirmar que se borran al preparar una nueva
+BULK_IMPORT_MAX_AGE = timedelta(hours=24)
+
+
+def _bulk_import_folder():
+    """Carpeta de vistas previas; borra las que llevan más de ``BULK_IMPORT_MAX_AGE``"""
+    folder = os.path.join(current_app.instance_path, 'imports')
+    os.makedirs(folder, exist_ok=True)
+    cutoff = (datetime.now() - BULK_IMPORT_MAX_AGE).timestamp()
+    for entry in os.scandir(folder):
+        try:
+            if entry.is_file() and entry.name.endswith('.csv') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass  # otra petición ya lo borró
+    return folder
+
+
+def _discard_bulk_import(folder, token):
+    """Borrar el archivo de una vista previa que ya no se va a confirmar"""
+    if not token:
+        return
+    try:
+        os.remove(os.path.join(folder, f'{secure_filename(token)}.csv'))
+    except FileNotFoundError:
+        pass
+
+
+def _bulk_import_options(source):
+    """Modo de importación elegido en el formulario (``create`` por defecto)"""
+    mode = source.get('mode', 'create')
+    return {
+        'mode': mode if mode in IMPORT_MODES else 'create',
+        'deactivate_missing': bool(source.get('deactivate_missing')),
+    }
+
+
+def _run_bulk_import(stream, options, dry_run=False):
+    valid_centers = get_center_slug_set()
+    if options['mode'] == 'upsert':
+        return upsert_toys(stream, valid_centers, dry_run=dry_run,
+                           deactivate_missing=options['deactivate_missing'])
+    return import_toys(stream, valid_centers, dry_run=dry_run)
+
+
+def _flash_import_result(result, options):
+    """Resumen de la importación (solo las primeras filas con error para no llenar la sesión)"""
+    for error in result.errors[:MAX_FLASHED_IMPORT_ERRORS]:
+        flash(f'❌ {error}', 'error')
+    hidden = len(result.errors) - MAX_FLASHED_IMPORT_ERRORS
+    if hidden > 0:
+        flash(f'... y {hidden} errores más', 'error')
+    category = 'success' if not result.errors else 'warning'
+    if options['mode'] != 'upsert':
+        flash(f'{result.created} juguetes cargados exitosamente. {len(result.errors)} errores.', category)
+        return
+    flash(f'{result.created} nuevos, {result.updated} actualizados, {result.unchanged} sin cambios, '
+          f'{result.deactivated} desactivados. {len(result.errors)} errores.', category)
+    if options['deactivate_missing'] and result.missing and not result.deactivated:
+        flash(f'No se desactivaron {result.missing} juguetes ausentes porque el archivo tiene errores', 'warning')
+
+
+def _invalidate_after_import(result):
+    if result.created or getattr(result, 'updated', 0) or getattr(result, 'deactivated', 0):
+        invalidate_catalog()
+    changes = getattr(result, 'changes', {})
+    if any('centers' in change.fields for change in changes.values()):
+        invalidate_centers()
+
+
+def _save_bulk_image(image_file):
+    """Guardar una imagen subida en la vista previa y devolver su ruta relativa"""
+    upload_folder = os.path.join(current_app.static_folder, 'images', 'toys')
+    os.makedirs(upload_folder, exist_ok=True)
+    filename = datetime.now().strftime('%Y%m%d_%H%M%S_') + secure_filename(image_file.filename)
+    image_file.save(os.path.join(upload_folder, filename))
+    return f'images/toys/{filename}'
+
+
 @admin_bp.route('/bulk_upload_toys', methods=['GET', 'POST'])
 @login_required
 def bulk_upload_toys():
-    """Cargar juguetes desde un CSV (sin imágenes)."""
+    """Cargar juguetes desde un CSV (sin imágenes), por lotes y en streaming."""
     if not current_user.is_admin:
         flash('Acceso denegado', 'error')
         return redirect(url_for('shop.index'))
 
-    valid_centers = get_center_slug_set()
-
     if request.method == 'POST':
         csv_file = request.files.get('csv_file')
         if not csv_file:
             flash('Se requiere un archivo CSV', 'error')
             return redirect(url_for('admin.bulk_upload_toys'))
 
-        import csv
-        import re
-        from io import StringIO
+        options = _bulk_import_options(request.form)
+
+        if request.form.get('dry_run'):
+            # Vista previa: validar sin escribir y guardar el archivo para confirmar después
+            folder = _bulk_import_folder()
+            _discard_bulk_import(folder, session.get('bulk_import_token'))
+            token = uuid.uuid4().hex
+            path = os.path.join(folder, f'{token}.csv')
+            csv_file.save(path)
+            with open(path, 'rb') as fh:
+                result = _run_bulk_import(fh, options, dry_run=True)
+            session['bulk_import_token'] = token
+            session['bulk_import_options'] = options
+            return render_template('bulk_upload_preview.html',
+                                   toys=result.preview,
+                                   errors=result.errors,
+                                   result=result,
+                                   options=options,
+                                   changes=getattr(result, 'changes', {}))
+
+        result = _run_bulk_import(csv_file.stream, options)
+        current_app.logger.info(
+            f'Carga masiva ({options["mode"]}) completada: {result.created} éxitos, {len(result.errors)} errores'
+        )
+        _invalidate_after_import(result)
+        _flash_import_result(result, options)
+        return redirect(url_for('admin.toys_page'))
 
-        try:
-            raw = csv_file.stream.read()
-            try:
-                text = raw.decode('utf-8-sig')
-            except UnicodeDecodeError:
-                text = raw.decode('latin-1')
-            csv_stream = StringIO(text)
-            reader = list(csv.DictReader(csv_stream))
-        except Exception as e:
-            flash(f'Error al procesar el CSV: {e}', 'error')
-            print(f'❌ Error procesando CSV: {e}', flush=True)
-            return redirect(url_for('admin.bulk_upload_toys'))
-        print(f'Iniciando carga masiva desde CSV: {len(reader)} filas', flush=True)
-
-        created = 0
-        errors = []
-        for idx, row in enumerate(reader, start=1):
-            data = {k.strip().lower(): (v or '').strip() for k, v in row.items() if k}
-            name = data.get('name')
-            if not name:
-                error_msg = f'❌ Fila {idx} sin nombre, omitida'
-                print(error_msg, flush=True)
-                errors.append(error_msg)
-                continue
-            print(f'[{idx}/{len(reader)}] Procesando: {name}', flush=True)
-            try:
-                try:
-                    price = float(data.get('price', 0) or 0)
-                except ValueError:
-                    price = 0.0
-                try:
-                    stock = int(data.get('stock', 0) or 0)
-                except ValueError:
-                    stock = 0
-
-                toy = Toy(
-                    name=name,
-                    description=data.get('description', ''),
-                    price=price,
-                    stock=stock,
-                    age_range=data.get('age range') or data.get('age_range'),
-                    gender_category=data.get('gender category') or data.get('gender_category'),
-                    category=data.get('category'),
-                    image_url=None,
-                    updated_at=datetime.now()
-                )
+    return render_template('bulk_upload_toys.html', modes=IMPORT_MODES)
 
-                db.session.add(toy)
-                db.session.commit()
 
-                centers_str = data.get('center')
-                if centers_str:
-                    centers = [normalize_center_slug(c) for c in re.split(r'[;,]', centers_str) if c.strip()]
-                    if 'all' in centers:
-                        for center_slug in valid_centers:
-                            db.session.add(ToyCenterAvailability(toy_id=toy.id, center=center_slug))
-                        db.session.commit()
-                    else:
-                        filtered = [center for center in centers if center in valid_centers]
-                        for center_slug in filtered:
-                            db.session.add(ToyCenterAvailability(toy_id=toy.id, center=center_slug))
-                        db.session.commit()
-
-                created += 1
-                print(f'✔️ Fila {idx} procesada: {name}', flush=True)
-            except Exception as e:
-                db.session.rollback()
-                error_msg = f'❌ Error en fila {idx} ({name}): {e}'
-                print(error_msg, flush=True)
-                errors.append(error_msg)
-
-        for err in errors:
-            flash(err, 'error')
-        flash(f'{created} juguetes cargados exitosamente. {len(errors)} errores.',
-              'success' if not errors else 'warning')
-        print(f'Carga masiva completada: {created} éxitos, {len(errors)} errores', flush=True)
-        return redirect(url_for('admin.toys_page'))
+@admin_bp.route('/bulk_upload_toys/confirm', methods=['POST'])
+@login_required
+def bulk_upload_toys_confirm():
+    """Confirmar la carga revisada en la vista previa (con imágenes opcionales)."""
+    if not current_user.is_admin:
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('shop.index'))
+
+    token = session.pop('bulk_import_token', None)
+    options = _bulk_import_options(session.pop('bulk_import_options', None) or {})
+    path = os.path.join(_bulk_import_folder(), f'{token}.csv') if token else None
+    if not path or not os.path.exists(path):
+        flash('La vista previa expiró; vuelve a subir el CSV', 'error')
+        return redirect(url_for('admin.bulk_upload_toys'))
+
+    try:
+        with open(path, 'rb') as fh:
+            result = _run_bulk_import(fh, options)
+
+        # image_<n> corresponde a la n-ésima fila válida de la vista previa
+        images = []
+        for position, toy_id in enumerate(result.row_ids[:len(result.preview)], start=1):
+            image_file = request.files.get(f'image_{position}')
+            if toy_id is not None and image_file and image_file.filename:
+                images.append({'toy_id': toy_id, 'new_image_url': _save_bulk_image(image_file)})
+        if images:
+            db.session.execute(
+                Toy.__table__.update()
+                .where(Toy.__table__.c.id == db.bindparam('toy_id'))
+                .values(image_url=db.bindparam('new_image_url')),
+                images,
+            )
+            db.session.commit()
+            invalidate_catalog()
+    finally:
+        os.remove(path)
+
+    _invalidate_after_import(result)
+    _flash_import_result(result, options)
+    return redirect(url_for('admin.toys_page'))
+
 
-    return render_template('bulk_upload_toys.html')
 @admin_bp.route('/edit_toy/<int:toy_id>', methods=['GET', 'POST'])
 @login_required
 def edit_toy(toy_id):
@@ -956,8 +998,10 @@ def edit_toy(toy_id):
             if toy_form.stock.data is not None:
                 toy.stock = toy_form.stock.data
             toy.updated_at = datetime.now()
+            index_toy(toy)
             
             db.session.commit()
+            invalidate_catalog()
             flash('¡Juguete actualizado exitosamente!', 'success')
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -1026,8 +1070,10 @@ def delete_toy(toy_id):
         # Soft delete: marcar como eliminado en lugar de eliminar físicamente
         toy.deleted_at = datetime.now()
         toy.is_active = False
+        remove_toy(toy.id)
         
         db.session.commit()
+        invalidate_catalog()
         current_app.logger.info(f"Juguete {toy_id} eliminado exitosamente")
         
         # Respuesta diferente para AJAX vs formulario normal
@@ -1067,6 +1113,7 @@ def update_toy_stock(toy_id):
         delta = int(data.get('delta', 0))
         toy.stock = max(0, toy.stock + delta)
         db.session.commit()
+        invalidate_catalog()
         return jsonify({'success': True, 'stock': toy.stock})
     except Exception as e:
         db.session.rollback()
@@ -1134,6 +1181,8 @@ def manage_toy_centers(toy_id):
             db.session.add(ToyCenterAvailability(toy_id=toy.id, center=center))
 
         db.session.commit()
+        invalidate_catalog()
+        invalidate_centers()
         return jsonify({'success': True, 'centers': new_centers})
     except Exception as e:
         db.session.rollback()
@@ -1182,9 +1231,11 @@ def toy_edit_new(toy_id):
             toy.category = request.form.get('category', toy.category)
             toy.stock = int(request.form.get('stock', toy.stock))
             toy.updated_at = datetime.now()
+            index_toy(toy)
             
             # Guardar cambios
             db.session.commit()
+            invalidate_catalog()
             
             current_app.logger.info(f"Juguete {toy_id} actualizado exitosamente")
             
@@ -1231,7 +1282,7 @@ def inventory_dashboard():
         return redirect(url_for('admin.dashboard'))
     
     try:
-        inventory_manager = InventoryManager()
+        inventory_manager = get_inventory_manager()
         report = inventory_manager.generate_inventory_report()
         
         return render_template('inventory_dashboard.html',
@@ -1252,7 +1303,7 @@ def inventory_alerts():
         return jsonify({'error': 'Sistema no disponible'}), 503
     
     try:
-        inventory_manager = InventoryManager()
+        inventory_manager = get_inventory_manager()
         alerts = inventory_manager.check_low_stock()
         
         return jsonify({
@@ -1358,12 +1409,16 @@ def delete_order(order_id):
         user_balance = Decimal(str(order.user.balance or 0))
         order.user.balance = float(user_balance + refund_amount)
 
+        revert_sales((item.toy_id, item.quantity or 0) for item in order.items)
+        revert_order(order)
+
         order.status = 'cancelled'
         order.is_active = False
         order.deleted_at = datetime.now()
         order.updated_at = datetime.now()
 
         db.session.commit()
+        invalidate_catalog()
 
         success_message = f'Orden #{order.id} cancelada y reembolsada correctamente.'
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.accept_mimetypes.accept_json:
@@ -1400,11 +1455,9 @@ def download_receipt(order_id):
         "Items:",
     ]
     total_calc = 0.0
-    for it in order.items:
-        subtotal = (it.price or 0.0) * (it.quantity or 0)
-        total_calc += subtotal
-        toy_name = it.toy.name if getattr(it, 'toy', None) else f"Toy ID {it.toy_id}"
-        lines.append(f" - {toy_name} x{it.quantity} = A$ {subtotal:.2f}")
+    for it in order_lines(order.id):
+        total_calc += it.subtotal
+        lines.append(f" - {it.name} x{it.quantity} = A$ {it.subtotal:.2f}")
     lines.append("")
     subtotal = float(order.subtotal_price or order.total_price or 0.0)
     discount_amount = float(order.discount_amount or 0.0)
@@ -1443,7 +1496,7 @@ def send_inventory_alerts():
         
     try:
         # Obtener alertas de inventario
-        inventory_manager = InventoryManager()
+        inventory_manager = get_inventory_manager()
         report = inventory_manager.generate_inventory_report()
         alerts = report['alerts']
         
@@ -1529,6 +1582,7 @@ def add_user():
         try:
             db.session.add(new_user)
             db.session.commit()
+            invalidate_centers()
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({'success': True, 'user_id': new_user.id})
             flash(f'Usuario {new_user.username} agregado exitosamente.', 'success')
@@ -1681,73 +1735,61 @@ def bulk_users_action():
 # ------------------------------
 # Export CSV utilities
 # ------------------------------
-def _generate_csv_response(csv_content: str, filename: str) -> Response:
-    """Utility to return a CSV response with appropriate headers."""
-    return Response(
-        csv_content,
-        mimetype='text/csv',
-        headers={
-            'Content-Disposition': f'attachment; filename="{filename}"'
-        }
-    )
-
-
 @admin_bp.route('/export_orders')
 @login_required
 def export_orders():
-    """Exportar todas las órdenes en CSV."""
+    """Exportar órdenes en CSV (streaming; filtros start, end, center, status y gzip=1)."""
     if not current_user.is_admin:
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('shop.index'))
 
-    import csv, io
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # encabezados
-    writer.writerow(['ID', 'Fecha', 'Usuario', 'Centro', 'Total', 'Items'])
-
-    orders = Order.query.order_by(Order.order_date.desc()).all()
-    for order in orders:
-        item_count = sum(item.quantity for item in order.items)
-        writer.writerow([
-            order.id,
-            order.order_date.strftime('%Y-%m-%d %H:%M'),
-            order.user.username,
-            order.user.center,
-            f"{order.total_price:.2f}",
-            item_count
-        ])
-
-    return _generate_csv_response(output.getvalue(), 'ordenes.csv')
+    try:
+        filters = ExportFilters.from_args(request.args)
+    except ValueError as exc:
+        flash(str(exc), 'danger')
+        return redirect(url_for('admin.all_orders'))
+    return csv_response(filters.filename('ordenes'), ORDER_HEADER, order_rows(filters),
+                        compress=request.args.get('gzip') == '1')
 
 
 @admin_bp.route('/export_inventory')
 @login_required
 def export_inventory():
-    """Exportar inventario de juguetes en CSV."""
+    """Exportar inventario de juguetes en CSV (streaming; filtros center, status y gzip=1)."""
     if not current_user.is_admin:
         flash('Acceso denegado.', 'danger')
         return redirect(url_for('shop.index'))
 
-    import csv, io
-    output = io.StringIO()
-    writer = csv.writer(output)
+    try:
+        filters = ExportFilters.from_args(request.args)
+        rows = inventory_rows(filters)
+    except ValueError as exc:
+        flash(str(exc), 'danger')
+        return redirect(url_for('admin.toys_page'))
+    return csv_response(filters.filename('inventario'), INVENTORY_HEADER, rows,
+                        compress=request.args.get('gzip') == '1')
 
-    writer.writerow(['ID', 'Nombre', 'Categoría', 'Precio', 'Stock', 'Activo'])
+@admin_bp.route('/export_analytics', methods=['POST'])
+@login_required
+def export_analytics_dataset():
+    """Escribir el dataset columnar de órdenes por mes (incremental salvo full=1)."""
+    if not current_user.is_admin:
+        flash('Acceso denegado.', 'danger')
+        return redirect(url_for('shop.index'))
 
-    toys = Toy.query.filter_by(deleted_at=None).order_by(Toy.name.asc()).all()
-    for toy in toys:
-        writer.writerow([
-            toy.id,
-            toy.name,
-            toy.category,
-            f"{toy.price:.2f}",
-            toy.stock,
-            'Sí' if toy.is_active else 'No'
-        ])
+    try:
+        summary = export_analytics(incremental=request.form.get('full') != '1')
+    except Exception as exc:
+        current_app.logger.error(f'Error en la exportación analítica: {exc}')
+        flash(f'No se pudo exportar el dataset: {exc}', 'danger')
+        return redirect(url_for('admin.all_orders'))
 
-    return _generate_csv_response(output.getvalue(), 'inventario.csv')
+    flash(
+        f'Dataset {summary.format} actualizado: {len(summary.written)} meses escritos '
+        f'({summary.rows} filas), {len(summary.unchanged)} sin cambios.',
+        'success',
+    )
+    return redirect(url_for('admin.all_orders'))
 
 # ------------------------------
 # Ajustar saldo de usuario (Aloha Dólares)
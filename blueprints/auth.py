@@ -13,7 +13,7 @@ from datetime import datetime
 # Importaciones absolutas
 from app.models import User, Center
 from app.extensions import db
-from app.utils.centers import collect_center_choices, normalize_center_slug
+from app.utils.centers import cached_center_choices, normalize_center_slug
 from utils import normalize_email
 
 
@@ -96,7 +96,7 @@ def register():
         return redirect(url_for('shop.index'))
 
     form = RegisterForm()
-    center_choices, centers_map = collect_center_choices()
+    center_choices, centers_map = cached_center_choices()
     form.center.choices = center_choices
 
     if form.validate_on_submit():
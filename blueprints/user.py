@@ -6,12 +6,12 @@ Incluye: perfil, balance, cambio de contraseña, actualización de centro, histo
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort, current_app
 from flask_login import login_required, current_user
 from datetime import datetime
-from sqlalchemy import desc
 
 # Importaciones absolutas
 from app.models import Toy, Order, OrderItem, User, Center
 from app.extensions import db
-from app.filters import format_currency
+from app.utils.centers import invalidate_centers
+from app.utils.order_history import DEFAULT_PAGE_SIZE, order_count, order_history
 
 # Crear el blueprint de usuario
 user_bp = Blueprint('user', __name__, url_prefix='/user')
@@ -19,22 +19,36 @@ user_bp = Blueprint('user', __name__, url_prefix='/user')
 @user_bp.route('/profile')
 @login_required
 def profile():
-    """Página de perfil del usuario con historial de órdenes"""
-    # Obtener las órdenes del usuario ordenadas por fecha descendente
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(desc(Order.order_date)).all()
-    
-    # Formatear las órdenes para la vista
-    formatted_orders = []
-    for order in orders:
-        formatted_orders.append({
-            'id': order.id,
-            'order_date': order.order_date.strftime('%d/%m/%Y %H:%M'),
-            'total': format_currency(order.total_price),
-            'status': order.status,
-            'item_count': sum(item.quantity for item in order.items)
-        })
-    
-    return render_template('profile.html', orders=formatted_orders)
+    """Página de perfil del usuario con la primera página del historial de órdenes"""
+    page = order_history(current_user.id)
+    return render_template('profile.html',
+                           orders=[order.as_dict() for order in page.orders],
+                           order_count=order_count(current_user.id),
+                           next_cursor=page.next_cursor)
+
+
+@user_bp.route('/orders')
+@login_required
+def orders_page():
+    """Siguiente página del historial de órdenes en JSON ("cargar más")"""
+    try:
+        page = order_history(current_user.id,
+                             limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+                             cursor=request.args.get('cursor') or None)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    orders = []
+    for order in page.orders:
+        data = order.as_dict()
+        data['url'] = url_for('shop.order_summary', order_id=order.id)
+        orders.append(data)
+    return jsonify({
+        'success': True,
+        'orders': orders,
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more,
+    })
 
 @user_bp.route('/add_balance', methods=['POST'])
 @login_required
@@ -104,6 +118,7 @@ def update_center():
     try:
         current_user.center = center_record.slug
         db.session.commit()
+        invalidate_centers()
         return jsonify({'success': True})
     except Exception as exc:
         db.session.rollback()
@@ -6,9 +6,20 @@ Cache inteligente para consultas frecuentes, sesiones y carrito persistente
 
 import os
 import json
-import pickle
-from datetime import datetime, timedelta
-from typing import Any, Optional, Dict, List
+import fnmatch
+import hashlib
+import math
+import random
+import threading
+import time
+import uuid
+import struct
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Iterator, Optional, Dict, List, Tuple
 from functools import wraps
 
 try:
@@ -18,21 +29,485 @@ except ImportError:
     REDIS_AVAILABLE = False
     print("⚠️ Redis no está instalado. Instalando...")
 
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+# Versión del formato de los payloads; subirla hace que se ignoren los anteriores
+CACHE_SCHEMA_VERSION = 1
+
+def stable_key(*parts: Any) -> str:
+    """Digest estable de las partes de una clave (blake2b sobre JSON canónico).
+
+    A diferencia de ``hash()``, que cambia en cada proceso, el resultado es
+    el mismo en todos los workers y tras reiniciar.
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class LRUMemoryCache:
+    """Cache en memoria acotado por entradas y bytes, con TTL y expiración en segundo plano
+
+    Guarda los valores ya serializados: así el tamaño es exacto y quien lee
+    recibe una copia que puede modificar sin alterar el cache.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 32 * 1024 * 1024,
+                 sweep_interval: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._data: 'OrderedDict[str, Tuple[bytes, float]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._stop = threading.Event()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _drop(self, key: str) -> None:
+        payload, _ = self._data.pop(key)
+        self._bytes -= len(payload)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] <= self._clock():
+                self._drop(key)
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, payload: bytes, ttl: float) -> bool:
+        if len(payload) > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (payload, self._clock() + ttl)
+            self._bytes += len(payload)
+            # Expulsar las menos usadas hasta volver a los límites
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+        self._ensure_sweeper()
+        return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._drop(key)
+            return True
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def purge_expired(self) -> int:
+        """Eliminar las entradas vencidas; devuelve cuántas"""
+        now = self._clock()
+        with self._lock:
+            expired = [key for key, (_, expires) in self._data.items() if expires <= now]
+            for key in expired:
+                self._drop(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def _ensure_sweeper(self) -> None:
+        # Un hilo por proceso: tras un fork (gunicorn --preload) hay que crearlo de nuevo
+        if not self.sweep_interval or (self._sweeper_pid == os.getpid() and self._sweeper.is_alive()):
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid() and self._sweeper.is_alive():
+                return
+            self._stop.clear()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='cache-sweeper', daemon=True)
+            self._sweeper_pid = os.getpid()
+            self._sweeper.start()
+
+    def _sweep_loop(self) -> None:
+        while not self._stop.wait(self.sweep_interval):
+            self.purge_expired()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+
+
+class SerializationError(ValueError):
+    """Payload ilegible: formato desconocido, de otra versión o corrupto"""
+
+
+class CacheSerializer:
+    """Serialización compacta y versionada de los valores cacheados
+
+    Cada payload empieza con una cabecera de 4 bytes (``TC``, versión de
+    esquema, flags).  El cuerpo es msgpack si está instalado y JSON si no;
+    los cuerpos de más de ``compress_threshold`` bytes van con zlib.  Un
+    payload de otra versión (o un pickle de antes) se trata como fallo de
+    cache, así un deploy nunca lee formatos viejos.
+
+    Solo admite tipos de datos: dict, list, str, números, bool, None,
+    ``datetime``/``date``, ``Decimal`` y conjuntos.  Las tuplas vuelven
+    como listas y, con JSON, las claves de los dict como texto.
+    """
+
+    MAGIC = b'TC'
+    HEADER = struct.Struct('>2sBB')
+    FLAG_ZLIB = 0x01
+    FLAG_MSGPACK = 0x02
+
+    def __init__(self, fmt: str = 'auto', compress_threshold: int = 1024, compression_level: int = 6):
+        if fmt not in ('auto', 'msgpack', 'json'):
+            raise ValueError(f"Formato de serialización no soportado: {fmt}")
+        if fmt == 'msgpack' and not MSGPACK_AVAILABLE:
+            raise ValueError("msgpack no está instalado")
+        self.use_msgpack = fmt != 'json' and MSGPACK_AVAILABLE
+        self.compress_threshold = compress_threshold
+        self.compression_level = compression_level
+
+    @property
+    def name(self) -> str:
+        return 'msgpack' if self.use_msgpack else 'json'
+
+    @staticmethod
+    def _encode_extra(obj: Any) -> Any:
+        if isinstance(obj, datetime):
+            return {'__cache_type__': 'datetime', 'value': obj.isoformat()}
+        if isinstance(obj, date):
+            return {'__cache_type__': 'date', 'value': obj.isoformat()}
+        if isinstance(obj, Decimal):
+            return {'__cache_type__': 'decimal', 'value': str(obj)}
+        if isinstance(obj, (set, frozenset)):
+            return list(obj)
+        raise TypeError(f"Tipo no cacheable: {type(obj).__name__}")
+
+    @staticmethod
+    def _decode_extra(obj: Dict) -> Any:
+        kind = obj.get('__cache_type__')
+        if kind == 'datetime':
+            return datetime.fromisoformat(obj['value'])
+        if kind == 'date':
+            return date.fromisoformat(obj['value'])
+        if kind == 'decimal':
+            return Decimal(obj['value'])
+        return obj
+
+    def dumps(self, value: Any) -> bytes:
+        flags = 0
+        if self.use_msgpack:
+            body = msgpack.packb(value, default=self._encode_extra, use_bin_type=True)
+            flags |= self.FLAG_MSGPACK
+        else:
+            body = json.dumps(value, default=self._encode_extra, separators=(',', ':'),
+                              ensure_ascii=False).encode('utf-8')
+        if len(body) > self.compress_threshold:
+            body = zlib.compress(body, self.compression_level)
+            flags |= self.FLAG_ZLIB
+        return self.HEADER.pack(self.MAGIC, CACHE_SCHEMA_VERSION, flags) + body
+
+    def loads(self, payload: bytes) -> Any:
+        if len(payload) < self.HEADER.size:
+            raise SerializationError('payload demasiado corto')
+        magic, version, flags = self.HEADER.unpack_from(payload)
+        if magic != self.MAGIC or version != CACHE_SCHEMA_VERSION:
+            raise SerializationError(f'formato de cache desconocido (versión {version})')
+        body = payload[self.HEADER.size:]
+        try:
+            if flags & self.FLAG_ZLIB:
+                body = zlib.decompress(body)
+            if flags & self.FLAG_MSGPACK:
+                if not MSGPACK_AVAILABLE:
+                    raise SerializationError('payload msgpack sin msgpack instalado')
+                return msgpack.unpackb(body, object_hook=self._decode_extra, raw=False, strict_map_key=False)
+            return json.loads(body.decode('utf-8'), object_hook=self._decode_extra)
+        except SerializationError:
+            raise
+        except Exception as e:
+            raise SerializationError(str(e)) from e
+
+
+class RedisL2:
+    """L2 en Redis (compartido por todos los workers y servidores)"""
+
+    name = 'Redis'
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        """Valor y segundos que le quedan (``None`` si no vence), en un solo viaje"""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        payload, pttl = pipe.execute()
+        return payload, (pttl / 1000.0 if pttl is not None and pttl >= 0 else None)
+
+    def set(self, key: str, payload: bytes, ttl: float) -> bool:
+        return bool(self.client.setex(key, max(1, int(ttl)), payload))
+
+    def delete(self, key: str) -> bool:
+        return self.client.delete(key) > 0
+
+    def delete_pattern(self, pattern: str, batch_size: int = 500) -> int:
+        # SCAN por lotes: KEYS bloquea Redis para todos los clientes mientras recorre todas las claves
+        deleted = 0
+        batch = []
+        for key in self.client.scan_iter(match=pattern, count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += self.client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self.client.unlink(*batch)
+        return deleted
+
+    def generation(self, tag: str) -> int:
+        key = f"{GENERATION_PREFIX}{tag}"
+        value = self.client.get(key)
+        if value is None:
+            self.client.set(key, generation_seed(), nx=True)
+            value = self.client.get(key)
+        return int(value)
+
+    def bump_generation(self, tag: str) -> int:
+        key = f"{GENERATION_PREFIX}{tag}"
+        self.client.set(key, generation_seed(), nx=True)
+        return int(self.client.incr(key))
+
+    # Borra el lock solo si sigue siendo nuestro (pudo vencer y tomarlo otro)
+    _UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def try_lock(self, name: str, token: str, ttl: float) -> bool:
+        return bool(self.client.set(name, token, nx=True, px=int(ttl * 1000)))
+
+    def unlock(self, name: str, token: str) -> None:
+        self.client.eval(self._UNLOCK_SCRIPT, 1, name, token)
+
+    def stats(self) -> Dict:
+        info = self.client.info()
+        return {
+            'redis_memory': info.get('used_memory_human', 'N/A'),
+            'redis_keys': info.get('db0', {}).get('keys', 0),
+        }
+
+
+class SQLiteL2:
+    """L2 en un archivo SQLite: compartido por los workers de la misma máquina cuando no hay Redis
+
+    SQLite no expira filas por sí solo: cada ``purge_interval`` segundos
+    una escritura borra las entradas y locks vencidos, así las claves
+    huérfanas (p. ej. de generaciones de catálogo anteriores) no hacen
+    crecer el archivo.
+    """
+
+    name = 'SQLite'
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time, purge_interval: float = 60.0):
+        self.path = path
+        self._clock = clock
+        self.purge_interval = purge_interval
+        self._next_purge = clock() + purge_interval
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS cache_entry ('
+            ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)'
+        )
+        self._conn().execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_expires ON cache_entry (expires)')
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS cache_generation (tag TEXT PRIMARY KEY, value INTEGER NOT NULL)'
+        )
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS cache_lock (name TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+
+    def _conn(self):
+        # Una conexión por hilo y proceso (las conexiones no sobreviven a un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            'SELECT value FROM cache_entry WHERE key = ? AND expires > ?', (key, self._clock())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def get_with_ttl(self, key: str) -> Tuple[Optional[bytes], Optional[float]]:
+        now = self._clock()
+        row = self._conn().execute(
+            'SELECT value, expires FROM cache_entry WHERE key = ? AND expires > ?', (key, now)
+        ).fetchone()
+        return (bytes(row[0]), row[1] - now) if row else (None, None)
+
+    def set(self, key: str, payload: bytes, ttl: float) -> bool:
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache_entry (key, value, expires) VALUES (?, ?, ?)',
+            (key, payload, self._clock() + ttl),
+        )
+        self._maybe_purge()
+        return True
+
+    def _maybe_purge(self) -> None:
+        if self._clock() < self._next_purge:
+            return
+        self._next_purge = self._clock() + self.purge_interval
+        try:
+            self.purge_expired()
+        except Exception as e:
+            print(f"⚠️ No se pudo purgar el cache SQLite: {str(e)}")
+
+    def delete(self, key: str) -> bool:
+        return self._conn().execute('DELETE FROM cache_entry WHERE key = ?', (key,)).rowcount > 0
+
+    def delete_pattern(self, pattern: str) -> int:
+        # GLOB usa los mismos comodines que KEYS de Redis
+        return self._conn().execute('DELETE FROM cache_entry WHERE key GLOB ?', (pattern,)).rowcount
+
+    def purge_expired(self) -> int:
+        """Borrar entradas y locks vencidos; devuelve cuántas entradas"""
+        conn = self._conn()
+        now = self._clock()
+        conn.execute('DELETE FROM cache_lock WHERE expires <= ?', (now,))
+        return conn.execute('DELETE FROM cache_entry WHERE expires <= ?', (now,)).rowcount
+
+    def generation(self, tag: str) -> int:
+        conn = self._conn()
+        conn.execute('INSERT OR IGNORE INTO cache_generation (tag, value) VALUES (?, ?)', (tag, generation_seed()))
+        return conn.execute('SELECT value FROM cache_generation WHERE tag = ?', (tag,)).fetchone()[0]
+
+    def bump_generation(self, tag: str) -> int:
+        conn = self._conn()
+        conn.execute('INSERT OR IGNORE INTO cache_generation (tag, value) VALUES (?, ?)', (tag, generation_seed()))
+        conn.execute('UPDATE cache_generation SET value = value + 1 WHERE tag = ?', (tag,))
+        return conn.execute('SELECT value FROM cache_generation WHERE tag = ?', (tag,)).fetchone()[0]
+
+    def try_lock(self, name: str, token: str, ttl: float) -> bool:
+        conn = self._conn()
+        now = self._clock()
+        conn.execute('DELETE FROM cache_lock WHERE name = ? AND expires <= ?', (name, now))
+        return conn.execute(
+            'INSERT OR IGNORE INTO cache_lock (name, token, expires) VALUES (?, ?, ?)', (name, token, now + ttl)
+        ).rowcount == 1
+
+    def unlock(self, name: str, token: str) -> None:
+        self._conn().execute('DELETE FROM cache_lock WHERE name = ? AND token = ?', (name, token))
+
+    def stats(self) -> Dict:
+        count = self._conn().execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+        return {'sqlite_path': self.path, 'sqlite_keys': count}
+
+
+INVALIDATION_CHANNEL = 'cache:invalidate'
+GENERATION_PREFIX = 'cache:gen:'
+LOCK_PREFIX = 'cache:lock:'
+
+
+def generation_seed() -> int:
+    """Valor inicial de una generación compartida
+
+    Se basa en el reloj para que, si el contador se pierde (reinicio o
+    desalojo en Redis), la nueva generación no coincida con claves viejas.
+    """
+    return int(time.time() * 1000)
+
+
 class CacheManager:
-    """Gestor de cache Redis con fallback a memoria"""
+    """Cache de dos niveles: L1 en memoria del proceso delante de un L2 compartido
+
+    El L2 es Redis si responde; si no, un archivo SQLite compartido (con
+    ``sqlite_path``) y, en último caso, solo el L1.  Las escrituras van a
+    ambos niveles y, con Redis, se publica la clave en ``cache:invalidate``
+    para que los demás workers descarten su copia en L1.  Sin pub/sub el
+    L1 solo guarda ``l1_ttl`` segundos, lo que acota la desactualización.
+    """
     
-    def __init__(self, redis_url: str = None):
+    def __init__(self, redis_url: str = None, memory_cache: LRUMemoryCache = None,
+                 l2_backend: str = 'auto', sqlite_path: str = None, l1_ttl: float = None,
+                 serializer: CacheSerializer = None):
         self.redis_url = redis_url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
         self.redis_client = None
-        self.memory_cache = {}  # Fallback cache
+        self.l2 = None
+        # L1 acotado (LRU + TTL) en cada proceso
+        self.memory_cache = memory_cache or LRUMemoryCache(
+            max_entries=int(os.getenv('CACHE_MEMORY_MAX_ENTRIES', '2048')),
+            max_bytes=int(os.getenv('CACHE_MEMORY_MAX_BYTES', str(32 * 1024 * 1024))),
+            sweep_interval=float(os.getenv('CACHE_SWEEP_INTERVAL', '60')),
+        )
+        self.serializer = serializer or CacheSerializer(
+            fmt=os.getenv('CACHE_SERIALIZER', 'auto'),
+            compress_threshold=int(os.getenv('CACHE_COMPRESS_THRESHOLD', '1024')),
+        )
+        self.instance_id = uuid.uuid4().hex
+        # Generaciones por etiqueta: tag -> (valor, expira)
+        self._generations: Dict[str, Tuple[int, float]] = {}
+        # Locks de recálculo por clave: key -> [RLock, usuarios]; se borran al quedar sin usuarios
+        self._flight_locks: Dict[str, List] = {}
+        self._flight_guard = threading.Lock()
+        self._random = random.random
+        self._subscriber = None
+        self._subscriber_pid = None
+        self._subscriber_lock = threading.Lock()
         self.cache_stats = {
             'hits': 0,
             'misses': 0,
+            'l1_hits': 0,
+            'l2_hits': 0,
             'sets': 0,
-            'deletes': 0
+            'deletes': 0,
+            'invalidations': 0,
+            'invalidations_received': 0,
+            'stale_payloads': 0,
+            'recomputes': 0,
+            'early_refreshes': 0,
+            'stale_served': 0,
         }
         
-        self._connect_redis()
+        if l2_backend in ('auto', 'redis'):
+            self._connect_redis()
+        if self.redis_client:
+            self.l2 = RedisL2(self.redis_client)
+        elif l2_backend in ('auto', 'sqlite') and sqlite_path:
+            try:
+                self.l2 = SQLiteL2(sqlite_path)
+                print(f"📝 Usando SQLite como cache compartido: {sqlite_path}")
+            except Exception as e:
+                print(f"⚠️ No se pudo abrir el cache SQLite: {str(e)}")
+
+        if l1_ttl is None:
+            l1_ttl = float(os.getenv('CACHE_L1_TTL', '30' if self.redis_client else '5'))
+        self.l1_ttl = l1_ttl
     
     def _connect_redis(self):
         """Conectar a Redis con manejo de errores"""
@@ -49,24 +524,271 @@ class CacheManager:
             print(f"⚠️ No se pudo conectar a Redis: {str(e)}")
             print("📝 Usando cache en memoria como fallback")
             self.redis_client = None
+
+    @property
+    def backend_name(self) -> str:
+        return self.l2.name if self.l2 else 'Memory'
+
+    def _l1_ttl(self, ttl: float) -> float:
+        return min(ttl, self.l1_ttl) if self.l2 else ttl
+
+    # --- Invalidación entre workers (Redis pub/sub) ---
+
+    def _publish(self, op: str, target: str) -> None:
+        if not self.redis_client:
+            return
+        try:
+            message = json.dumps({'origin': self.instance_id, 'op': op, 'target': target})
+            self.redis_client.publish(INVALIDATION_CHANNEL, message)
+        except Exception as e:
+            print(f"⚠️ No se pudo publicar la invalidación de {target}: {str(e)}")
+
+    def apply_invalidation(self, data) -> None:
+        """Aplicar en el L1 local un mensaje de invalidación de otro worker"""
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if message.get('origin') == self.instance_id:
+            return
+        self.cache_stats['invalidations_received'] += 1
+        target = message.get('target', '')
+        if message.get('op') == 'generation':
+            self._generations.pop(target, None)
+        elif message.get('op') == 'pattern':
+            for key in self.memory_cache.keys():
+                if fnmatch.fnmatch(key, target):
+                    self.memory_cache.delete(key)
+        elif message.get('op') == 'flush':
+            self.memory_cache.clear()
+        else:
+            self.memory_cache.delete(target)
+
+    def _ensure_subscriber(self) -> None:
+        if not self.redis_client or (self._subscriber_pid == os.getpid() and self._subscriber.is_alive()):
+            return
+        with self._subscriber_lock:
+            if self._subscriber_pid == os.getpid() and self._subscriber.is_alive():
+                return
+            # Lo que haya en L1 pudo quedar obsoleto mientras no escuchábamos
+            self.memory_cache.clear()
+            self._subscriber = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+            self._subscriber_pid = os.getpid()
+            self._subscriber.start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.apply_invalidation(message['data'])
+            except Exception as e:
+                print(f"⚠️ Suscripción de invalidación interrumpida: {str(e)}")
+                self.memory_cache.clear()
+                time.sleep(1)
+
+    # --- Invalidación por etiquetas ---
+
+    def generation(self, tag: str) -> int:
+        """Generación actual de una etiqueta; se incluye en las claves que dependen de ella"""
+        now = time.monotonic()
+        cached = self._generations.get(tag)
+        if cached and cached[1] > now:
+            return cached[0]
+        try:
+            self._ensure_subscriber()
+            if self.l2:
+                value = self.l2.generation(tag)
+                self._generations[tag] = (value, now + self.l1_ttl)
+            else:
+                # Solo L1: el contador vive en este proceso y nunca caduca
+                value = cached[0] if cached else 0
+                self._generations[tag] = (value, float('inf'))
+            return value
+        except Exception as e:
+            print(f"❌ Error leyendo la generación {tag}: {str(e)}")
+            return cached[0] if cached else 0
+
+    def bump_generation(self, tag: str) -> int:
+        """Invalidar en O(1) todas las entradas de una etiqueta
+
+        Las claves de la generación anterior dejan de consultarse y caducan
+        solas por TTL (o las desaloja el LRU), sin recorrer el keyspace.
+        """
+        try:
+            if self.l2:
+                value = self.l2.bump_generation(tag)
+                self._generations[tag] = (value, time.monotonic() + self.l1_ttl)
+            else:
+                cached = self._generations.get(tag)
+                value = (cached[0] if cached else 0) + 1
+                self._generations[tag] = (value, float('inf'))
+            self._publish('generation', tag)
+            self.cache_stats['invalidations'] += 1
+            return value
+        except Exception as e:
+            print(f"❌ Error invalidando la etiqueta {tag}: {str(e)}")
+            # Sin contador compartido no hay invalidación confiable: descartar lo local
+            self._generations.pop(tag, None)
+            self.memory_cache.clear()
+            return 0
+
+    # --- Recalculo de una sola vez (single-flight) ---
+
+    @contextmanager
+    def _single_flight(self, key: str, wait: float, lock_ttl: float) -> Iterator[bool]:
+        """Lock por clave en el proceso y, si hay L2, entre workers
+
+        Produce ``True`` si este llamador es quien debe recalcular; con
+        ``wait`` en 0 no espera a que otro termine.
+        """
+        with self._flight_guard:
+            slot = self._flight_locks.setdefault(key, [threading.RLock(), 0])
+            slot[1] += 1
+        try:
+            deadline = time.monotonic() + wait
+            local = slot[0]
+            if not (local.acquire(timeout=wait) if wait > 0 else local.acquire(blocking=False)):
+                yield False
+                return
+            try:
+                yield from self._shared_flight(key, deadline, lock_ttl)
+            finally:
+                local.release()
+        finally:
+            with self._flight_guard:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._flight_locks[key]
+
+    def _shared_flight(self, key: str, deadline: float, lock_ttl: float) -> Iterator[bool]:
+        """Parte entre workers de :meth:`_single_flight` (lock en el L2)"""
+        name, token = f"{LOCK_PREFIX}{key}", None
+        try:
+            if self.l2:
+                try:
+                    candidate = uuid.uuid4().hex
+                    while not self.l2.try_lock(name, candidate, lock_ttl):
+                        if time.monotonic() >= deadline:
+                            break
+                        time.sleep(0.05)
+                    else:
+                        token = candidate
+                except Exception as e:
+                    # Sin lock compartido se recalcula igual (solo lo protege el lock local)
+                    print(f"⚠️ No se pudo obtener el lock de {key}: {str(e)}")
+                    token = ''
+            yield token is not None or not self.l2
+        finally:
+            if token:
+                try:
+                    self.l2.unlock(name, token)
+                except Exception as e:
+                    print(f"⚠️ No se pudo liberar el lock de {key}: {str(e)}")
+
+    def _get_entry(self, key: str) -> Optional[Dict]:
+        entry = self.get(key)
+        return entry if isinstance(entry, dict) and entry.get('__entry__') else None
+
+    def set_entry(self, key: str, value: Any, ttl: int = 3600, stale_ttl: Optional[int] = None,
+                  delta: float = 0.0) -> bool:
+        """Guardar un valor con vencimiento lógico ``ttl`` y margen ``stale_ttl`` para servirlo vencido"""
+        stale_ttl = ttl if stale_ttl is None else stale_ttl
+        entry = {'__entry__': True, 'value': value, 'expires': time.time() + ttl, 'delta': delta}
+        return self.set(key, entry, ttl + stale_ttl)
+
+    def get_fresh(self, key: str) -> Optional[Any]:
+        """Valor guardado con :meth:`set_entry` si todavía no venció"""
+        entry = self._get_entry(key)
+        if entry and entry['expires'] > time.time():
+            return entry['value']
+        return None
+
+    def _refresh_early(self, entry: Dict, now: float, beta: float) -> bool:
+        # XFetch: la probabilidad crece al acercarse el vencimiento y con el costo del cálculo
+        delta = entry.get('delta') or 0
+        if delta <= 0 or beta <= 0:
+            return False
+        return now - delta * beta * math.log(1.0 - self._random()) >= entry['expires']
+
+    def _recompute(self, key: str, compute: Callable[[], Any], ttl: int, stale_ttl: int) -> Any:
+        started = time.monotonic()
+        value = compute()
+        self.set_entry(key, value, ttl, stale_ttl, delta=time.monotonic() - started)
+        self.cache_stats['recomputes'] += 1
+        return value
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl: int = 3600, stale_ttl: Optional[int] = None,
+                   beta: float = 1.0, lock_wait: float = 10.0, lock_ttl: float = 30.0) -> Any:
+        """Obtener un valor o calcularlo una sola vez entre todos los workers
+
+        * Fresco: se devuelve, salvo que toque el refresco anticipado
+          probabilístico (más probable cerca del vencimiento y cuanto más
+          tarda ``compute``).
+        * Vencido pero dentro de ``stale_ttl`` (por defecto ``ttl``): quien
+          obtiene el lock recalcula y el resto sirve el valor anterior.
+        * Ausente: uno calcula y los demás esperan el lock hasta
+          ``lock_wait`` segundos y leen su resultado (si el tiempo se
+          agota calculan ellos).
+        """
+        stale_ttl = ttl if stale_ttl is None else stale_ttl
+        entry = self._get_entry(key)
+        if entry is not None:
+            now = time.time()
+            fresh = entry['expires'] > now
+            if fresh and not self._refresh_early(entry, now, beta):
+                return entry['value']
+            with self._single_flight(key, wait=0, lock_ttl=lock_ttl) as leader:
+                if not leader:
+                    if not fresh:
+                        self.cache_stats['stale_served'] += 1
+                    return entry['value']
+                if fresh:
+                    self.cache_stats['early_refreshes'] += 1
+                try:
+                    return self._recompute(key, compute, ttl, stale_ttl)
+                except Exception as e:
+                    print(f"❌ Error recalculando {key}, se sirve el valor anterior: {str(e)}")
+                    self.cache_stats['stale_served'] += 1
+                    return entry['value']
+
+        with self._single_flight(key, wait=lock_wait, lock_ttl=lock_ttl):
+            # Otro worker pudo calcularlo mientras esperábamos
+            entry = self._get_entry(key)
+            if entry is not None:
+                return entry['value']
+            return self._recompute(key, compute, ttl, stale_ttl)
+
+    # --- Operaciones ---
     
     def get(self, key: str) -> Optional[Any]:
-        """Obtener valor del cache"""
+        """Obtener valor del cache (L1 y luego L2)"""
         try:
-            if self.redis_client:
-                value = self.redis_client.get(key)
-                if value is not None:
+            self._ensure_subscriber()
+            payload = self.memory_cache.get(key)
+            if payload is not None:
+                self.cache_stats['l1_hits'] += 1
+            elif self.l2:
+                payload, remaining = self.l2.get_with_ttl(key)
+                if payload is not None:
+                    self.cache_stats['l2_hits'] += 1
+                    # La copia en L1 no puede durar más de lo que le queda en L2
+                    l1_ttl = self.l1_ttl if remaining is None else min(self.l1_ttl, remaining)
+                    if l1_ttl > 0:
+                        self.memory_cache.set(key, payload, l1_ttl)
+
+            if payload is not None:
+                try:
+                    value = self.serializer.loads(payload)
+                except SerializationError:
+                    # Formato viejo (otro deploy): se trata como fallo y se recalcula
+                    self.cache_stats['stale_payloads'] += 1
+                    self.memory_cache.delete(key)
+                else:
                     self.cache_stats['hits'] += 1
-                    return pickle.loads(value)
-            else:
-                # Fallback a memoria
-                if key in self.memory_cache:
-                    item = self.memory_cache[key]
-                    if item['expires'] > datetime.now():
-                        self.cache_stats['hits'] += 1
-                        return item['value']
-                    else:
-                        del self.memory_cache[key]
+                    return value
             
             self.cache_stats['misses'] += 1
             return None
@@ -79,20 +801,17 @@ class CacheManager:
     def set(self, key: str, value: Any, ttl: int = 3600) -> bool:
         """Establecer valor en cache con TTL en segundos"""
         try:
-            if self.redis_client:
-                serialized = pickle.dumps(value)
-                result = self.redis_client.setex(key, ttl, serialized)
-                self.cache_stats['sets'] += 1
-                return result
+            self._ensure_subscriber()
+            payload = self.serializer.dumps(value)
+            if self.l2:
+                stored = self.l2.set(key, payload, ttl)
+                self.memory_cache.set(key, payload, self._l1_ttl(ttl))
             else:
-                # Fallback a memoria
-                expires = datetime.now() + timedelta(seconds=ttl)
-                self.memory_cache[key] = {
-                    'value': value,
-                    'expires': expires
-                }
+                stored = self.memory_cache.set(key, payload, ttl)
+            self._publish('key', key)
+            if stored:
                 self.cache_stats['sets'] += 1
-                return True
+            return stored
                 
         except Exception as e:
             print(f"❌ Error estableciendo cache {key}: {str(e)}")
@@ -101,12 +820,10 @@ class CacheManager:
     def delete(self, key: str) -> bool:
         """Eliminar clave del cache"""
         try:
-            if self.redis_client:
-                result = self.redis_client.delete(key) > 0
-            else:
-                result = key in self.memory_cache
-                if result:
-                    del self.memory_cache[key]
+            result = self.memory_cache.delete(key)
+            if self.l2:
+                result = self.l2.delete(key) or result
+            self._publish('key', key)
             
             if result:
                 self.cache_stats['deletes'] += 1
@@ -117,25 +834,20 @@ class CacheManager:
             return False
     
     def clear_pattern(self, pattern: str) -> int:
-        """Eliminar claves que coincidan con un patrón"""
+        """Eliminar claves que coincidan con un patrón (mantenimiento)
+
+        Recorre el keyspace con SCAN; para invalidar en el camino de una
+        petición usar :meth:`bump_generation`.
+        """
         try:
-            if self.redis_client:
-                keys = self.redis_client.keys(pattern)
-                if keys:
-                    deleted = self.redis_client.delete(*keys)
-                    self.cache_stats['deletes'] += deleted
-                    return deleted
-            else:
-                # Fallback a memoria
-                import fnmatch
-                keys_to_delete = [k for k in self.memory_cache.keys() 
-                                if fnmatch.fnmatch(k, pattern)]
-                for key in keys_to_delete:
-                    del self.memory_cache[key]
-                self.cache_stats['deletes'] += len(keys_to_delete)
-                return len(keys_to_delete)
-            
-            return 0
+            keys_to_delete = [k for k in self.memory_cache.keys()
+                            if fnmatch.fnmatch(k, pattern)]
+            for key in keys_to_delete:
+                self.memory_cache.delete(key)
+            deleted = self.l2.delete_pattern(pattern) if self.l2 else len(keys_to_delete)
+            self._publish('pattern', pattern)
+            self.cache_stats['deletes'] += deleted
+            return deleted
             
         except Exception as e:
             print(f"❌ Error eliminando patrón {pattern}: {str(e)}")
@@ -146,65 +858,93 @@ class CacheManager:
         total_requests = self.cache_stats['hits'] + self.cache_stats['misses']
         hit_rate = (self.cache_stats['hits'] / total_requests * 100) if total_requests > 0 else 0
         
-        stats = {
-            'hits': self.cache_stats['hits'],
-            'misses': self.cache_stats['misses'],
-            'sets': self.cache_stats['sets'],
-            'deletes': self.cache_stats['deletes'],
+        stats = dict(self.cache_stats)
+        stats.update({
             'hit_rate': round(hit_rate, 2),
             'total_requests': total_requests,
-            'backend': 'Redis' if self.redis_client else 'Memory'
-        }
+            'backend': self.backend_name,
+            'serializer': self.serializer.name,
+            'memory_keys': len(self.memory_cache),
+            'memory_bytes': self.memory_cache.nbytes,
+            'memory_evictions': self.memory_cache.evictions,
+            'memory_expirations': self.memory_cache.expirations,
+        })
         
-        if self.redis_client:
+        if self.l2:
             try:
-                info = self.redis_client.info()
-                stats['redis_memory'] = info.get('used_memory_human', 'N/A')
-                stats['redis_keys'] = info.get('db0', {}).get('keys', 0)
-            except:
+                stats.update(self.l2.stats())
+            except Exception:
                 pass
-        else:
-            stats['memory_keys'] = len(self.memory_cache)
         
         return stats
 
-# Instancia global del cache
+# Instancia global del cache (init_app la reemplaza con la configuración de la app)
 cache = CacheManager()
 
-def cached(ttl: int = 3600, key_prefix: str = ""):
-    """Decorador para cachear resultados de funciones"""
+
+def init_app(app) -> CacheManager:
+    """Configurar el cache global para la app: Redis o SQLite compartido como L2
+
+    ``CACHE_L2_BACKEND``: auto (Redis si responde, si no SQLite), redis,
+    sqlite o none (solo L1); por defecto none con TESTING.
+    ``CACHE_SERIALIZER``: auto (msgpack si está instalado), msgpack o json.
+    """
+    global cache
+    backend = app.config.get('CACHE_L2_BACKEND') or ('none' if app.testing else 'auto')
+    sqlite_path = app.config.get('CACHE_SQLITE_PATH') or os.path.join(app.instance_path, 'cache.sqlite3')
+    cache = CacheManager(
+        redis_url=app.config.get('REDIS_URL'),
+        l2_backend=backend,
+        sqlite_path=sqlite_path,
+        l1_ttl=app.config.get('CACHE_L1_TTL'),
+        serializer=CacheSerializer(
+            fmt=app.config.get('CACHE_SERIALIZER') or 'auto',
+            compress_threshold=app.config.get('CACHE_COMPRESS_THRESHOLD', 1024),
+        ),
+    )
+    app.extensions['cache_manager'] = cache
+    return cache
+
+def cached(ttl: int = 3600, key_prefix: str = "", stale_ttl: Optional[int] = None):
+    """Decorador para cachear resultados de funciones
+
+    Un solo llamador recalcula cuando la entrada vence; los demás sirven
+    el valor anterior durante ``stale_ttl`` segundos (ver ``get_or_set``).
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Generar clave única
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(kwargs))}"
-            
-            # Intentar obtener del cache
-            result = cache.get(cache_key)
-            if result is not None:
-                return result
-            
-            # Ejecutar función y cachear resultado
-            result = func(*args, **kwargs)
-            cache.set(cache_key, result, ttl)
-            return result
+            # Clave estable entre procesos (no usar hash(), que cambia en cada worker)
+            cache_key = f"{key_prefix}:{func.__module__}.{func.__qualname__}:{stable_key(args, kwargs)}"
+            return cache.get_or_set(cache_key, lambda: func(*args, **kwargs), ttl, stale_ttl=stale_ttl)
         
         return wrapper
     return decorator
 
 class ToyCache:
-    """Cache específico para juguetes"""
+    """Cache específico para juguetes
+
+    Los listados y búsquedas dependen de la generación ``catalog``: al
+    editar un juguete se incrementa el contador y las entradas anteriores
+    dejan de usarse sin recorrer claves.
+    """
+
+    CATALOG_TAG = 'catalog'
+
+    @staticmethod
+    def _catalog_key(key: str) -> str:
+        return f"{key}:g{cache.generation(ToyCache.CATALOG_TAG)}"
     
     @staticmethod
     def get_active_toys(page: int = 1, per_page: int = 12) -> Optional[List]:
         """Obtener juguetes activos con cache"""
-        key = f"toys:active:page:{page}:per_page:{per_page}"
+        key = ToyCache._catalog_key(f"toys:active:page:{page}:per_page:{per_page}")
         return cache.get(key)
     
     @staticmethod
     def set_active_toys(toys_data: List, page: int = 1, per_page: int = 12, ttl: int = 300):
         """Cachear juguetes activos (5 minutos)"""
-        key = f"toys:active:page:{page}:per_page:{per_page}"
+        key = ToyCache._catalog_key(f"toys:active:page:{page}:per_page:{per_page}")
         cache.set(key, toys_data, ttl)
     
     @staticmethod
@@ -223,23 +963,27 @@ class ToyCache:
     def invalidate_toy(toy_id: int):
         """Invalidar cache de un juguete específico"""
         cache.delete(f"toy:id:{toy_id}")
-        # Invalidar también las listas de juguetes
-        cache.clear_pattern("toys:active:*")
-        cache.clear_pattern("toys:search:*")
+        # Invalidar también las listas y búsquedas (O(1), sin KEYS)
+        ToyCache.invalidate_catalog()
+
+    @staticmethod
+    def invalidate_catalog():
+        """Invalidar todos los listados y búsquedas de juguetes"""
+        cache.bump_generation(ToyCache.CATALOG_TAG)
+    
+    @staticmethod
+    def search_key(query: str, filters: Dict, page: int = 1) -> str:
+        return f"toys:search:{stable_key(query, filters)}:page:{page}"
     
     @staticmethod
     def get_search_results(query: str, filters: Dict, page: int = 1) -> Optional[List]:
         """Obtener resultados de búsqueda con cache"""
-        filter_str = json.dumps(filters, sort_keys=True)
-        key = f"toys:search:{hash(query + filter_str)}:page:{page}"
-        return cache.get(key)
+        return cache.get(ToyCache._catalog_key(ToyCache.search_key(query, filters, page)))
     
     @staticmethod
     def set_search_results(query: str, filters: Dict, results: List, page: int = 1, ttl: int = 300):
         """Cachear resultados de búsqueda (5 minutos)"""
-        filter_str = json.dumps(filters, sort_keys=True)
-        key = f"toys:search:{hash(query + filter_str)}:page:{page}"
-        cache.set(key, results, ttl)
+        cache.set(ToyCache._catalog_key(ToyCache.search_key(query, filters, page)), results, ttl)
 
 class CartCache:
     """Cache para carritos de compra persistentes"""
@@ -283,22 +1027,40 @@ class CartCache:
         cache.delete(f"cart:user:{user_id}")
 
 class DashboardCache:
-    """Cache para estadísticas del dashboard"""
+    """Cache para estadísticas del dashboard
+
+    Las entradas se recalculan una sola vez al vencer (``get_or_set``):
+    mientras tanto los demás administradores ven el valor anterior.
+    """
+
+    STATS_KEY = "dashboard:stats"
+    SALES_STATS_KEY = "dashboard:sales_stats"
     
     @staticmethod
     def get_stats() -> Optional[Dict]:
         """Obtener estadísticas del dashboard"""
-        return cache.get("dashboard:stats")
+        return cache.get_fresh(DashboardCache.STATS_KEY)
     
     @staticmethod
     def set_stats(stats: Dict, ttl: int = 300):
         """Cachear estadísticas del dashboard (5 minutos)"""
-        cache.set("dashboard:stats", stats, ttl)
+        cache.set_entry(DashboardCache.STATS_KEY, stats, ttl)
+
+    @staticmethod
+    def get_or_compute_stats(compute: Callable[[], Dict], ttl: int = 300) -> Dict:
+        """Resumen de inventario del dashboard, calculado por un solo worker (5 minutos)"""
+        return cache.get_or_set(DashboardCache.STATS_KEY, compute, ttl)
+
+    @staticmethod
+    def get_or_compute_sales_stats(compute: Callable[[], Dict], ttl: int = 300) -> Dict:
+        """Totales de ventas del dashboard, calculados por un solo worker (5 minutos)"""
+        return cache.get_or_set(DashboardCache.SALES_STATS_KEY, compute, ttl)
     
     @staticmethod
     def invalidate_stats():
         """Invalidar cache de estadísticas"""
-        cache.delete("dashboard:stats")
+        cache.delete(DashboardCache.STATS_KEY)
+        cache.delete(DashboardCache.SALES_STATS_KEY)
 
 def install_redis():
     """Instalar Redis usando pip"""
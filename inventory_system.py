@@ -6,6 +6,7 @@ Alertas automáticas, predicción de reabastecimiento y dashboard en tiempo real
 
 import os
 import sys
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import smtplib
@@ -15,21 +16,37 @@ from email.mime.multipart import MIMEMultipart
 # Agregar el directorio actual al path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import create_app
-from extensions import db
-from models import Toy, Order, OrderItem, User
+from flask import current_app, has_app_context
+from app.extensions import db
+from app.models import Toy, Order, OrderItem, User
+from app.utils.restock import ForecastSettings, forecast_restock, inventory_stats
 
 class InventoryManager:
     """Gestor inteligente de inventario"""
     
-    def __init__(self):
-        self.app = create_app()
+    EXTENSION_KEY = 'inventory_manager'
+    
+    def __init__(self, app=None):
+        self.app = None
         self.low_stock_threshold = 5  # Umbral de stock bajo
         self.critical_stock_threshold = 2  # Umbral crítico
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        """Registrar el gestor como servicio de la aplicación"""
+        self.app = app
+        app.extensions.setdefault(self.EXTENSION_KEY, self)
+    
+    def _app_context(self):
+        """Reutilizar el contexto activo; solo se crea uno fuera de Flask (scripts)"""
+        if has_app_context() or self.app is None:
+            return nullcontext()
+        return self.app.app_context()
         
     def check_low_stock(self) -> List[Dict]:
         """Verificar juguetes con stock bajo"""
-        with self.app.app_context():
+        with self._app_context():
             low_stock_toys = Toy.query.filter(
                 Toy.is_active == True,
                 Toy.stock <= self.low_stock_threshold
@@ -50,93 +67,50 @@ class InventoryManager:
             
             return alerts
     
-    def predict_restock_needs(self, days_ahead: int = 30) -> List[Dict]:
-        """Predecir necesidades de reabastecimiento basado en ventas históricas"""
-        with self.app.app_context():
-            # Calcular ventas promedio de los últimos 30 días
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-            
-            # Obtener ventas por juguete
-            sales_data = db.session.query(
-                OrderItem.toy_id,
-                db.func.sum(OrderItem.quantity).label('total_sold'),
-                db.func.count(OrderItem.id).label('order_count')
-            ).join(Order).filter(
-                Order.is_active == True,
-                Order.order_date >= thirty_days_ago
-            ).group_by(OrderItem.toy_id).all()
+    def forecast_settings(self, **overrides) -> ForecastSettings:
+        """Parámetros del pronóstico (config INVENTORY_FORECAST_* + umbrales del gestor)"""
+        app = self.app or current_app
+        return ForecastSettings.from_config(
+            app.config,
+            low_threshold=self.low_stock_threshold,
+            critical_threshold=self.critical_stock_threshold,
+            **overrides
+        )
+    
+    def predict_restock_needs(self, days_ahead: int = 30, window_days: Optional[int] = None,
+                              method: Optional[str] = None) -> List[Dict]:
+        """Predecir necesidades de reabastecimiento (una consulta sobre ventas diarias por juguete)"""
+        with self._app_context():
+            settings = self.forecast_settings(window_days=window_days, method=method)
+            forecasts = forecast_restock(days_ahead, settings)
             
-            predictions = []
-            for sale in sales_data:
-                toy = Toy.query.get(sale.toy_id)
-                if toy and toy.is_active:
-                    # Calcular ventas promedio diarias
-                    daily_avg = sale.total_sold / 30
-                    predicted_demand = daily_avg * days_ahead
-                    
-                    # Determinar si necesita reabastecimiento
-                    needs_restock = toy.stock < predicted_demand
-                    
-                    if needs_restock:
-                        suggested_order = max(
-                            int(predicted_demand - toy.stock + 10),  # Buffer de 10
-                            20  # Mínimo de 20 unidades
-                        )
-                        
-                        predictions.append({
-                            'toy_id': toy.id,
-                            'name': toy.name,
-                            'category': toy.category,
-                            'current_stock': toy.stock,
-                            'daily_avg_sales': round(daily_avg, 2),
-                            'predicted_demand': int(predicted_demand),
-                            'suggested_order_qty': suggested_order,
-                            'urgency': 'ALTA' if toy.stock < daily_avg * 7 else 'MEDIA'
-                        })
+            predictions = [
+                {
+                    'toy_id': f.toy_id,
+                    'name': f.name,
+                    'category': f.category,
+                    'current_stock': f.stock,
+                    'daily_avg_sales': round(f.daily_rate, 2),
+                    'predicted_demand': int(f.predicted_demand),
+                    'coverage_days': f.coverage_days,
+                    'alert_level': f.alert_level,
+                    'suggested_order_qty': f.suggested_order_qty,
+                    'urgency': f.urgency,
+                    'forecast_method': settings.method
+                }
+                for f in forecasts if f.needs_restock
+            ]
             
             return sorted(predictions, key=lambda x: x['urgency'] == 'ALTA', reverse=True)
     
     def get_inventory_stats(self) -> Dict:
-        """Obtener estadísticas generales del inventario"""
-        with self.app.app_context():
-            total_toys = Toy.query.filter_by(is_active=True).count()
-            total_stock = db.session.query(db.func.sum(Toy.stock)).filter(
-                Toy.is_active == True
-            ).scalar() or 0
-            
-            low_stock_count = Toy.query.filter(
-                Toy.is_active == True,
-                Toy.stock <= self.low_stock_threshold
-            ).count()
-            
-            critical_stock_count = Toy.query.filter(
-                Toy.is_active == True,
-                Toy.stock <= self.critical_stock_threshold
-            ).count()
-            
-            # Valor total del inventario
-            total_value = db.session.query(
-                db.func.sum(Toy.stock * Toy.price)
-            ).filter(Toy.is_active == True).scalar() or 0
-            
-            # Categorías con stock bajo
-            categories_low_stock = db.session.query(
-                Toy.category,
-                db.func.count(Toy.id)
-            ).filter(
-                Toy.is_active == True,
-                Toy.stock <= self.low_stock_threshold
-            ).group_by(Toy.category).all()
-            
-            return {
-                'total_products': total_toys,
-                'total_stock_units': int(total_stock),
-                'total_inventory_value': float(total_value),
-                'low_stock_count': low_stock_count,
-                'critical_stock_count': critical_stock_count,
-                'categories_with_low_stock': dict(categories_low_stock),
-                'stock_health': self._calculate_stock_health(total_toys, low_stock_count)
-            }
+        """Obtener estadísticas generales del inventario (una sola consulta agrupada)"""
+        with self._app_context():
+            stats = inventory_stats(self.low_stock_threshold, self.critical_stock_threshold)
+            stats['stock_health'] = self._calculate_stock_health(
+                stats['total_products'], stats['low_stock_count']
+            )
+            return stats
     
     def _calculate_stock_health(self, total: int, low_stock: int) -> str:
         """Calcular salud general del inventario"""
@@ -283,9 +257,19 @@ class InventoryManager:
             }
         }
 
+def get_inventory_manager(app=None) -> InventoryManager:
+    """Gestor de inventario de la aplicación (se crea una vez y se reutiliza)"""
+    app = app or current_app._get_current_object()
+    manager = app.extensions.get(InventoryManager.EXTENSION_KEY)
+    if manager is None:
+        InventoryManager(app)
+        manager = app.extensions[InventoryManager.EXTENSION_KEY]
+    return manager
+
 def main():
     """Función principal para ejecutar el sistema de inventario"""
-    manager = InventoryManager()
+    from app import create_app
+    manager = InventoryManager(create_app())
     
     print("📦 SISTEMA DE INVENTARIO INTELIGENTE - TIENDITA ALOHA")
     print("=" * 60)
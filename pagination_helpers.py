@@ -2,6 +2,10 @@
 Helpers de paginación para Tiendita ALOHA
 """
 
+import base64
+import binascii
+import json
+
 from flask import request, url_for
 from urllib.parse import urlencode
 
@@ -74,3 +78,22 @@ def paginate_query(query, page=None, per_page=None, error_out=False):
         per_page=per_page, 
         error_out=error_out
     )
+
+
+def encode_cursor(sort, key):
+    """Codificar la posición (modo de orden, clave keyset) como token opaco para URLs"""
+    payload = json.dumps({'s': sort, 'k': list(key)}, separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, sort):
+    """Decodificar un cursor; devuelve la clave como tupla o None si es inválido o de otro orden"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+    if not isinstance(payload, dict) or payload.get('s') != sort or not isinstance(payload.get('k'), list):
+        return None
+    return tuple(payload['k'])
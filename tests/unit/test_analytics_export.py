@@ -0,0 +1,140 @@
+import csv
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, User
+from app.utils.analytics_export import DATASET, MANIFEST, available_format, export_analytics, month_range
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app(tmp_path):
+    app = create_app(TestConfig)
+    app.config['ANALYTICS_EXPORT_DIR'] = str(tmp_path / 'analytics')
+    with app.app_context():
+        db.create_all()
+        ana = User(username='ana', email='ana@example.com', center='norte')
+        ana.set_password('password')
+        pelota = Toy(name='Pelota', sku='P-1', price=5.0, stock=10, category='Deportes')
+        db.session.add_all([ana, pelota])
+        db.session.flush()
+        for when, qty, center in [(datetime(2025, 1, 10), 2, None), (datetime(2025, 2, 3), 1, 'sur')]:
+            # Centro y categoría guardados como en el checkout
+            order = Order(user_id=ana.id, order_date=when, total_price=5.0 * qty,
+                          discount_center=center, center=center or ana.center, status='completada')
+            db.session.add(order)
+            db.session.add(OrderItem(order=order, toy_id=pelota.id, quantity=qty, price=5.0,
+                                     category=pelota.category))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _read_csv_partition(app, month):
+    path = os.path.join(app.config['ANALYTICS_EXPORT_DIR'], DATASET, f'month={month}', 'part-0.csv.gz')
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        return list(csv.DictReader(fh))
+
+
+def test_month_range_crosses_year():
+    assert month_range('2024-12') == (datetime(2024, 12, 1), datetime(2025, 1, 1))
+
+
+def test_csv_export_is_partitioned_and_incremental(app):
+    with app.app_context():
+        summary = export_analytics(fmt='csv')
+        assert summary.format == 'csv'
+        assert summary.written == ['2025-01', '2025-02'] and summary.rows == 2
+
+        january = _read_csv_partition(app, '2025-01')
+        assert january[0]['toy_sku'] == 'P-1'
+        assert (january[0]['center'], january[0]['quantity'], january[0]['line_total']) == ('norte', '2', '10.0')
+        assert _read_csv_partition(app, '2025-02')[0]['center'] == 'sur'
+        assert january[0]['toy_category'] == 'Deportes'
+
+        # Sin cambios no se reescribe nada
+        again = export_analytics(fmt='csv')
+        assert again.written == [] and again.unchanged == ['2025-01', '2025-02']
+
+        # Una orden nueva en febrero y enero eliminado: solo se toca lo que cambió
+        toy = Toy.query.first()
+        user = User.query.first()
+        order = Order(user_id=user.id, order_date=datetime(2025, 2, 20), total_price=5.0, status='completada')
+        db.session.add(order)
+        db.session.add(OrderItem(order=order, toy_id=toy.id, quantity=1, price=5.0))
+        db.session.commit()
+        third = export_analytics(fmt='csv')
+        assert third.written == ['2025-02'] and third.unchanged == ['2025-01']
+        assert len(_read_csv_partition(app, '2025-02')) == 2
+
+        jan_order = Order.query.filter(Order.order_date < datetime(2025, 2, 1)).one()
+        db.session.delete(jan_order)
+        db.session.commit()
+        fourth = export_analytics(fmt='csv')
+        assert fourth.removed == ['2025-01']
+
+        with open(os.path.join(app.config['ANALYTICS_EXPORT_DIR'], MANIFEST), encoding='utf-8') as fh:
+            manifest = json.load(fh)
+        assert sorted(manifest['months']) == ['2025-02']
+        assert manifest['format'] == 'csv'
+
+
+def test_arrow_formats_when_available(app):
+    pa = pytest.importorskip('pyarrow')
+    with app.app_context():
+        fmt = available_format()
+        summary = export_analytics(incremental=False)
+        assert summary.format == fmt
+        path = os.path.join(app.config['ANALYTICS_EXPORT_DIR'], DATASET, 'month=2025-01',
+                            'part-0.parquet' if fmt == 'parquet' else 'part-0.arrow')
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(path)
+        else:
+            table = pa.ipc.open_file(path).read_all()
+        assert table.column('quantity').to_pylist() == [2]
+
+
+def test_admin_route_runs_export(app):
+    with app.app_context():
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.commit()
+        admin_id = admin.id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+
+    resp = client.post('/admin/export_analytics', data={'full': '1'})
+    assert resp.status_code == 302
+    assert os.path.exists(os.path.join(app.config['ANALYTICS_EXPORT_DIR'], MANIFEST))
+
+
+def test_export_keeps_sale_time_center_and_category(app):
+    with app.app_context():
+        User.query.first().center = 'este'
+        Toy.query.first().category = 'Exterior'
+        db.session.commit()
+        export_analytics(fmt='csv')
+
+        row = _read_csv_partition(app, '2025-01')[0]
+        assert (row['center'], row['user_center'], row['toy_category']) == ('norte', 'este', 'Deportes')
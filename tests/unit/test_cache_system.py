@@ -0,0 +1,401 @@
+import fnmatch
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.append(ROOT)
+
+import cache_system
+from cache_system import CacheManager, LRUMemoryCache, ToyCache, stable_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def memory_manager(monkeypatch):
+    manager = CacheManager(memory_cache=LRUMemoryCache(max_entries=3, max_bytes=10_000, sweep_interval=0),
+                           l2_backend='none')
+    assert manager.l2 is None and manager.redis_client is None
+    monkeypatch.setattr(cache_system, 'cache', manager)
+    return manager
+
+
+def test_lru_evicts_least_recently_used_entry():
+    lru = LRUMemoryCache(max_entries=2, sweep_interval=0)
+    lru.set('a', b'1', 60)
+    lru.set('b', b'2', 60)
+    assert lru.get('a') == b'1'
+    lru.set('c', b'3', 60)
+
+    assert lru.keys() == ['a', 'c']
+    assert lru.evictions == 1
+
+
+def test_lru_respects_byte_limit():
+    lru = LRUMemoryCache(max_entries=100, max_bytes=10, sweep_interval=0)
+    lru.set('a', b'12345', 60)
+    lru.set('b', b'12345', 60)
+    lru.set('c', b'123', 60)
+    assert lru.keys() == ['b', 'c'] and lru.nbytes == 8
+    # Un valor más grande que el límite no se guarda
+    assert lru.set('huge', b'x' * 11, 60) is False
+
+
+def test_ttl_expiry_on_get_and_sweep():
+    clock = FakeClock()
+    lru = LRUMemoryCache(sweep_interval=0, clock=clock)
+    lru.set('short', b'1', 5)
+    lru.set('long', b'2', 60)
+    clock.now += 10
+    assert lru.get('short') is None
+    lru.set('other', b'3', 5)
+    clock.now += 10
+    assert lru.purge_expired() == 1
+    assert lru.keys() == ['long'] and lru.expirations == 2
+
+
+def test_manager_memory_fallback_returns_copies(memory_manager):
+    memory_manager.set('cart', {'items': {'1': 2}}, 60)
+    value = memory_manager.get('cart')
+    value['items']['1'] = 99
+    assert memory_manager.get('cart') == {'items': {'1': 2}}
+    assert memory_manager.clear_pattern('ca*') == 1
+    assert memory_manager.get_stats()['memory_keys'] == 0
+
+
+def test_stable_key_is_the_same_in_every_process():
+    code = "import cache_system; print(cache_system.ToyCache.search_key('pelota', {'b': 1, 'a': [2]}, 2))"
+    keys = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        keys.add(out.strip().splitlines()[-1])
+    assert keys == {ToyCache.search_key('pelota', {'a': [2], 'b': 1}, 2)}
+    assert stable_key('x', 1) != stable_key('x', '1')
+
+
+def test_cached_decorator_uses_stable_keys(memory_manager):
+    calls = []
+
+    @cache_system.cached(ttl=60, key_prefix='test')
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert square(4) == 16 and square(4) == 16
+    assert calls == [4]
+    assert any(key.startswith('test:') and key.endswith(stable_key((4,), {})) for key in memory_manager.memory_cache.keys())
+
+
+def test_sqlite_l2_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    first = CacheManager(l2_backend='sqlite', sqlite_path=path, l1_ttl=5,
+                         memory_cache=LRUMemoryCache(sweep_interval=0))
+    second = CacheManager(l2_backend='sqlite', sqlite_path=path, l1_ttl=5,
+                          memory_cache=LRUMemoryCache(sweep_interval=0))
+    assert first.backend_name == 'SQLite'
+
+    first.set('dashboard:stats', {'total_orders': 3}, 300)
+    assert second.get('dashboard:stats') == {'total_orders': 3}
+    assert second.get('dashboard:stats') == {'total_orders': 3}
+    stats = second.get_stats()
+    assert (stats['l2_hits'], stats['l1_hits']) == (1, 1)
+
+    # La copia en L1 vive como máximo l1_ttl aunque el valor dure más en L2
+    assert second.memory_cache._data['dashboard:stats'][1] <= time.monotonic() + 5
+    assert first.clear_pattern('dashboard:*') == 1
+    second.memory_cache.clear()
+    assert second.get('dashboard:stats') is None
+
+
+def test_invalidation_messages_drop_l1_copies(memory_manager):
+    memory_manager.set('toy:id:1', {'name': 'Pelota'}, 60)
+    memory_manager.set('toys:active:page:1:per_page:12', [1], 60)
+
+    # Los mensajes propios se ignoran
+    memory_manager.apply_invalidation(json.dumps({'origin': memory_manager.instance_id, 'op': 'key', 'target': 'toy:id:1'}))
+    assert memory_manager.get('toy:id:1') == {'name': 'Pelota'}
+
+    memory_manager.apply_invalidation(json.dumps({'origin': 'otro', 'op': 'key', 'target': 'toy:id:1'}))
+    memory_manager.apply_invalidation(json.dumps({'origin': 'otro', 'op': 'pattern', 'target': 'toys:active:*'}))
+    assert memory_manager.memory_cache.keys() == []
+    assert memory_manager.get_stats()['invalidations_received'] == 2
+
+
+def test_dashboard_stats_are_cached(memory_manager, monkeypatch):
+    from app import create_app, db
+    from app.config import Config
+    from blueprints import admin
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+        SECRET_KEY = 'test'
+
+    app = create_app(TestConfig)
+    monkeypatch.setattr(cache_system, 'cache', memory_manager)
+    calls = []
+
+    def fake_totals():
+        calls.append(1)
+        return {'total_sales': 10.0, 'total_orders': 2}
+
+    monkeypatch.setattr(admin, 'dashboard_totals', fake_totals)
+    with app.test_request_context():
+        db.create_all()
+        first = admin.get_dashboard_stats_optimized()
+        second = admin.get_dashboard_stats_optimized()
+        db.drop_all()
+    assert first == second and first['total_orders'] == 2
+    assert calls == [1]
+    # Los totales de ventas no pisan el resumen de inventario
+    assert cache_system.DashboardCache.get_stats() is None
+
+
+def test_catalog_generation_invalidates_searches(memory_manager):
+    ToyCache.set_search_results('pelota', {}, {'toys': [1]})
+    ToyCache.set_active_toys([1])
+    assert ToyCache.get_search_results('pelota', {}) == {'toys': [1]}
+
+    ToyCache.invalidate_toy(1)
+    assert ToyCache.get_search_results('pelota', {}) is None
+    assert ToyCache.get_active_toys() is None
+    assert memory_manager.get_stats()['invalidations'] == 1
+
+
+def test_generation_is_shared_through_sqlite(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    first = CacheManager(l2_backend='sqlite', sqlite_path=path, l1_ttl=0,
+                         memory_cache=LRUMemoryCache(sweep_interval=0))
+    second = CacheManager(l2_backend='sqlite', sqlite_path=path, l1_ttl=0,
+                          memory_cache=LRUMemoryCache(sweep_interval=0))
+    start = second.generation('catalog')
+    assert first.generation('catalog') == start
+    assert first.bump_generation('catalog') == start + 1
+    assert second.generation('catalog') == start + 1
+
+
+def test_redis_pattern_delete_uses_scan():
+    class FakeRedis:
+        def __init__(self):
+            self.data = {f'toys:search:{i}': b'x' for i in range(5)}
+            self.data['cart:user:1'] = b'x'
+
+        def keys(self, pattern):
+            raise AssertionError('KEYS no debe usarse')
+
+        def scan_iter(self, match, count):
+            return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+        def unlink(self, *keys):
+            return sum(self.data.pop(key, None) is not None for key in keys)
+
+    client = FakeRedis()
+    assert cache_system.RedisL2(client).delete_pattern('toys:search:*', batch_size=2) == 5
+    assert list(client.data) == ['cart:user:1']
+
+
+def test_invalidate_catalog_bumps_cache_generation(memory_manager):
+    from app.utils.catalog import invalidate_catalog
+
+    before = memory_manager.generation(ToyCache.CATALOG_TAG)
+    invalidate_catalog()
+    assert memory_manager.generation(ToyCache.CATALOG_TAG) == before + 1
+
+
+def test_serializer_round_trip_and_compression():
+    serializer = cache_system.CacheSerializer(fmt='json', compress_threshold=64)
+    value = {
+        'results': [{'name': 'Pelota', 'price': 2.5}] * 20,
+        'when': datetime(2025, 3, 1, 12, 30),
+        'day': date(2025, 3, 1),
+        'total': Decimal('10.50'),
+        'empty': None,
+    }
+    payload = serializer.dumps(value)
+    assert payload[:2] == b'TC' and payload[3] & serializer.FLAG_ZLIB
+    assert len(payload) < len(json.dumps(value, default=str))
+    assert serializer.loads(payload) == value
+
+    small = serializer.dumps({'a': 1})
+    assert not small[3] & serializer.FLAG_ZLIB
+    with pytest.raises(TypeError):
+        serializer.dumps(object())
+
+
+def test_stale_or_foreign_payloads_are_misses(memory_manager):
+    import pickle
+
+    memory_manager.memory_cache.set('legacy', pickle.dumps({'a': 1}), 60)
+    old_version = cache_system.CacheSerializer.HEADER.pack(b'TC', cache_system.CACHE_SCHEMA_VERSION + 1, 0) + b'{}'
+    memory_manager.memory_cache.set('old', old_version, 60)
+
+    assert memory_manager.get('legacy') is None
+    assert memory_manager.get('old') is None
+    assert memory_manager.get_stats()['stale_payloads'] == 2
+    assert memory_manager.memory_cache.keys() == []
+
+
+def test_msgpack_serializer_when_available():
+    pytest.importorskip('msgpack')
+    serializer = cache_system.CacheSerializer(fmt='msgpack')
+    payload = serializer.dumps({1: 'uno', 'when': date(2025, 1, 2)})
+    assert payload[3] & serializer.FLAG_MSGPACK
+    assert serializer.loads(payload) == {1: 'uno', 'when': date(2025, 1, 2)}
+
+
+def test_concurrent_misses_compute_once(memory_manager):
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(2)
+        return {'total': 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(memory_manager.get_or_set('stats', compute, 60)))
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == [{'total': 1}] * 6
+
+
+def test_expired_entry_is_served_while_another_recomputes(memory_manager):
+    memory_manager.set_entry('stats', 'old', ttl=0, stale_ttl=60)
+    holding, done = threading.Event(), threading.Event()
+
+    def leader():
+        with memory_manager._single_flight('stats', wait=0, lock_ttl=30):
+            holding.set()
+            done.wait(2)
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    holding.wait(2)
+    try:
+        assert memory_manager.get_or_set('stats', lambda: 'new', 60) == 'old'
+    finally:
+        done.set()
+        thread.join()
+    assert memory_manager.get_stats()['stale_served'] == 1
+    assert memory_manager.get_or_set('stats', lambda: 'new', 60) == 'new'
+    assert memory_manager.get_fresh('stats') == 'new'
+
+
+def test_early_refresh_is_probabilistic(memory_manager):
+    memory_manager.set_entry('report', 'v1', ttl=60, delta=100.0)
+    memory_manager._random = lambda: 0.0
+    assert memory_manager.get_or_set('report', lambda: 'v2', 60) == 'v1'
+    # Cálculo caro y mala suerte: se refresca antes de vencer
+    memory_manager._random = lambda: 0.999
+    assert memory_manager.get_or_set('report', lambda: 'v2', 60) == 'v2'
+    assert memory_manager.get_stats()['early_refreshes'] == 1
+
+
+def test_sqlite_lock_is_exclusive_until_released_or_expired(tmp_path):
+    clock = FakeClock()
+    l2 = cache_system.SQLiteL2(str(tmp_path / 'cache.sqlite3'), clock=clock)
+    assert l2.try_lock('cache:lock:stats', 'a', 30)
+    assert not l2.try_lock('cache:lock:stats', 'b', 30)
+    l2.unlock('cache:lock:stats', 'b')
+    assert not l2.try_lock('cache:lock:stats', 'b', 30)
+    clock.now += 31
+    assert l2.try_lock('cache:lock:stats', 'b', 30)
+
+
+def test_sqlite_l2_purges_expired_rows_periodically(tmp_path):
+    clock = FakeClock()
+    l2 = cache_system.SQLiteL2(str(tmp_path / 'cache.sqlite3'), clock=clock, purge_interval=60)
+    l2.set('toys:search:a:page:1:g1', b'x', 5)
+    l2.try_lock('cache:lock:stats', 'a', 5)
+    clock.now += 10
+    # Antes del intervalo no se purga
+    l2.set('toys:search:a:page:1:g2', b'y', 300)
+    assert l2.stats()['sqlite_keys'] == 2
+
+    clock.now += 60
+    l2.set('toys:search:a:page:1:g3', b'z', 300)
+    assert l2.stats()['sqlite_keys'] == 2
+    assert l2.get('toys:search:a:page:1:g1') is None
+    assert l2._conn().execute('SELECT COUNT(*) FROM cache_lock').fetchone()[0] == 0
+
+
+def test_single_flight_locks_are_per_key(memory_manager):
+    holding, done = threading.Event(), threading.Event()
+
+    def slow_report():
+        holding.set()
+        done.wait(2)
+        return 'report'
+
+    thread = threading.Thread(target=lambda: memory_manager.get_or_set('dashboard:stats', slow_report, 60))
+    thread.start()
+    holding.wait(2)
+    try:
+        # Otra clave no espera al recálculo en curso
+        started = time.monotonic()
+        assert memory_manager.get_or_set('toys:active', lambda: [1], 60, lock_wait=1) == [1]
+        assert time.monotonic() - started < 0.5
+    finally:
+        done.set()
+        thread.join()
+    assert memory_manager._flight_locks == {}
+
+
+def test_l1_copy_never_outlives_the_l2_entry(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    writer = CacheManager(l2_backend='sqlite', sqlite_path=path, l1_ttl=30,
+                          memory_cache=LRUMemoryCache(sweep_interval=0))
+    reader = CacheManager(l2_backend='sqlite', sqlite_path=path, l1_ttl=30,
+                          memory_cache=LRUMemoryCache(sweep_interval=0))
+    writer.set('toy:id:1', {'name': 'Pelota'}, 2)
+    assert reader.get('toy:id:1') == {'name': 'Pelota'}
+    assert reader.memory_cache._data['toy:id:1'][1] <= time.monotonic() + 2
+
+
+def test_redis_l2_reports_remaining_ttl():
+    class FakePipeline:
+        def __init__(self, results):
+            self.results = results
+
+        def get(self, key):
+            pass
+
+        def pttl(self, key):
+            pass
+
+        def execute(self):
+            return self.results
+
+    class FakeRedis:
+        results = [b'x', 1500]
+
+        def pipeline(self, transaction=True):
+            return FakePipeline(self.results)
+
+    client = FakeRedis()
+    assert cache_system.RedisL2(client).get_with_ttl('k') == (b'x', 1.5)
+    client.results = [b'x', -1]
+    assert cache_system.RedisL2(client).get_with_ttl('k') == (b'x', None)
@@ -0,0 +1,98 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, User
+from app.utils.cart_hydration import hydrate_cart, order_lines
+from app.utils.cart_store import CartLine
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+    CART_STORE_BACKEND = 'sql'
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        buyer = User(username='buyer', email='buyer@example.com', balance=100.0)
+        buyer.set_password('password')
+        db.session.add(buyer)
+        db.session.add_all([
+            Toy(name=f'Juguete {n}', description='', price=1.0 + n, category='Clásicos', stock=5)
+            for n in range(6)
+        ])
+        db.session.add(Toy(name='Retirado', description='', price=2.0, stock=5, is_active=False))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+def count_queries(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements, lambda: event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_hydrate_cart_uses_one_query_and_keeps_cart_prices(app):
+    with app.app_context():
+        toys = Toy.query.filter_by(is_active=True).order_by(Toy.id).all()
+        retired = Toy.query.filter_by(name='Retirado').first()
+        lines = [CartLine(toy.id, 2, 150) for toy in reversed(toys)]
+        lines.append(CartLine(retired.id, 1, 200))
+        lines.append(CartLine(9999, 1, 100))
+        db.session.expunge_all()
+
+        statements, stop = count_queries(app)
+        try:
+            cart = hydrate_cart(lines)
+        finally:
+            stop()
+
+        assert len(statements) == 1
+        assert [line.toy_id for line in cart.lines] == [toy.id for toy in reversed(toys)]
+        assert cart.missing == [retired.id, 9999]
+        assert cart.count == 12
+        assert cart.subtotal == pytest.approx(18.0)
+        assert cart.lines[0].total == pytest.approx(3.0)
+        assert cart.lines[0].toy.name == toys[-1].name
+
+
+def test_order_lines_joins_toy_names(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        first, second = Toy.query.order_by(Toy.id).limit(2).all()
+        order = Order(user_id=buyer.id, total_price=7.0)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all([
+            OrderItem(order_id=order.id, toy_id=first.id, quantity=2, price=1.0),
+            OrderItem(order_id=order.id, toy_id=second.id, quantity=1, price=2.5),
+        ])
+        db.session.commit()
+
+        lines = order_lines(order.id)
+        assert [(line.name, line.quantity, line.subtotal) for line in lines] == [
+            (first.name, 2, 2.0),
+            (second.name, 1, 2.5),
+        ]
@@ -0,0 +1,134 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import CartItem, CartTotal, Toy, User
+from app.utils.cart_store import CartStore, MemoryCartBackend, SQLCartBackend, get_cart_store
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+    CART_STORE_BACKEND = 'sql'
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        buyer = User(username='buyer', email='buyer@example.com', balance=100.0)
+        buyer.set_password('password')
+        db.session.add(buyer)
+        db.session.add_all([
+            Toy(name='Pelota', description='Roja', price=5.0, category='Deportes', stock=3),
+            Toy(name='Yoyo', description='Clásico', price=2.5, category='Clásicos', stock=10),
+        ])
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+
+@pytest.mark.parametrize('backend', [MemoryCartBackend, SQLCartBackend])
+def test_store_increments_and_keeps_running_total(app, backend):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        pelota, yoyo = Toy.query.order_by(Toy.id).all()
+        store = CartStore(backend())
+
+        assert store.add(buyer.id, pelota.id, 2, 5.0, max_quantity=3) == 2
+        assert store.add(buyer.id, pelota.id, 1, 5.0, max_quantity=3) == 3
+        # El tope de stock se aplica sobre la cantidad acumulada
+        assert store.add(buyer.id, pelota.id, 1, 5.0, max_quantity=3) is None
+        assert store.add(buyer.id, yoyo.id, 2, 2.5) == 2
+
+        summary = store.summary(buyer.id)
+        assert summary.count == 5
+        assert summary.total == pytest.approx(20.0)
+
+        assert store.set_quantity(buyer.id, yoyo.id, 1)
+        assert store.summary(buyer.id).total == pytest.approx(17.5)
+        assert store.remove(buyer.id, pelota.id)
+        assert not store.remove(buyer.id, pelota.id)
+        assert [(line.toy_id, line.quantity) for line in store.lines(buyer.id)] == [(yoyo.id, 1)]
+
+        store.clear(buyer.id)
+        assert store.summary(buyer.id).count == 0
+        assert store.lines(buyer.id) == []
+
+
+def test_sql_backend_persists_rows(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        yoyo = Toy.query.filter_by(name='Yoyo').first()
+        store = CartStore(SQLCartBackend())
+
+        store.add(buyer.id, yoyo.id, 4, 2.5)
+        item = db.session.get(CartItem, (buyer.id, yoyo.id))
+        total = db.session.get(CartTotal, buyer.id)
+        assert item.quantity == 4 and item.unit_price_cents == 250
+        assert total.item_count == 4 and total.total_cents == 1000
+
+
+def test_add_to_cart_route_updates_badge(app, client):
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        pelota_id = Toy.query.filter_by(name='Pelota').first().id
+    login(client, buyer_id)
+
+    resp = client.post('/add_to_cart', data={'toy_id': pelota_id, 'quantity': 2},
+                       headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert resp.get_json() == {'success': True, 'message': 'Pelota agregado al carrito', 'cart_count': 2}
+
+    resp = client.post('/add_to_cart', data={'toy_id': pelota_id, 'quantity': 2},
+                       headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert resp.status_code == 400
+    assert not resp.get_json()['success']
+
+    with app.app_context():
+        assert get_cart_store().summary(buyer_id).count == 2
+
+    resp = client.get('/cart')
+    assert resp.status_code == 200
+    assert 'Pelota' in resp.get_data(as_text=True)
+
+
+def test_legacy_session_cart_is_migrated(app, client):
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        yoyo_id = Toy.query.filter_by(name='Yoyo').first().id
+    login(client, buyer_id)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(yoyo_id): {'quantity': 3, 'price': 2.5}}
+
+    client.get('/cart')
+
+    with client.session_transaction() as sess:
+        assert 'cart' not in sess
+    with app.app_context():
+        summary = get_cart_store().summary(buyer_id)
+        assert summary.count == 3
+        assert summary.total == pytest.approx(7.5)
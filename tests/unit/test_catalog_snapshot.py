@@ -0,0 +1,113 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Toy, ToyCenterAvailability, User
+from app.utils.catalog import get_catalog_snapshot, invalidate_catalog
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        student = User(username='student', email='student@example.com', center='north-hub')
+        student.set_password('password')
+        db.session.add_all([admin, student])
+
+        toys = [
+            Toy(name='Global Toy', description='All centers', price=10.0, category='General', stock=5),
+            Toy(name='North Toy', description='North only', price=12.0, category='General', stock=3),
+            Toy(name='South Toy', description='South only', price=8.0, category='Peluches', stock=3),
+            Toy(name='Retired Toy', description='Inactive', price=5.0, category='General', stock=1, is_active=False),
+        ]
+        db.session.add_all(toys)
+        db.session.flush()
+        toys[1].centers.append(ToyCenterAvailability(center='north-hub'))
+        toys[2].centers.append(ToyCenterAvailability(center='south-hub'))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def login_as(client, user_id):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+
+def test_snapshot_filters_by_center_and_skips_inactive(app):
+    with app.app_context():
+        snapshot = get_catalog_snapshot()
+
+        names = {toy.name for toy in snapshot.filter(center='North-Hub')}
+        assert names == {'Global Toy', 'North Toy'}
+        assert 'Retired Toy' not in {toy.name for toy in snapshot.toys}
+        assert snapshot.categories == ['General', 'Peluches']
+
+        by_price = snapshot.sort(snapshot.filter(), 'price_asc')
+        assert [toy.name for toy in by_price] == ['South Toy', 'Global Toy', 'North Toy']
+
+
+def test_snapshot_is_reused_until_invalidated(app):
+    with app.app_context():
+        first = get_catalog_snapshot()
+        assert get_catalog_snapshot() is first
+
+        toy = Toy.query.filter_by(name='Global Toy').first()
+        toy.stock = 0
+        db.session.commit()
+        assert get_catalog_snapshot().by_id[toy.id].stock == 5
+
+        invalidate_catalog()
+        refreshed = get_catalog_snapshot()
+        assert refreshed is not first
+        assert refreshed.by_id[toy.id].stock == 0
+
+
+def test_index_lists_toys_for_student_center(client):
+    login_as(client, 2)
+    response = client.get('/index')
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'Global Toy' in html
+    assert 'North Toy' in html
+    assert 'South Toy' not in html
+
+
+def test_stock_update_invalidates_snapshot(client, app):
+    login_as(client, 1)
+    with app.app_context():
+        toy_id = Toy.query.filter_by(name='Global Toy').first().id
+        assert get_catalog_snapshot().by_id[toy_id].stock == 5
+
+    response = client.post(f'/admin/toys/{toy_id}/stock', json={'delta': -2})
+    assert response.get_json()['stock'] == 3
+
+    with app.app_context():
+        assert get_catalog_snapshot().by_id[toy_id].stock == 3
@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Center, User
+from app.utils.centers import get_center_registry, invalidate_centers
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.add(Center(slug='north-hub', name='North Hub', discount_percentage=5.0))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def test_registry_is_cached_until_invalidated(app):
+    with app.app_context():
+        first = get_center_registry()
+        assert [center.slug for center in first.centers] == ['north-hub']
+        assert first.by_slug == {'north-hub': 'North Hub'}
+
+        db.session.add(Center(slug='south-hub', name='South Hub'))
+        db.session.commit()
+        assert get_center_registry() is first
+
+        invalidate_centers()
+        assert set(get_center_registry().by_slug) == {'north-hub', 'south-hub'}
+
+
+def test_templates_get_centers_without_queries(client, app):
+    client.get('/')  # Carga inicial del registro
+
+    statements = []
+
+    def count(*_args):
+        statements.append(1)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        with app.test_request_context('/'):
+            processors = app.template_context_processors[None]
+            context = {}
+            for processor in processors:
+                context.update(processor())
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    assert context['centers_by_slug'] == {'north-hub': 'North Hub'}
+    assert statements == []
+
+
+def test_creating_center_from_admin_refreshes_registry(client, app):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+        get_center_registry()
+
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+
+    client.post('/admin/centers', data={'action': 'create', 'name': 'East Hub', 'discount_percentage': '10'})
+
+    with app.app_context():
+        assert get_center_registry().by_slug.get('east-hub') == 'East Hub'
@@ -0,0 +1,194 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, Toy, ToyPopularity, User
+from app.utils.cart_hydration import hydrate_cart
+from app.utils.cart_store import CartLine, get_cart_store
+from app.utils.checkout import CheckoutError, place_order
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+    CART_STORE_BACKEND = 'sql'
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        buyer = User(username='buyer', email='buyer@example.com', balance=20.0)
+        buyer.set_password('password')
+        db.session.add(buyer)
+        db.session.add_all([
+            Toy(name='Pelota', description='Roja', price=5.0, category='Deportes', stock=2),
+            Toy(name='Yoyo', description='Clásico', price=3.0, category='Clásicos', stock=1),
+            Toy(name='Cometa', description='Azul', price=1.0, category='Aire libre', stock=10),
+        ])
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+def _lines(*pairs):
+    toys = {toy.name: toy for toy in Toy.query.all()}
+    return hydrate_cart([CartLine(toys[name].id, qty, int(toys[name].price * 100)) for name, qty in pairs]).lines
+
+
+def test_place_order_decrements_stock_and_balance(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        lines = _lines(('Pelota', 2), ('Cometa', 3))
+
+        order = place_order(buyer.id, lines, subtotal=13.0, total=13.0)
+        db.session.commit()
+
+        stock = {toy.name: toy.stock for toy in Toy.query.all()}
+        assert stock == {'Pelota': 0, 'Yoyo': 1, 'Cometa': 7}
+        assert db.session.get(User, buyer.id).balance == pytest.approx(7.0)
+        assert len(order.items) == 2
+        assert sum(row.total_sold for row in ToyPopularity.query.all()) == 5
+
+
+def test_place_order_reports_every_failed_line(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        lines = _lines(('Pelota', 3), ('Yoyo', 2), ('Cometa', 1))
+
+        with pytest.raises(CheckoutError) as excinfo:
+            place_order(buyer.id, lines, subtotal=22.0, total=22.0)
+        db.session.rollback()
+
+        assert excinfo.value.reason == 'stock'
+        assert [(f.name, f.requested, f.available) for f in excinfo.value.failures] == [
+            ('Pelota', 3, 2),
+            ('Yoyo', 2, 1),
+        ]
+        assert {toy.name: toy.stock for toy in Toy.query.all()} == {'Pelota': 2, 'Yoyo': 1, 'Cometa': 10}
+        assert Order.query.count() == 0
+
+
+def test_place_order_refuses_insufficient_balance(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        lines = _lines(('Cometa', 3))
+
+        with pytest.raises(CheckoutError) as excinfo:
+            place_order(buyer.id, lines, subtotal=25.0, total=25.0)
+        db.session.rollback()
+
+        assert excinfo.value.reason == 'balance'
+        assert Toy.query.filter_by(name='Cometa').first().stock == 10
+        assert db.session.get(User, buyer.id).balance == pytest.approx(20.0)
+
+
+def test_checkout_route_flashes_failed_lines(app):
+    client = app.test_client()
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        get_cart_store().add(buyer_id, pelota.id, 2, pelota.price)
+        # Otro pedido se llevó el stock entre agregar al carrito y pagar
+        pelota.stock = 1
+        db.session.commit()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(buyer_id)
+        sess['_fresh'] = True
+
+    resp = client.post('/checkout')
+    assert resp.status_code == 302
+    with client.session_transaction() as sess:
+        messages = [message for _, message in sess.get('_flashes', [])]
+    assert messages == ['Error al procesar la compra: Stock insuficiente para Pelota. Disponible: 1, Solicitado: 2']
+    with app.app_context():
+        assert Order.query.count() == 0
+        assert get_cart_store().summary(buyer_id).count == 2
+
+
+def test_checkout_succeeds_when_cart_clear_fails(app, monkeypatch):
+    client = app.test_client()
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        store = get_cart_store()
+        store.add(buyer_id, pelota.id, 1, pelota.price)
+
+    calls = []
+
+    def broken_clear(user_id):
+        calls.append(user_id)
+        raise RuntimeError('backend caído')
+
+    monkeypatch.setattr(store, 'clear', broken_clear)
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(buyer_id)
+        sess['_fresh'] = True
+
+    resp = client.post('/checkout')
+    with app.app_context():
+        order = Order.query.one()
+    assert resp.status_code == 302
+    assert resp.headers['Location'].endswith(f'/order/{order.id}')
+    assert calls == [buyer_id]
+    with client.session_transaction() as sess:
+        assert not sess.get('_flashes')
+        assert sess['last_order_id'] == order.id
+
+
+def test_deactivated_toy_is_dropped_and_checkout_continues(app):
+    client = app.test_client()
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        yoyo = Toy.query.filter_by(name='Yoyo').first()
+        store = get_cart_store()
+        store.add(buyer_id, pelota.id, 1, pelota.price)
+        store.add(buyer_id, yoyo.id, 1, yoyo.price)
+        yoyo.is_active = False
+        db.session.commit()
+        yoyo_id = yoyo.id
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(buyer_id)
+        sess['_fresh'] = True
+
+    resp = client.post('/checkout')
+    assert resp.status_code == 302
+    with client.session_transaction() as sess:
+        messages = [message for _, message in sess.get('_flashes', [])]
+    assert messages == ['Se quitó del carrito un juguete que ya no está disponible']
+    with app.app_context():
+        order = Order.query.one()
+        assert len(order.items) == 1 and order.items[0].toy_id != yoyo_id
+        assert order.total_price == pytest.approx(5.0)
+        assert get_cart_store().lines(buyer_id) == []
+
+
+def test_view_cart_removes_unavailable_toys(app):
+    client = app.test_client()
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        yoyo = Toy.query.filter_by(name='Yoyo').first()
+        get_cart_store().add(buyer_id, yoyo.id, 1, yoyo.price)
+        yoyo.is_active = False
+        db.session.commit()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(buyer_id)
+        sess['_fresh'] = True
+
+    assert client.get('/cart').status_code == 200
+    with app.app_context():
+        assert get_cart_store().summary(buyer_id).count == 0
@@ -0,0 +1,143 @@
+import csv
+import gzip
+import io
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, ToyCenterAvailability, User
+from app.utils.exports import ExportFilters, csv_chunks, csv_response, order_rows
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        ana = User(username='ana', email='ana@example.com', center='norte')
+        ana.set_password('password')
+        beto = User(username='beto', email='beto@example.com', center='sur')
+        beto.set_password('password')
+        pelota = Toy(name='Pelota', price=5.0, stock=10, category='Deportes')
+        cometa = Toy(name='Cometa', price=2.5, stock=4, category='Aire libre', is_active=False)
+        db.session.add_all([admin, ana, beto, pelota, cometa])
+        db.session.flush()
+        db.session.add(ToyCenterAvailability(toy_id=pelota.id, center='norte'))
+        orders = [
+            (ana, datetime(2024, 12, 31, 23, 30), 'completada', [(pelota, 2), (cometa, 1)]),
+            (beto, datetime(2025, 1, 1, 10, 0), 'completada', [(pelota, 3)]),
+            (ana, datetime(2025, 1, 15, 12, 0), 'cancelled', [(cometa, 4)]),
+        ]
+        for user, when, status, items in orders:
+            order = Order(user_id=user.id, order_date=when, status=status,
+                          total_price=sum(toy.price * qty for toy, qty in items))
+            db.session.add(order)
+            for toy, qty in items:
+                db.session.add(OrderItem(order=order, toy_id=toy.id, quantity=qty, price=toy.price))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+    return client
+
+
+def _rows(data):
+    return list(csv.reader(io.StringIO(data)))
+
+
+def test_order_rows_use_one_query_and_filters(app):
+    with app.app_context():
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            rows = list(order_rows())
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        assert len(statements) == 1
+        assert [(row[2], row[5]) for row in rows] == [('ana', 4), ('beto', 3), ('ana', 3)]
+
+        filters = ExportFilters.from_args({'start': '2025-01-01', 'end': '2025-01-31', 'status': 'completada'})
+        assert [row[1] for row in order_rows(filters)] == ['2025-01-01 10:00']
+        assert [row[2] for row in order_rows(ExportFilters(center='norte'))] == ['ana', 'ana']
+        assert filters.filename('ordenes') == 'ordenes_2025-01-01_2025-01-31_completada.csv'
+
+
+def test_filters_reject_bad_dates():
+    with pytest.raises(ValueError):
+        ExportFilters.from_args({'start': '2025-13-01'})
+    with pytest.raises(ValueError):
+        ExportFilters.from_args({'start': '2025-02-01', 'end': '2025-01-01'})
+
+
+def test_csv_chunks_split_rows():
+    chunks = list(csv_chunks(['a'], ([n] for n in range(5)), chunk_rows=2))
+    assert len(chunks) == 3
+    assert _rows(''.join(chunks)) == [['a'], ['0'], ['1'], ['2'], ['3'], ['4']]
+
+
+def test_export_orders_streams_csv(client):
+    resp = client.get('/admin/export_orders?center=sur')
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="ordenes_sur.csv"'
+    assert _rows(resp.get_data(as_text=True)) == [
+        ['ID', 'Fecha', 'Usuario', 'Centro', 'Total', 'Items'],
+        ['2', '2025-01-01 10:00', 'beto', 'sur', '15.00', '3'],
+    ]
+
+
+def test_export_inventory_gzip_and_filters(client):
+    resp = client.get('/admin/export_inventory?gzip=1')
+    assert resp.mimetype == 'application/gzip'
+    assert resp.headers['Content-Disposition'].endswith('inventario.csv.gz"')
+    rows = _rows(gzip.decompress(resp.get_data()).decode('utf-8'))
+    assert [row[1] for row in rows[1:]] == ['Cometa', 'Pelota']
+
+    resp = client.get('/admin/export_inventory?status=active&center=norte')
+    assert [row[1] for row in _rows(resp.get_data(as_text=True))[1:]] == ['Pelota']
+
+    resp = client.get('/admin/export_inventory?status=raro')
+    assert resp.status_code == 302
+
+
+def test_export_filename_is_safe_for_the_header(client):
+    resp = client.get('/admin/export_orders', query_string={'status': 'x" ñandú'})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="ordenes_x_nandu.csv"'
+
+    resp = csv_response('órdenes.csv', ['a'], [])
+    assert resp.headers['Content-Disposition'] == (
+        "attachment; filename=\"ordenes.csv\"; filename*=UTF-8''%C3%B3rdenes.csv"
+    )
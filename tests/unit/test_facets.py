@@ -0,0 +1,78 @@
+import os
+import sys
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app.utils.catalog import CatalogToy
+from app.utils.facets import compute_facets
+
+
+def make_toy(toy_id, name, price, category, age_range=None, gender=None, stock=5, description=''):
+    return CatalogToy(
+        id=toy_id,
+        name=name,
+        description=description,
+        price=price,
+        image_url=None,
+        category=category,
+        age_range=age_range,
+        gender_category=gender,
+        stock=stock,
+        created_at=datetime(2024, 1, toy_id),
+    )
+
+
+TOYS = [
+    make_toy(1, 'Oso grande', 30.0, 'Peluches', '0-3', 'Unisex'),
+    make_toy(2, 'Oso chico', 8.0, 'Peluches', '0-3', 'Unisex', stock=0),
+    make_toy(3, 'Tren', 45.0, 'Vehículos', '4-7', 'Niño'),
+    make_toy(4, 'Muñeca', 20.0, 'Muñecas', '4-7', 'Niña'),
+]
+
+
+def counts(facet):
+    return {item['value']: item['count'] for item in facet}
+
+
+def test_counts_without_filters_cover_whole_catalog():
+    facets = compute_facets(TOYS)
+
+    assert counts(facets['categories']) == {'Muñecas': 1, 'Peluches': 2, 'Vehículos': 1}
+    assert counts(facets['age_ranges']) == {'0-3': 2, '4-7': 2}
+    assert [item['count'] for item in facets['price_ranges']] == [1, 1, 2, 0, 0]
+
+
+def test_facet_counts_exclude_only_their_own_filter():
+    facets = compute_facets(TOYS, {'category': 'Peluches', 'age_range': '4-7'})
+
+    # Categorías: conteos con age_range=4-7 aplicado, sin el filtro de categoría
+    assert counts(facets['categories']) == {'Muñecas': 1, 'Peluches': 0, 'Vehículos': 1}
+    # Edades: conteos con category=Peluches aplicado
+    assert counts(facets['age_ranges']) == {'0-3': 2, '4-7': 0}
+    # Resto de facetas: ningún juguete cumple ambos filtros
+    assert counts(facets['genders']) == {'Niña': 0, 'Niño': 0, 'Unisex': 0}
+    assert [item['value'] for item in facets['categories'] if item['active']] == ['Peluches']
+
+
+def test_text_stock_and_price_filters_restrict_counts():
+    facets = compute_facets(TOYS, {'in_stock': True, 'price_min': 10, 'price_max': 25}, text='oso')
+
+    assert counts(facets['categories']) == {'Muñecas': 0, 'Peluches': 0, 'Vehículos': 0}
+    # El precio no se aplica a su propia faceta
+    assert [item['count'] for item in facets['price_ranges']] == [0, 0, 1, 0, 0]
+    assert [item['label'] for item in facets['price_ranges'] if item['active']] == ['$10 - $25']
+
+    by_ids = compute_facets(TOYS, ids={3, 4})
+    assert counts(by_ids['categories']) == {'Muñecas': 1, 'Peluches': 0, 'Vehículos': 1}
+
+
+def test_price_bucket_counts_match_inclusive_price_filter():
+    toys = TOYS + [make_toy(5, 'Pelota', 25.0, 'Deportes'), make_toy(6, 'Dados', 10.0, 'Mesa')]
+    facets = compute_facets(toys)
+    assert [item['count'] for item in facets['price_ranges']] == [2, 3, 3, 0, 0]
+
+    selected = compute_facets(toys, {'price_min': 10, 'price_max': 25})
+    in_range = sum(1 for toy in toys if 10 <= toy.price <= 25)
+    assert sum(counts(selected['categories']).values()) == in_range == 3
+    assert [item['count'] for item in selected['price_ranges'] if item['active']] == [in_range]
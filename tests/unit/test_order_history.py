@@ -0,0 +1,132 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, inspect
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, User
+from app.utils.order_history import decode_cursor, encode_cursor, order_count, order_history
+from pagination_helpers import decode_cursor as decode_keyset, encode_cursor as encode_keyset
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        ana = User(username='ana', email='ana@example.com')
+        ana.set_password('password')
+        beto = User(username='beto', email='beto@example.com')
+        beto.set_password('password')
+        toy = Toy(name='Pelota', price=2.0, stock=100)
+        db.session.add_all([ana, beto, toy])
+        db.session.flush()
+        base = datetime(2025, 3, 1, 12, 0)
+        # 5 órdenes de ana (dos con la misma fecha) y una de beto
+        for offset, quantities in [(0, [1]), (1, [2, 3]), (1, []), (2, [4]), (3, [1, 1])]:
+            order = Order(user_id=ana.id, order_date=base + timedelta(days=offset),
+                          total_price=2.0 * sum(quantities))
+            db.session.add(order)
+            for qty in quantities:
+                db.session.add(OrderItem(order=order, toy_id=toy.id, quantity=qty, price=2.0))
+        db.session.add(Order(user_id=beto.id, order_date=base, total_price=1.0))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _user_id(username):
+    return User.query.filter_by(username=username).first().id
+
+
+@pytest.fixture()
+def client(app):
+    with app.app_context():
+        user_id = _user_id('ana')
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def test_composite_index_exists(app):
+    with app.app_context():
+        indexes = {index['name']: index['column_names'] for index in inspect(db.engine).get_indexes('order')}
+        assert indexes['ix_order_user_date'] == ['user_id', 'order_date']
+
+
+def test_cursor_round_trip():
+    moment = datetime(2025, 3, 2, 12, 0, 30)
+    assert decode_cursor(encode_cursor(moment, 7)) == (moment, 7)
+    with pytest.raises(ValueError):
+        decode_cursor('no-es-un-cursor')
+    # Mismo formato que los cursores del catálogo, pero no intercambiables
+    assert decode_keyset(encode_cursor(moment, 7), 'order_history') == (moment.isoformat(), 7)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_keyset('price_asc', (7.0, 12)))
+
+
+def test_pages_walk_orders_with_one_query_each(app):
+    with app.app_context():
+        user_id = _user_id('ana')
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            first = order_history(user_id, limit=2)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        assert len(statements) == 1
+
+        second = order_history(user_id, limit=2, cursor=first.next_cursor)
+        third = order_history(user_id, limit=2, cursor=second.next_cursor)
+
+        pages = [first, second, third]
+        seen = [order.id for page in pages for order in page.orders]
+        assert len(seen) == len(set(seen)) == 5
+        dates = [order.order_date for page in pages for order in page.orders]
+        assert dates == sorted(dates, reverse=True)
+        assert [order.item_count for order in first.orders] == [2, 4]
+        assert [order.item_count for order in second.orders] == [0, 5]
+        assert third.has_more is False and len(third.orders) == 1
+        assert order_count(user_id) == 5
+
+
+def test_profile_renders_first_page(app, client):
+    resp = client.get('/user/profile')
+    body = resp.get_data(as_text=True)
+    assert resp.status_code == 200
+    assert 'Mis Ordenes (5)' in body
+    assert 'id="load-more-orders"' not in body
+
+
+def test_orders_json_endpoint(client):
+    resp = client.get('/user/orders?limit=3')
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert [order['item_count'] for order in data['orders']] == [2, 4, 0]
+    assert data['has_more'] is True
+    assert data['orders'][0]['url'].endswith(f"/{data['orders'][0]['id']}")
+
+    rest = client.get(f"/user/orders?limit=3&cursor={data['next_cursor']}").get_json()
+    assert len(rest['orders']) == 2 and rest['has_more'] is False
+
+    assert client.get('/user/orders?cursor=@@@').status_code == 400
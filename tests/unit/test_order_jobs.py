@@ -0,0 +1,121 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, Toy, User
+from app.utils.cart_store import get_cart_store
+from app.utils.jobs import JobRunner, get_job_runner, order_summary_path
+from app.utils.receipts import get_receipt_renderer
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+    CART_STORE_BACKEND = 'sql'
+    ORDER_JOBS_MODE = 'eager'
+
+
+@pytest.fixture()
+def app(tmp_path):
+    class JobsConfig(TestConfig):
+        RECEIPT_CACHE_DIR = str(tmp_path / 'receipts')
+        ORDER_SUMMARY_DIR = str(tmp_path / 'orders')
+
+    app = create_app(JobsConfig)
+    with app.app_context():
+        db.create_all()
+
+        buyer = User(username='buyer', email='buyer@example.com', balance=50.0)
+        buyer.set_password('password')
+        db.session.add(buyer)
+        db.session.add(Toy(name='Pelota', description='Roja', price=5.0, category='Deportes', stock=10))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+def test_default_mode_is_off_when_testing():
+    class QuietConfig(TestConfig):
+        ORDER_JOBS_MODE = None
+
+    app = create_app(QuietConfig)
+    assert get_job_runner(app).mode == 'off'
+
+
+def test_thread_mode_runs_inside_app_context(app):
+    runner = JobRunner(app, 'thread')
+    try:
+        future = runner.submit(lambda: app.config['ORDER_SUMMARY_DIR'])
+        assert runner.mode == 'thread'
+        assert future.result(timeout=5) == app.config['ORDER_SUMMARY_DIR']
+    finally:
+        runner.shutdown()
+
+
+def test_checkout_renders_receipt_and_summary(app):
+    client = app.test_client()
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        get_cart_store().add(buyer_id, pelota.id, 2, pelota.price)
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(buyer_id)
+        sess['_fresh'] = True
+
+    resp = client.post('/checkout')
+    assert resp.status_code == 302
+
+    with app.app_context():
+        order = Order.query.one()
+        assert get_receipt_renderer().cached(order) is not None
+        with open(order_summary_path(app, order.id), encoding='utf-8') as fh:
+            assert 'Pelota x2' in fh.read()
+
+
+class _FakeQueue:
+    def __init__(self, ping_ok=True, enqueue_ok=True):
+        self.ping_ok, self.enqueue_ok = ping_ok, enqueue_ok
+        self.connection = self
+        self.jobs = []
+
+    def ping(self):
+        if not self.ping_ok:
+            raise ConnectionError('sin servidor')
+        return True
+
+    def enqueue(self, func, *args):
+        if not self.enqueue_ok:
+            raise ConnectionError('sin servidor')
+        self.jobs.append((func, args))
+        return 'job'
+
+
+def test_auto_mode_uses_threads_when_redis_does_not_answer(app, monkeypatch):
+    monkeypatch.setattr(app, 'task_queue', _FakeQueue(ping_ok=False), raising=False)
+    runner = JobRunner(app, 'auto')
+    assert runner.mode == 'thread'
+
+    monkeypatch.setattr(app, 'task_queue', _FakeQueue(), raising=False)
+    assert JobRunner(app, 'auto').mode == 'rq'
+
+
+def test_failed_enqueue_falls_back_to_thread_pool(app, monkeypatch):
+    monkeypatch.setattr(app, 'task_queue', _FakeQueue(enqueue_ok=False), raising=False)
+    runner = JobRunner(app, 'rq')
+    try:
+        assert runner.mode == 'rq'
+        future = runner.submit(lambda: 'hecho')
+        assert future.result(timeout=5) == 'hecho'
+    finally:
+        runner.shutdown()
@@ -0,0 +1,121 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, ToyPopularity, User
+from app.utils.popularity import popularity_for, rebuild_popularity, record_sales, revert_sales
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        buyer = User(username='buyer', email='buyer@example.com', balance=100.0)
+        buyer.set_password('password')
+        db.session.add_all([admin, buyer])
+        db.session.add_all([
+            Toy(name='Pelota', description='Roja', price=5.0, category='Deportes', stock=10),
+            Toy(name='Yoyo', description='Clásico', price=3.0, category='Clásicos', stock=10),
+        ])
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+
+def test_record_and_revert_sales_are_incremental(app):
+    with app.app_context():
+        pelota, yoyo = Toy.query.order_by(Toy.id).all()
+
+        record_sales({pelota.id: 2, yoyo.id: 1})
+        record_sales([(pelota.id, 3)])
+        db.session.commit()
+        assert popularity_for([pelota.id, yoyo.id]) == {pelota.id: 5, yoyo.id: 1}
+
+        revert_sales({pelota.id: 2})
+        db.session.commit()
+        assert popularity_for([pelota.id])[pelota.id] == 3
+
+
+def test_rebuild_matches_active_orders(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        active = Order(user_id=buyer.id, total_price=10.0, is_active=True)
+        cancelled = Order(user_id=buyer.id, total_price=5.0, is_active=False)
+        db.session.add_all([active, cancelled])
+        db.session.flush()
+        db.session.add_all([
+            OrderItem(order_id=active.id, toy_id=pelota.id, quantity=2, price=5.0),
+            OrderItem(order_id=cancelled.id, toy_id=pelota.id, quantity=7, price=5.0),
+        ])
+        db.session.commit()
+
+        assert rebuild_popularity() == 1
+        assert db.session.get(ToyPopularity, pelota.id).total_sold == 2
+
+
+def test_checkout_records_popularity(client, app):
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+        pelota_id = Toy.query.filter_by(name='Pelota').first().id
+
+    login(client, buyer_id)
+    with client.session_transaction() as sess:
+        sess['cart'] = {str(pelota_id): {'quantity': 3, 'price': 5.0, 'name': 'Pelota'}}
+    response = client.post('/checkout')
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert popularity_for([pelota_id])[pelota_id] == 3
+
+
+def test_delete_order_reverts_popularity(client, app):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+        buyer = User.query.filter_by(username='buyer').first()
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        order = Order(user_id=buyer.id, total_price=10.0, is_active=True)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, toy_id=pelota.id, quantity=2, price=5.0))
+        record_sales({pelota.id: 2})
+        db.session.commit()
+        order_id, pelota_id = order.id, pelota.id
+
+    login(client, admin_id)
+    response = client.post(f'/admin/orders/{order_id}/delete', headers={'Accept': 'application/json'})
+    assert response.get_json()['success'] is True
+
+    with app.app_context():
+        assert popularity_for([pelota_id])[pelota_id] == 0
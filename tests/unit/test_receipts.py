@@ -0,0 +1,100 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, User
+from app.utils import receipts
+from app.utils.receipts import get_receipt_assets, get_receipt_renderer, receipt_key
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app(tmp_path):
+    class ReceiptConfig(TestConfig):
+        RECEIPT_CACHE_DIR = str(tmp_path / 'receipts')
+
+    app = create_app(ReceiptConfig)
+    with app.app_context():
+        db.create_all()
+
+        buyer = User(username='buyer', email='buyer@example.com', balance=10.0)
+        buyer.set_password('password')
+        toy = Toy(name='Pelota', description='Roja', price=5.0, category='Deportes', stock=10)
+        db.session.add_all([buyer, toy])
+        db.session.flush()
+        order = Order(user_id=buyer.id, subtotal_price=5.0, discounted_total=5.0, total_price=5.0)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, toy_id=toy.id, quantity=1, price=5.0))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    with app.app_context():
+        buyer_id = User.query.filter_by(username='buyer').first().id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(buyer_id)
+        sess['_fresh'] = True
+    return client
+
+
+def test_assets_are_loaded_once(app):
+    with app.app_context():
+        assert get_receipt_assets() is get_receipt_assets()
+
+
+def test_download_is_cached_and_revalidated(app, client, monkeypatch):
+    with app.app_context():
+        order_id = Order.query.first().id
+
+    calls = []
+    render = receipts.render_receipt
+    monkeypatch.setattr(receipts, 'render_receipt', lambda order: calls.append(order.id) or render(order))
+
+    first = client.get(f'/order/{order_id}/pdf')
+    assert first.status_code == 200
+    assert first.mimetype == 'application/pdf'
+    assert first.data.startswith(b'%PDF')
+    etag = first.headers['ETag']
+
+    second = client.get(f'/order/{order_id}/pdf', headers={'If-None-Match': etag})
+    assert second.status_code == 304
+
+    third = client.get(f'/order/{order_id}/pdf')
+    assert third.status_code == 200
+    assert calls == [order_id]
+
+
+def test_order_update_changes_key_and_drops_old_file(app):
+    with app.app_context():
+        order = Order.query.first()
+        renderer = get_receipt_renderer()
+        old = renderer.get(order)
+
+        order.updated_at = datetime.now() + timedelta(seconds=1)
+        db.session.commit()
+        new = renderer.get(order)
+
+        assert new.etag == receipt_key(order) != old.etag
+        assert os.path.exists(new.path)
+        assert not os.path.exists(old.path)
@@ -0,0 +1,111 @@
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import SalesDailyToy, Toy
+from app.utils.restock import ForecastSettings, forecast_restock, inventory_stats, window_weights
+from inventory_system import get_inventory_manager
+
+TODAY = date(2025, 3, 12)
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        steady = Toy(name='Pelota', description='', price=5.0, category='Deportes', stock=10)
+        recent = Toy(name='Yoyo', description='', price=2.0, category='Clásicos', stock=4)
+        idle = Toy(name='Cometa', description='', price=1.0, category='Deportes', stock=1)
+        db.session.add_all([steady, recent, idle])
+        db.session.flush()
+        # Pelota: 1 unidad diaria los 30 días; Yoyo: 15 unidades en los últimos 3 días
+        db.session.add_all([
+            SalesDailyToy(day=TODAY - timedelta(days=n), toy_id=steady.id, quantity=1, amount_cents=500)
+            for n in range(30)
+        ])
+        db.session.add_all([
+            SalesDailyToy(day=TODAY - timedelta(days=n), toy_id=recent.id, quantity=5, amount_cents=1000)
+            for n in range(3)
+        ])
+        # Fuera de la ventana
+        db.session.add(SalesDailyToy(day=TODAY - timedelta(days=45), toy_id=idle.id, quantity=50, amount_cents=5000))
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+def test_weights_are_normalized_and_favor_recent_days():
+    flat = window_weights(30, 'mean', 7)
+    ewma = window_weights(30, 'ewma', 7)
+    assert sum(flat) == pytest.approx(1.0)
+    assert sum(ewma) == pytest.approx(1.0)
+    assert ewma[-1] == pytest.approx(2 * ewma[-8])
+    with pytest.raises(ValueError):
+        window_weights(30, 'median', 7)
+
+
+def test_forecast_in_one_query(app):
+    with app.app_context():
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            flat = {f.name: f for f in forecast_restock(30, ForecastSettings(method='mean'), today=TODAY)}
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert len(statements) == 1
+        assert flat['Pelota'].daily_rate == pytest.approx(1.0)
+        assert flat['Pelota'].coverage_days == 10.0
+        assert flat['Pelota'].needs_restock
+        assert flat['Pelota'].suggested_order_qty == 30
+        assert flat['Yoyo'].daily_rate == pytest.approx(0.5)
+        assert flat['Cometa'].units_sold == 0
+        assert not flat['Cometa'].needs_restock
+        assert flat['Cometa'].alert_level == 'CRÍTICO'
+        assert flat['Yoyo'].alert_level == 'BAJO'
+
+        ewma = {f.name: f for f in forecast_restock(30, ForecastSettings(method='ewma'), today=TODAY)}
+        assert ewma['Pelota'].daily_rate == pytest.approx(1.0)
+        assert ewma['Yoyo'].daily_rate > flat['Yoyo'].daily_rate
+        assert ewma['Yoyo'].urgency == 'ALTA'
+
+
+def test_inventory_stats_single_grouped_query(app):
+    with app.app_context():
+        stats = inventory_stats(low_threshold=5, critical_threshold=2)
+        assert stats['total_products'] == 3
+        assert stats['total_stock_units'] == 15
+        assert stats['total_inventory_value'] == pytest.approx(59.0)
+        assert stats['low_stock_count'] == 2
+        assert stats['critical_stock_count'] == 1
+        assert stats['categories_with_low_stock'] == {'Clásicos': 1, 'Deportes': 1}
+
+
+def test_inventory_manager_uses_forecast_settings(app):
+    app.config['INVENTORY_FORECAST_METHOD'] = 'mean'
+    with app.app_context():
+        manager = get_inventory_manager()
+        assert manager.forecast_settings().method == 'mean'
+        assert manager.forecast_settings(method='ewma').method == 'ewma'
+        assert manager.get_inventory_stats()['stock_health'] == 'CRÍTICO'
@@ -0,0 +1,148 @@
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, SalesDailyCategory, SalesDailyCenter, SalesDailyToy, Toy, User
+from app.utils.cart_hydration import hydrate_cart
+from app.utils.cart_store import CartLine
+from app.utils.checkout import place_order
+from app.utils.rollups import dashboard_totals, rollups_cli, verify_rollups
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        buyer = User(username='buyer', email='buyer@example.com', balance=100.0, center='norte')
+        buyer.set_password('password')
+        db.session.add_all([admin, buyer])
+        db.session.add_all([
+            Toy(name='Pelota', description='Roja', price=5.0, category='Deportes', stock=10),
+            Toy(name='Yoyo', description='Clásico', price=2.5, category='Clásicos', stock=10),
+        ])
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+def _buy(pairs, total):
+    buyer = User.query.filter_by(username='buyer').first()
+    toys = {toy.name: toy for toy in Toy.query.all()}
+    lines = hydrate_cart([CartLine(toys[name].id, qty, int(toys[name].price * 100)) for name, qty in pairs]).lines
+    order = place_order(buyer.id, lines, subtotal=total, total=total)
+    db.session.commit()
+    return order.id
+
+
+def test_checkout_updates_rollups(app):
+    with app.app_context():
+        _buy([('Pelota', 2), ('Yoyo', 1)], 12.5)
+        _buy([('Yoyo', 2)], 5.0)
+
+        today = date.today()
+        center = db.session.get(SalesDailyCenter, (today, 'norte'))
+        assert (center.order_count, center.amount_cents) == (2, 1750)
+        assert db.session.get(SalesDailyCategory, (today, 'Clásicos')).quantity == 3
+        yoyo = Toy.query.filter_by(name='Yoyo').first()
+        assert db.session.get(SalesDailyToy, (today, yoyo.id)).amount_cents == 750
+
+        totals = dashboard_totals()
+        assert totals['total_sales'] == 17.5
+        assert totals['total_orders'] == 2
+        assert totals['avg_order_value'] == 8.75
+        assert totals['sales_by_category'][0] == {'category': 'Deportes', 'quantity': 2, 'amount': 10.0}
+        assert verify_rollups() == []
+
+
+def test_delete_order_reverts_rollups(app):
+    with app.app_context():
+        order_id = _buy([('Pelota', 1)], 5.0)
+        admin_id = User.query.filter_by(username='admin').first().id
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+    resp = client.post(f'/admin/orders/{order_id}/delete', headers={'Accept': 'application/json'})
+    assert resp.get_json()['success']
+
+    with app.app_context():
+        assert dashboard_totals()['total_orders'] == 0
+        assert dashboard_totals()['sales_by_category'] == []
+        assert verify_rollups() == []
+
+
+def test_rebuild_and_verify_commands(app):
+    with app.app_context():
+        buyer = User.query.filter_by(username='buyer').first()
+        pelota = Toy.query.filter_by(name='Pelota').first()
+        # Orden histórica creada sin pasar por el checkout
+        order = Order(user_id=buyer.id, order_date=datetime(2024, 5, 1, 9), total_price=15.0)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, toy_id=pelota.id, quantity=3, price=5.0))
+        db.session.commit()
+        assert verify_rollups()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(rollups_cli, ['verify'])
+    assert result.exit_code == 1
+
+    result = runner.invoke(rollups_cli, ['rebuild'])
+    assert result.exit_code == 0
+    assert 'sales_daily_center: 1 filas' in result.output
+
+    result = runner.invoke(rollups_cli, ['verify'])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert db.session.get(SalesDailyCenter, (date(2024, 5, 1), 'norte')).amount_cents == 1500
+
+
+def test_recategorized_toy_and_moved_user_keep_original_buckets(app):
+    with app.app_context():
+        order_id = _buy([('Pelota', 2)], 10.0)
+        item = OrderItem.query.filter_by(order_id=order_id).one()
+        assert (item.category, db.session.get(Order, order_id).center) == ('Deportes', 'norte')
+
+        # Cambios posteriores a la venta
+        Toy.query.filter_by(name='Pelota').first().category = 'Exterior'
+        User.query.filter_by(username='buyer').first().center = 'sur'
+        db.session.commit()
+        assert verify_rollups() == []
+
+        admin_id = User.query.filter_by(username='admin').first().id
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+    assert client.post(f'/admin/orders/{order_id}/delete', headers={'Accept': 'application/json'}).get_json()['success']
+
+    with app.app_context():
+        today = date.today()
+        assert db.session.get(SalesDailyCategory, (today, 'Deportes')).amount_cents == 0
+        assert db.session.get(SalesDailyCategory, (today, 'Exterior')) is None
+        assert db.session.get(SalesDailyCenter, (today, 'norte')).order_count == 0
+        assert db.session.get(SalesDailyCenter, (today, 'sur')) is None
+        assert verify_rollups() == []
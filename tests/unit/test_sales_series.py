@@ -0,0 +1,135 @@
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Order, OrderItem, Toy, User
+from app.utils.sales import sales_series
+
+TODAY = date(2025, 3, 12)  # miércoles
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+def _order(user, toy, days_ago, amount, quantity=1, active=True, center=None):
+    when = datetime.combine(TODAY - timedelta(days=days_ago), datetime.min.time()) + timedelta(hours=10)
+    # Centro y categoría guardados como en el checkout
+    order = Order(user_id=user.id, order_date=when, total_price=amount, subtotal_price=amount,
+                  discount_center=center, center=center or user.center, is_active=active)
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, toy_id=toy.id, quantity=quantity, price=amount / quantity,
+                             category=toy.category))
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        buyer = User(username='buyer', email='buyer@example.com', center='norte')
+        buyer.set_password('password')
+        pelota = Toy(name='Pelota', description='', price=5.0, category='Deportes', stock=10)
+        yoyo = Toy(name='Yoyo', description='', price=3.0, category='Clásicos', stock=10)
+        db.session.add_all([admin, buyer, pelota, yoyo])
+        db.session.flush()
+
+        _order(buyer, pelota, 0, 10.0, quantity=2)
+        _order(buyer, yoyo, 0, 3.0, center='sur')
+        _order(buyer, pelota, 2, 5.0)
+        _order(buyer, pelota, 1, 50.0, active=False)
+        _order(buyer, yoyo, 20, 6.0, quantity=2)
+        _order(buyer, yoyo, 100, 99.0)
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+def test_daily_window_is_zero_filled_in_one_query(app):
+    with app.app_context():
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            data = sales_series(7, today=TODAY)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert len(statements) == 1
+        assert 'date(' not in statements[0].split('WHERE', 1)[1].split('GROUP BY')[0]
+        assert data['labels'][0] == '2025-03-06' and data['labels'][-1] == '2025-03-12'
+        assert data['series'] == {'total': [0.0, 0.0, 0.0, 0.0, 5.0, 0.0, 13.0]}
+        assert data['totals'] == {'total': 18.0}
+
+
+def test_weekly_and_monthly_buckets(app):
+    with app.app_context():
+        weekly = sales_series(30, 'week', today=TODAY)
+        assert weekly['labels'][-1] == '2025-03-10'
+        assert weekly['series']['total'][-1] == 18.0
+        assert weekly['totals']['total'] == 24.0
+
+        monthly = sales_series(90, 'month', today=TODAY)
+        assert monthly['labels'] == ['2024-12', '2025-01', '2025-02', '2025-03']
+        assert monthly['series']['total'] == [0.0, 0.0, 6.0, 18.0]
+
+
+def test_center_and_category_splits(app):
+    with app.app_context():
+        by_center = sales_series(7, split='center', today=TODAY)
+        assert by_center['totals'] == {'norte': 15.0, 'sur': 3.0}
+
+        by_category = sales_series(30, 'month', split='category', today=TODAY)
+        assert by_category['totals'] == {'Clásicos': 9.0, 'Deportes': 15.0}
+
+
+def test_invalid_window_is_rejected(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            sales_series(14)
+
+
+def test_sales_series_endpoint(app):
+    client = app.test_client()
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+
+    resp = client.get('/admin/api/sales_series?days=30&bucket=week')
+    body = resp.get_json()
+    assert resp.status_code == 200
+    assert body['success'] and body['bucket'] == 'week'
+    assert len(body['labels']) == len(body['series']['total'])
+
+    assert client.get('/admin/api/sales_series?days=5').status_code == 400
+
+
+def test_splits_keep_sale_time_category_and_center(app):
+    with app.app_context():
+        Toy.query.filter_by(name='Pelota').first().category = 'Exterior'
+        User.query.filter_by(username='buyer').first().center = 'este'
+        db.session.commit()
+
+        assert sales_series(7, split='center', today=TODAY)['totals'] == {'norte': 15.0, 'sur': 3.0}
+        by_category = sales_series(30, 'month', split='category', today=TODAY)
+        assert by_category['totals'] == {'Clásicos': 9.0, 'Deportes': 15.0}
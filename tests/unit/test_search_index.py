@@ -0,0 +1,102 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Toy, User
+from app.utils.search_index import (
+    build_match_query,
+    rebuild_search_index,
+    search_index_available,
+    search_toy_ids,
+)
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.add_all([
+            Toy(name='Muñecas de trapo', description='Hechas a mano', price=10.0, category='Muñecas', stock=4),
+            Toy(name='Camión de bomberos', description='Con luces y dos muñecas piloto', price=20.0, category='Vehículos', stock=2),
+            Toy(name='Rompecabezas', description='500 piezas', price=8.0, category='Juegos', stock=6),
+        ])
+        db.session.commit()
+        rebuild_search_index()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def login_as_admin(client):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = '1'
+        sess['_fresh'] = True
+
+
+def test_build_match_query_uses_prefix_terms():
+    assert build_match_query('Muñecas  rojas!') == '"Muñecas"* "rojas"*'
+    assert build_match_query('  ¿? ') is None
+
+
+def test_search_is_accent_insensitive_and_ranked(app):
+    with app.app_context():
+        if not search_index_available():
+            pytest.skip('SQLite sin soporte FTS5')
+
+        ids = search_toy_ids('munecas')
+        names = [db.session.get(Toy, toy_id).name for toy_id in ids]
+        # El nombre pesa más que la descripción en bm25
+        assert names[0] == 'Muñecas de trapo'
+        assert 'Camión de bomberos' in names
+        assert 'Rompecabezas' not in names
+
+        assert [db.session.get(Toy, toy_id).name for toy_id in search_toy_ids('vehiculos')] == ['Camión de bomberos']
+
+
+def test_soft_deleted_toy_leaves_the_index(client, app):
+    login_as_admin(client)
+    with app.app_context():
+        if not search_index_available():
+            pytest.skip('SQLite sin soporte FTS5')
+        toy_id = Toy.query.filter_by(name='Rompecabezas').first().id
+
+    response = client.post(f'/admin/delete_toy/{toy_id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.get_json()['success'] is True
+
+    with app.app_context():
+        assert search_toy_ids('rompecabezas') == []
+
+
+def test_basic_search_uses_index(client, app):
+    login_as_admin(client)
+    response = client.get('/search', query_string={'query': 'vehiculo'})
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'Camión de bomberos' in html
+    assert 'Rompecabezas' not in html
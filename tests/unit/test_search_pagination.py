@@ -0,0 +1,86 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Toy
+from app.utils.catalog import SORT_MODES, get_catalog_snapshot
+from pagination_helpers import decode_cursor, encode_cursor
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        # Precios repetidos para ejercitar el desempate por id
+        db.session.add_all([
+            Toy(name=f'Juguete {index:02d}', description='Demo', price=float(5 + index % 4), category='General', stock=2)
+            for index in range(11)
+        ])
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def test_cursor_round_trip_and_rejects_other_sort():
+    token = encode_cursor('price_asc', (7.0, 12))
+    assert decode_cursor(token, 'price_asc') == (7.0, 12)
+    assert decode_cursor(token, 'name') is None
+    assert decode_cursor('no-es-un-cursor', 'name') is None
+
+
+@pytest.mark.parametrize('sort', SORT_MODES)
+def test_keyset_pages_cover_catalog_once_in_order(app, sort):
+    with app.app_context():
+        snapshot = get_catalog_snapshot()
+        expected = [toy.id for toy in snapshot.ordered(sort)[0]]
+
+        seen, after = [], None
+        while True:
+            items, after = snapshot.page_after(sort, after, 4)
+            seen.extend(toy.id for toy in items)
+            if after is None:
+                break
+
+        assert seen == expected
+        assert len(seen) == 11
+
+
+def test_search_page_endpoint_walks_cursors(client):
+    response = client.get('/search', query_string={'sort': 'price_desc', 'per_page': 5})
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert 'Cargar más' in html
+
+    url = '/search/page?sort=price_desc&per_page=5'
+    prices, pages = [], 0
+    while url:
+        data = client.get(url).get_json()
+        prices.extend(item['price'] for item in data['items'])
+        url = data['next_page_url']
+        pages += 1
+
+    assert pages == 3
+    assert prices == sorted(prices, reverse=True)
+    assert len(prices) == 11
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Toy, User
+from app.utils.catalog import invalidate_catalog
+from advanced_search import AdvancedSearchEngine, get_search_engine
+from inventory_system import get_inventory_manager
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.add_all([
+            Toy(name='Oso', description='Peluche', price=12.0, category='Peluches', age_range='0-3', stock=1),
+            Toy(name='Tren', description='De madera', price=30.0, category='Vehículos', stock=9),
+        ])
+        db.session.commit()
+
+        yield app
+
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+def test_search_engine_is_bound_once_per_app(app):
+    with app.app_context():
+        engine = get_search_engine()
+        assert get_search_engine() is engine
+        assert engine.app is app
+        assert isinstance(engine, AdvancedSearchEngine)
+
+    other = create_app(TestConfig)
+    assert get_search_engine(other) is not engine
+
+
+def test_facet_metadata_is_cached_until_catalog_changes(app):
+    with app.app_context():
+        engine = get_search_engine()
+        categories = engine._get_categories()
+        assert {c['value']: c['count'] for c in categories} == {'Peluches': 1, 'Vehículos': 1}
+        assert engine._get_categories() is categories
+        assert [o['value'] for o in engine.available_filters['age_range']['options']] == ['0-3']
+
+        db.session.add(Toy(name='Osa', description='Peluche', price=11.0, category='Peluches', stock=3))
+        db.session.commit()
+        assert engine._get_categories() is categories
+
+        invalidate_catalog()
+        refreshed = engine._get_categories()
+        assert {c['value']: c['count'] for c in refreshed} == {'Peluches': 2, 'Vehículos': 1}
+
+
+def test_inventory_alerts_use_app_bound_manager(client, app):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+        manager = get_inventory_manager()
+
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+
+    response = client.get('/admin/inventory/alerts')
+    assert response.status_code == 200
+    assert [alert['name'] for alert in response.get_json()['alerts']] == ['Oso']
+
+    with app.app_context():
+        assert get_inventory_manager() is manager
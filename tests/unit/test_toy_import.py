@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Center, Toy, ToyCenterAvailability, User
+from app.utils.search_index import rebuild_search_index, search_toy_ids
+from app.utils.toy_import import import_toys
+
+CSV = (
+    "name,description,price,stock,category,center\n"
+    "Pelota,Roja,5.0,10,Deportes,norte\n"
+    ",Sin nombre,1,1,Otro,\n"
+    "Yoyo,Clásico,abc,3,Clásicos,\n"
+    "Cometa,Azul,2.5,4,Aire libre,ALL\n"
+    "Trompo,Madera,1.25,-1,Clásicos,\n"
+    "Dados,Juego,3,6,Mesa,sur;desconocido\n"
+)
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app(tmp_path):
+    app = create_app(TestConfig)
+    app.instance_path = str(tmp_path)
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.add_all([
+            Center(slug='norte', name='Norte'),
+            Center(slug='sur', name='Sur'),
+        ])
+        db.session.commit()
+        rebuild_search_index()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+    return client
+
+
+def test_import_in_chunks_reports_row_errors(app):
+    with app.app_context():
+        result = import_toys(io.BytesIO(CSV.encode('utf-8')), {'norte', 'sur'}, chunk_size=2)
+
+        assert result.total_rows == 6
+        assert result.created == 3
+        assert [(error.line, error.name) for error in result.errors] == [(2, ''), (3, 'Yoyo'), (5, 'Trompo')]
+        assert 'precio inválido' in str(result.errors[1])
+
+        centers = {
+            (toy.name, row.center)
+            for toy, row in db.session.query(Toy, ToyCenterAvailability).join(ToyCenterAvailability)
+        }
+        assert centers == {('Pelota', 'norte'), ('Cometa', 'norte'), ('Cometa', 'sur'), ('Dados', 'sur')}
+        assert len(search_toy_ids('cometa')) == 1
+
+
+def test_dry_run_writes_nothing_and_reads_latin1(app):
+    with app.app_context():
+        data = "name,price,stock\nMuñeco,4,2\n".encode('latin-1')
+        result = import_toys(io.BytesIO(data), set(), dry_run=True)
+
+        assert result.dry_run and result.created == 0
+        assert [row.name for row in result.preview] == ['Muñeco']
+        assert Toy.query.count() == 0
+
+
+def test_direct_upload_route(app, client):
+    resp = client.post('/admin/bulk_upload_toys',
+                       data={'csv_file': (io.BytesIO(CSV.encode('utf-8')), 'toys.csv')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 302
+    with app.app_context():
+        assert Toy.query.count() == 3
+
+
+def test_preview_then_confirm_with_image(app, client):
+    resp = client.post('/admin/bulk_upload_toys',
+                       data={'csv_file': (io.BytesIO(CSV.encode('utf-8')), 'toys.csv'), 'dry_run': '1'},
+                       content_type='multipart/form-data')
+    body = resp.get_data(as_text=True)
+    assert resp.status_code == 200
+    assert 'Pelota' in body and 'Fila 3 (Yoyo)' in body
+    with app.app_context():
+        assert Toy.query.count() == 0
+
+    image = (io.BytesIO(b'\x89PNG fake'), 'cometa.png')
+    resp = client.post('/admin/bulk_upload_toys/confirm',
+                       data={'image_2': image},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 302
+    with app.app_context():
+        assert Toy.query.count() == 3
+        cometa = Toy.query.filter_by(name='Cometa').first()
+        assert cometa.image_url.endswith('cometa.png')
+        os.remove(os.path.join(app.static_folder, cometa.image_url))
+    assert not os.listdir(os.path.join(app.instance_path, 'imports'))
@@ -0,0 +1,185 @@
+import io
+import os
+import sys
+import time
+
+import pytest
+from sqlalchemy import event
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app import create_app, db
+from app.config import Config
+from app.models import Center, Toy, ToyCenterAvailability, User
+from app.utils.search_index import rebuild_search_index, search_toy_ids
+from app.utils.toy_import import normalize_toy_name, upsert_toys
+
+CENTERS = {'norte', 'sur'}
+
+CSV = (
+    "sku,name,description,price,stock,category,center\n"
+    "P-1,Pelota grande,,6.5,10,,norte;sur\n"
+    ",  COMETA ,,2.5,4,,\n"
+    ",Yoyo,Clásico,1.5,3,Clásicos,sur\n"
+    ",Trompo,,1.25,2,,\n"
+)
+
+
+class TestConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SECRET_KEY = 'test'
+    LOGIN_DISABLED = False
+
+
+@pytest.fixture()
+def app(tmp_path):
+    app = create_app(TestConfig)
+    app.instance_path = str(tmp_path)
+    with app.app_context():
+        db.create_all()
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        admin.set_password('password')
+        db.session.add(admin)
+        db.session.add_all([Center(slug='norte', name='Norte'), Center(slug='sur', name='Sur')])
+        pelota = Toy(sku='P-1', name='Pelota', description='Roja', price=5.0, stock=10, category='Deportes')
+        cometa = Toy(name='Cométa', description='Azul', price=2.5, stock=4, category='Aire libre')
+        dados = Toy(name='Dados', description='Juego', price=3.0, stock=6, category='Mesa')
+        trompo = Toy(name='Trompo', description='Madera', price=1.25, stock=2, category='Clásicos', is_active=False)
+        db.session.add_all([pelota, cometa, dados, trompo])
+        db.session.flush()
+        db.session.add_all([
+            ToyCenterAvailability(toy_id=pelota.id, center='norte'),
+            ToyCenterAvailability(toy_id=cometa.id, center='sur'),
+        ])
+        db.session.commit()
+        rebuild_search_index()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture()
+def client(app):
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').first().id
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+        sess['_fresh'] = True
+    return client
+
+
+def _centers(name):
+    toy = Toy.query.filter_by(name=name).one()
+    return {row.center for row in ToyCenterAvailability.query.filter_by(toy_id=toy.id)}
+
+
+def test_normalize_toy_name():
+    assert normalize_toy_name('  Cométa   Azul ') == 'cometa azul'
+    assert normalize_toy_name('MUÑECO') == normalize_toy_name('muneco')
+
+
+def test_dry_run_reports_diff_without_writing(app):
+    with app.app_context():
+        result = upsert_toys(io.BytesIO(CSV.encode('utf-8')), CENTERS, dry_run=True, deactivate_missing=True)
+
+        assert (result.created, result.updated, result.unchanged) == (1, 2, 1)
+        assert (result.missing, result.deactivated) == (1, 1)
+        assert result.changes[1].fields == ('name', 'price', 'centers')
+        assert result.changes[4].label == 'Cambia: reactivado'
+        assert result.changes[2].status == 'unchanged'
+        assert Toy.query.count() == 4
+        assert Toy.query.filter_by(sku='P-1').one().price == 5.0
+
+
+def test_upsert_writes_only_changed_rows(app):
+    with app.app_context():
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            result = upsert_toys(io.BytesIO(CSV.encode('utf-8')), CENTERS, deactivate_missing=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        assert (result.created, result.updated, result.unchanged, result.deactivated) == (1, 2, 1, 1)
+        toy_updates = [s for s in statements if s.startswith('UPDATE toy ')]
+        # Un executemany para los cambios y uno para desactivar
+        assert len(toy_updates) == 2
+
+        pelota = Toy.query.filter_by(sku='P-1').one()
+        assert (pelota.name, pelota.price, pelota.description, pelota.category) == ('Pelota grande', 6.5, 'Roja', 'Deportes')
+        assert _centers('Pelota grande') == {'norte', 'sur'}
+        assert _centers('Cométa') == {'sur'}
+        assert Toy.query.filter_by(name='Trompo').one().is_active is True
+        dados = Toy.query.filter_by(name='Dados').one()
+        assert dados.is_active is False and dados.deleted_at is not None
+        assert Toy.query.count() == 5
+        assert search_toy_ids('grande') == [pelota.id]
+        assert search_toy_ids('dados') == []
+
+        again = upsert_toys(io.BytesIO(CSV.encode('utf-8')), CENTERS)
+        assert (again.created, again.updated, again.unchanged) == (0, 0, 4)
+
+
+def test_row_errors_block_deactivation_and_duplicates_are_reported(app):
+    with app.app_context():
+        data = (
+            "name,price,stock\n"
+            "Pelota,5,10\n"
+            "pelota,5,11\n"
+            "Cometa,abc,4\n"
+        )
+        result = upsert_toys(io.BytesIO(data.encode('utf-8')), CENTERS, deactivate_missing=True)
+
+        assert [(error.line, error.name) for error in result.errors] == [(2, 'pelota'), (3, 'Cometa')]
+        assert 'repetida en el archivo (ver fila 1)' in str(result.errors[0])
+        assert result.deactivated == 0 and result.missing == 2
+        assert Toy.query.filter_by(is_active=True).count() == 3
+
+
+def test_upsert_preview_then_confirm_route(app, client):
+    resp = client.post('/admin/bulk_upload_toys',
+                       data={'csv_file': (io.BytesIO(CSV.encode('utf-8')), 'toys.csv'),
+                             'dry_run': '1', 'mode': 'upsert'},
+                       content_type='multipart/form-data')
+    body = resp.get_data(as_text=True)
+    assert resp.status_code == 200
+    assert '1 nuevos, 2 con cambios, 1 sin cambios' in body
+    assert 'Cambia: nombre, precio, centros' in body
+
+    resp = client.post('/admin/bulk_upload_toys/confirm', data={}, content_type='multipart/form-data')
+    assert resp.status_code == 302
+    with app.app_context():
+        assert Toy.query.count() == 5
+        assert Toy.query.filter_by(sku='P-1').one().price == 6.5
+        assert Toy.query.filter_by(name='Dados').one().is_active is True
+
+
+def test_new_preview_discards_previous_and_stale_files(app, client):
+    folder = os.path.join(app.instance_path, 'imports')
+    os.makedirs(folder, exist_ok=True)
+    stale = os.path.join(folder, 'viejo.csv')
+    with open(stale, 'w') as fh:
+        fh.write(CSV)
+    old = time.time() - 2 * 24 * 3600
+    os.utime(stale, (old, old))
+
+    def preview():
+        client.post('/admin/bulk_upload_toys',
+                    data={'csv_file': (io.BytesIO(CSV.encode('utf-8')), 'toys.csv'),
+                          'dry_run': '1', 'mode': 'upsert'},
+                    content_type='multipart/form-data')
+        with client.session_transaction() as sess:
+            return sess['bulk_import_token']
+
+    first = preview()
+    assert not os.path.exists(stale)
+    second = preview()
+    assert second != first
+    assert os.listdir(folder) == [f'{second}.csv']